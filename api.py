@@ -1,24 +1,130 @@
+import asyncio
+import datetime
 import logging
+import math
 import os
 import tempfile
+import threading
+import zipfile
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Depends, Header, Query, Request
-from fastapi.responses import FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import shutil
-from eco_manager import ECO, MIN_PASSWORD_LENGTH
+from eco_manager import ECO, JOB_DONE, MAX_TOKENS_PER_USER, MIN_PASSWORD_LENGTH, TOKEN_TTL
+from blobstore import blob_store_from_env
+from ratelimit import EXPENSIVE_CLASSES, ROUTE_LIMITS, buckets_from_env, classify, client_key
+from storage import storage_from_env
+import downloads
+import profiler
+import static_assets
+import tracing
+from worker import run_worker
+from workflow import COMMENT_REQUIRED
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="ECO Manager API")
-
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Job worker threads started inside each API process; set to 0 when running
+# dedicated `python worker.py` processes instead.
+JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", 1))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    for _ in range(JOB_WORKER_THREADS):
+        threading.Thread(target=run_worker, args=(eco_system,), kwargs={"stop": stop}, daemon=True).start()
+    yield
+    stop.set()
+
+
+app = FastAPI(title="ECO Manager API", lifespan=lifespan)
+
+# Static files: the output of `python static_assets.py build` when present,
+# served precompressed with long-lived caching for fingerprinted names.
+app.mount("/static", static_assets.PrecompressedStaticFiles(directory=static_assets.static_dir_from_env()),
+          name="static")
+
+# Admission control for search, report and upload requests in this process:
+# at most MAX_EXPENSIVE_REQUESTS run at once, with up to ADMISSION_QUEUE_SIZE
+# more waiting up to ADMISSION_TIMEOUT seconds for a slot.
+MAX_EXPENSIVE_REQUESTS = int(os.environ.get("MAX_EXPENSIVE_REQUESTS", 4))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 16))
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", 2.0))
+
+rate_limit_buckets = buckets_from_env()
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._slots = None
+        self._loop = None
+        self._waiting = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots, self._loop = asyncio.Semaphore(MAX_EXPENSIVE_REQUESTS), loop
+        return self._slots
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        route_class = classify(request.method, request.url.path, bool(request.query_params.get("search")))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        if rate_limit_buckets is not None:
+            rate, burst = ROUTE_LIMITS[route_class]
+            user_id = None
+            token = request.headers.get("x-api-token")
+            # Logins and registrations are always limited per address
+            if token and route_class != "auth":
+                user = await run_in_threadpool(eco_system.get_user_from_token, token)
+                user_id = user["id"] if user else None
+                # Saves get_current_user a second lookup of the same token
+                scope.setdefault("state", {})["token_user"] = user
+            key = client_key(user_id, request.client.host if request.client else None)
+            # Shared buckets live in SQLite, so taking one may block on its lock
+            retry_after = await run_in_threadpool(rate_limit_buckets.take, f"{route_class}:{key}", rate, burst)
+            if retry_after:
+                response = JSONResponse({"detail": "Too many requests"}, status_code=429,
+                                        headers={"Retry-After": str(math.ceil(retry_after))})
+                await response(scope, receive, send)
+                return
+        if route_class not in EXPENSIVE_CLASSES:
+            await self.app(scope, receive, send)
+            return
+        # Fail fast when the queue is full rather than letting every request time out
+        slots = self._semaphore()
+        busy = JSONResponse({"detail": "Server busy"}, status_code=503, headers={"Retry-After": "1"})
+        if slots.locked() and self._waiting >= ADMISSION_QUEUE_SIZE:
+            await busy(scope, receive, send)
+            return
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), ADMISSION_TIMEOUT)
+        except asyncio.TimeoutError:
+            await busy(scope, receive, send)
+            return
+        finally:
+            self._waiting -= 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            slots.release()
+
+# Innermost, so CORS and security headers also apply to 429 and 503 responses
+app.add_middleware(RateLimitMiddleware)
 
 # CORS - configure via CORS_ORIGINS env var (comma-separated) for production
 cors_origins = os.environ.get("CORS_ORIGINS", "*").split(",")
@@ -30,22 +136,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        return response
+# The middlewares below are plain ASGI rather than BaseHTTPMiddleware, which
+# only passes http.response.body messages through and would break responses
+# that hand the server a file to send (downloads.ZeroCopyFileResponse).
+
+class SecurityHeadersMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Content-Type-Options"] = "nosniff"
+                headers["X-Frame-Options"] = "DENY"
+                headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
 
 app.add_middleware(SecurityHeadersMiddleware)
 
+# JSON responses at least this large are compressed when the client allows it
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+
+class CompressionMiddleware:
+    """Compresses API results: JSON bodies of known length that are not downloads.
+
+    Only those are buffered. Attachments and other files (which carry a
+    Content-Disposition), streamed bodies and precompressed static files pass
+    through untouched.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        accepted = set()
+        if scope["type"] == "http" and scope["method"] != "HEAD":
+            accepted = static_assets.accepted_encodings(Headers(scope=scope).get("accept-encoding"))
+        if not accepted & {"br", "gzip"}:
+            await self.app(scope, receive, send)
+            return
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (headers.get("content-type", "").startswith("application/json") and "content-length" in headers
+                        and "content-disposition" not in headers and "content-encoding" not in headers):
+                    start = message
+                    return
+            elif start is not None and message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                body, coding = b"".join(chunks), None
+                if len(body) >= COMPRESS_MIN_SIZE:
+                    coding, body = static_assets.compress(body, accepted)
+                headers = MutableHeaders(scope=start)
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                if coding:
+                    headers["Content-Encoding"] = coding
+                await send(start)
+                await send({"type": "http.response.body", "body": body})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware)
+
+class TracingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = tracing.request_id_from_header(Headers(scope=scope).get("x-request-id"))
+        trace, token = tracing.start_trace(request_id)
+
+        async def send_traced(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                if tracing.SERVER_TIMING:
+                    headers["Server-Timing"] = trace.server_timing()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            tracing.end_trace(token)
+
+# Outermost, so the trace covers every other middleware
+app.add_middleware(TracingMiddleware)
+
 MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))  # 10MB default
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 200))  # files per batch upload, counting archive contents
+
+ATTACHMENTS_DIR = os.environ.get("ATTACHMENTS_DIR", "attachments")
+# Re-hash attachments served from local storage before sending them
+VERIFY_DOWNLOADS = os.environ.get("VERIFY_DOWNLOADS", "0") == "1"
 
 eco_system = ECO(
-    db_path=os.environ.get("DATABASE_PATH", "eco_system.db"),
-    attachments_dir=os.environ.get("ATTACHMENTS_DIR", "attachments"),
+    storage=storage_from_env(),
+    attachments_dir=ATTACHMENTS_DIR,
+    blob_store=blob_store_from_env(ATTACHMENTS_DIR),
+    token_ttl=int(os.environ.get("TOKEN_TTL", TOKEN_TTL)),
+    max_tokens_per_user=int(os.environ.get("MAX_TOKENS_PER_USER", MAX_TOKENS_PER_USER)),
+    token_secret=os.environ.get("TOKEN_SECRET"),
 )
+if not os.environ.get("TOKEN_SECRET"):
+    logger.warning("TOKEN_SECRET is not set; API tokens are hashed without a server-side key")
 
 @app.get("/")
 def read_root():
@@ -95,9 +308,66 @@ class ECOItem(BaseModel):
     created_at: str
     created_by: str
 
+class ApproversUpdate(BaseModel):
+    approvers: List[str]
+    quorum: Optional[int] = None
+
+class PendingItem(ECOItem):
+    quorum: int
+    approvals: int
+
+class AuditEntry(BaseModel):
+    id: int
+    eco_id: Optional[int]
+    action: str
+    comment: Optional[str]
+    username: Optional[str]
+    performed_at: str
+
+class AuditPage(BaseModel):
+    entries: List[AuditEntry]
+    next_cursor: Optional[str]
+
+class ChangedAttachment(BaseModel):
+    filename: str
+    mime_type: Optional[str]
+    file_size: Optional[int]
+    sha256: Optional[str]
+    uploaded_at: str
+
+class ChangedECO(BaseModel):
+    id: int
+    title: str
+    description: str
+    status: str
+    version: int
+    created_at: str
+    created_by: str
+    updated_at: str
+    quorum: Optional[int]
+    approvals: int
+    rejections: int
+    attachments: List[ChangedAttachment]
+
+class Change(BaseModel):
+    seq: int
+    eco_id: int
+    deleted: bool
+    eco: Optional[ChangedECO]
+
+class ChangesPage(BaseModel):
+    changes: List[Change]
+    next_since: int
+    has_more: bool
+
 # Dependencies
-def get_current_user(x_api_token: str = Header(...)) -> User:
-    user_data = eco_system.get_user_from_token(x_api_token)
+_UNRESOLVED = object()
+
+def get_current_user(request: Request, x_api_token: str = Header(...)) -> User:
+    # RateLimitMiddleware has usually looked the token up already
+    user_data = getattr(request.state, "token_user", _UNRESOLVED)
+    if user_data is _UNRESOLVED:
+        user_data = eco_system.get_user_from_token(x_api_token)
     if not user_data:
         raise HTTPException(status_code=401, detail="Invalid API Token")
     return User(**user_data)
@@ -141,76 +411,212 @@ def create_eco(item: ECOCreate, user: User = Depends(get_current_user)):
     eco_id = eco_system.create_eco(item.title, item.description, user.username)
     return {"eco_id": eco_id, "message": "ECO created successfully"}
 
+# Lists and details carry an ETag derived from the audit log, so an unchanged
+# result is answered with 304 before running the query behind it. The tags
+# are weak because the same data may be sent with or without compression.
+VALIDATOR_HEADERS = {"Cache-Control": "private, no-cache"}
+
 @app.get("/ecos", response_model=List[ECOItem])
 def list_ecos(
+    request: Request,
+    response: Response,
     user: User = Depends(get_current_user),
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
     search: Optional[str] = Query(default=None),
     status: Optional[str] = Query(default=None),
+    count: bool = Query(default=False),
 ):
-    ecos = eco_system.list_ecos(limit=limit, offset=offset, search=search, status=status)
+    # Read the version first: if a change lands in between, the client sees
+    # the new version on its next window and refetches.
+    version = eco_system.list_version(username=user.username)
+    headers = {"ETag": f'W/"l{version}"', "X-List-Version": str(version), **VALIDATOR_HEADERS}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    if count:
+        response.headers["X-Total-Count"] = str(eco_system.count_ecos(search=search, status=status,
+                                                                      username=user.username))
+    ecos = eco_system.list_ecos(limit=limit, offset=offset, search=search, status=status,
+                                 username=user.username)
     return [{"id": r[0], "title": r[1], "status": r[2], "created_at": r[3], "created_by": r[4]} for r in ecos]
 
 @app.get("/ecos/{eco_id}")
-def get_eco(eco_id: int, user: User = Depends(get_current_user)):
-    details = eco_system.get_eco_details(eco_id)
+def get_eco(eco_id: int, request: Request, response: Response, user: User = Depends(get_current_user)):
+    version = eco_system.eco_version(eco_id, username=user.username)
+    if version is None:
+        raise HTTPException(status_code=404, detail="ECO not found")
+    headers = {"ETag": f'W/"e{version}"', **VALIDATOR_HEADERS}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    details = eco_system.get_eco_details(eco_id, username=user.username)
     if not details:
         raise HTTPException(status_code=404, detail="ECO not found")
+    response.headers.update(headers)
     return details
 
+# Writes to an ECO may carry its row version (the "version" field of its
+# details) as If-Match: "<version>". The write then only applies if nobody
+# changed the ECO in the meantime, and fails with 412 otherwise.
+def if_match_version(if_match: Optional[str] = Header(default=None)) -> Optional[int]:
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if len(tag) >= 2 and tag[0] == tag[-1] == '"':
+        tag = tag[1:-1]
+    if not tag.isdigit():
+        raise HTTPException(status_code=400, detail='If-Match must be an ECO version, e.g. "3"')
+    return int(tag)
+
+def write_failed(eco_id: int, expected_version: Optional[int], status_code: int, detail: str) -> HTTPException:
+    """The error for a failed write: 412 if it failed because the ECO changed since ``expected_version``."""
+    if expected_version is not None:
+        current = eco_system.current_version(eco_id)
+        if current is not None and current != expected_version:
+            return HTTPException(status_code=412, detail="ECO was changed by someone else; reload it and retry",
+                                 headers={"X-ECO-Version": str(current)})
+    return HTTPException(status_code=status_code, detail=detail)
+
 @app.put("/ecos/{eco_id}")
-def update_eco(eco_id: int, item: ECOCreate, admin: User = Depends(get_current_admin)):
-    success = eco_system.update_eco(eco_id, item.title, item.description, admin.username)
+def update_eco(eco_id: int, item: ECOCreate, admin: User = Depends(get_current_admin),
+               expected_version: Optional[int] = Depends(if_match_version)):
+    success = eco_system.update_eco(eco_id, item.title, item.description, admin.username,
+                                    expected_version=expected_version)
     if not success:
-        raise HTTPException(status_code=404, detail="ECO not found")
+        raise write_failed(eco_id, expected_version, 404, "ECO not found")
     return {"message": "ECO updated"}
 
 @app.delete("/ecos/{eco_id}")
-def delete_eco(eco_id: int, admin: User = Depends(get_current_admin)):
-    success = eco_system.delete_eco(eco_id)
+def delete_eco(eco_id: int, admin: User = Depends(get_current_admin),
+               expected_version: Optional[int] = Depends(if_match_version)):
+    success = eco_system.delete_eco(eco_id, admin.username, expected_version=expected_version)
     if not success:
-        raise HTTPException(status_code=404, detail="ECO not found")
+        raise write_failed(eco_id, expected_version, 404, "ECO not found")
     return {"message": "ECO deleted"}
 
 @app.post("/ecos/{eco_id}/submit")
-def submit_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user)):
-    success = eco_system.submit_eco(eco_id, user.username, action.comment)
+def submit_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user),
+               expected_version: Optional[int] = Depends(if_match_version)):
+    success = eco_system.submit_eco(eco_id, user.username, action.comment, expected_version=expected_version)
     if not success:
-         raise HTTPException(status_code=400, detail="Operation failed. Check ECO status or ID.")
+         raise write_failed(eco_id, expected_version, 400, "Operation failed. Check ECO status or ID.")
     return {"message": "ECO submitted"}
 
 @app.post("/ecos/{eco_id}/approve")
-def approve_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user)):
-    success = eco_system.approve_eco(eco_id, user.username, action.comment)
+def approve_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user),
+                expected_version: Optional[int] = Depends(if_match_version)):
+    success = eco_system.approve_eco(eco_id, user.username, action.comment, expected_version=expected_version)
     if not success:
-         raise HTTPException(status_code=400, detail="Operation failed. Check ECO status.")
-    return {"message": "ECO approved"}
+         raise write_failed(eco_id, expected_version, 400, "Operation failed. Check ECO status.")
+    return transition_result(eco_id, "approve")
 
 @app.post("/ecos/{eco_id}/reject")
-def reject_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user)):
+def reject_eco(eco_id: int, action: ECOAction, user: User = Depends(get_current_user),
+               expected_version: Optional[int] = Depends(if_match_version)):
     if not action.comment:
         raise HTTPException(status_code=400, detail="Comment required for rejection")
-    success = eco_system.reject_eco(eco_id, user.username, action.comment)
+    success = eco_system.reject_eco(eco_id, user.username, action.comment, expected_version=expected_version)
     if not success:
-         raise HTTPException(status_code=400, detail="Operation failed. Check ECO status.")
-    return {"message": "ECO rejected"}
+         raise write_failed(eco_id, expected_version, 400, "Operation failed. Check ECO status.")
+    return transition_result(eco_id, "reject")
+
+def transition_result(eco_id: int, action: str) -> dict:
+    # An approve or reject may only have been counted as a vote
+    target = eco_system.workflow.transitions[action].target
+    status = eco_system.current_status(eco_id)
+    if status != target:
+        return {"message": "Vote recorded; waiting for the other approvers", "status": status}
+    return {"message": f"ECO {target.lower()}", "status": target}
+
+@app.get("/workflow")
+def get_workflow(user: User = Depends(get_current_user)):
+    return eco_system.workflow.as_dict()
+
+@app.post("/ecos/{eco_id}/transitions/{action}")
+def transition_eco(eco_id: int, action: str, body: ECOAction, user: User = Depends(get_current_user),
+                   expected_version: Optional[int] = Depends(if_match_version)):
+    transition = eco_system.workflow.transitions.get(action)
+    if transition is None:
+        raise HTTPException(status_code=404, detail="Unknown workflow action")
+    if transition.comment == COMMENT_REQUIRED and not body.comment:
+        raise HTTPException(status_code=400, detail=f"Comment required to {transition.label.lower()}")
+    if not eco_system.transition(eco_id, action, user.username, body.comment, expected_version=expected_version):
+        raise write_failed(eco_id, expected_version, 400, "Operation failed. Check ECO status.")
+    return transition_result(eco_id, action)
+
+@app.put("/ecos/{eco_id}/approvers")
+def set_approvers(eco_id: int, body: ApproversUpdate, admin: User = Depends(get_current_admin)):
+    try:
+        success = eco_system.set_approvers(eco_id, body.approvers, admin.username, quorum=body.quorum)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not success:
+        raise HTTPException(status_code=400, detail="ECO not found or already approved")
+    return {"message": "Approvers updated"}
+
+@app.get("/me/pending", response_model=List[PendingItem])
+def pending_approvals(
+    user: User = Depends(get_current_user),
+    limit: int = Query(default=50, ge=1, le=200),
+    after: int = Query(default=0, ge=0, description="Return ECOs with ids above this one"),
+):
+    return eco_system.pending_approvals(user.username, limit=limit, after=after)
+
+def save_upload(file: UploadFile) -> str:
+    return save_stream(file.file)
+
+def save_stream(stream) -> str:
+    """Copy an upload or archive member to a temporary file in chunks, enforcing MAX_UPLOAD_SIZE as it goes."""
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        try:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE // (1024 * 1024)}MB",
+                    )
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name
+
+def expand_zip(path: str, tmp_paths: List[str]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """Extract the files in a zip archive one at a time; returns ``(filename, tmp_path, error)`` entries.
+
+    Members are decompressed as a stream and cut off at MAX_UPLOAD_SIZE, whatever
+    sizes the archive claims. Directories and macOS metadata are skipped.
+    Raises ``zipfile.BadZipFile`` if ``path`` is not a zip archive.
+    """
+    entries = []
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename.rsplit("/", 1)[-1]
+            if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if len(entries) >= MAX_BATCH_FILES:
+                raise HTTPException(status_code=413, detail=f"Too many files. Maximum is {MAX_BATCH_FILES}")
+            try:
+                with archive.open(info) as member:
+                    tmp_path = save_stream(member)
+            except HTTPException as e:
+                entries.append((name, None, e.detail))
+                continue
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError):
+                # Corrupt, encrypted or using an unsupported compression method
+                entries.append((name, None, "Could not extract file from archive"))
+                continue
+            tmp_paths.append(tmp_path)
+            entries.append((name, tmp_path, None))
+    return entries
 
 @app.post("/ecos/{eco_id}/attachments")
 def add_attachment(eco_id: int, file: UploadFile = File(...), user: User = Depends(get_current_user)):
-    # Read file content and enforce size limit
-    content = file.file.read()
-    if len(content) > MAX_UPLOAD_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Maximum size is {MAX_UPLOAD_SIZE // (1024 * 1024)}MB",
-        )
-
+    tmp_path = save_upload(file)
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-
         success = eco_system.add_attachment(eco_id, file.filename, tmp_path, user.username)
 
         if not success:
@@ -221,12 +627,76 @@ def add_attachment(eco_id: int, file: UploadFile = File(...), user: User = Depen
 
     return {"message": "Attachment added"}
 
+@app.post("/ecos/{eco_id}/attachments/batch")
+def add_attachments(
+    eco_id: int,
+    files: List[UploadFile] = File(...),
+    expand_archives: bool = Query(default=True, description="Attach the files inside .zip uploads instead"),
+    user: User = Depends(get_current_user),
+):
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files. Maximum is {MAX_BATCH_FILES}")
+    if eco_system.current_version(eco_id) is None:
+        raise HTTPException(status_code=404, detail="ECO not found")
+    entries: List[Tuple[str, Optional[str], Optional[str]]] = []
+    tmp_paths: List[str] = []
+    try:
+        for file in files:
+            try:
+                tmp_path = save_upload(file)
+            except HTTPException as e:
+                entries.append((file.filename, None, e.detail))
+                continue
+            tmp_paths.append(tmp_path)
+            if expand_archives and file.filename.lower().endswith(".zip"):
+                try:
+                    entries.extend(expand_zip(tmp_path, tmp_paths))
+                except zipfile.BadZipFile:
+                    entries.append((file.filename, None, "Not a valid zip archive"))
+            else:
+                entries.append((file.filename, tmp_path, None))
+            if len(entries) > MAX_BATCH_FILES:
+                raise HTTPException(status_code=413, detail=f"Too many files. Maximum is {MAX_BATCH_FILES}")
+        stored = iter(eco_system.add_attachments(
+            eco_id, [(name, path) for name, path, error in entries if error is None], user.username))
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    results = [next(stored) if error is None else {"filename": os.path.basename(name), "ok": False, "error": error}
+               for name, _, error in entries]
+    uploaded = sum(1 for r in results if r["ok"])
+    return {"uploaded": uploaded, "failed": len(results) - uploaded, "results": results}
+
 @app.get("/ecos/{eco_id}/attachments/{filename}")
 def get_attachment(eco_id: int, filename: str, user: User = Depends(get_current_user)):
+    # Blob stores that support it serve the bytes directly, bypassing this worker
+    url = eco_system.get_attachment_url(eco_id, filename)
+    if url:
+        return RedirectResponse(url, status_code=307)
     file_path = eco_system.get_attachment_path(eco_id, filename)
     if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Attachment not found")
-    return FileResponse(file_path, filename=filename)
+    if VERIFY_DOWNLOADS and eco_system.verify_attachment(eco_id, filename) is False:
+        raise HTTPException(status_code=500, detail="Attachment failed its integrity check")
+    return downloads.attachment_response(file_path, filename, str(eco_system.blob_store.root))
+
+@app.get("/ecos/{eco_id}/attachments/{filename}/preview")
+def get_attachment_preview(eco_id: int, filename: str, request: Request, user: User = Depends(get_current_user)):
+    preview = eco_system.get_attachment_preview(eco_id, filename)
+    if not preview:
+        raise HTTPException(status_code=404, detail="Preview not available")
+    # Previews are keyed by content hash, so the hash is a stable validator
+    etag = f'"{preview["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if preview['url']:
+        return RedirectResponse(preview['url'], status_code=307)
+    if not preview['file_path'] or not os.path.exists(preview['file_path']):
+        raise HTTPException(status_code=404, detail="Preview not available")
+    return FileResponse(preview['file_path'], media_type=preview['mime_type'], headers=headers)
 
 @app.get("/ecos/{eco_id}/report")
 def download_report(eco_id: int, background_tasks: BackgroundTasks, user: User = Depends(get_current_user)):
@@ -242,12 +712,101 @@ def download_report(eco_id: int, background_tasks: BackgroundTasks, user: User =
     background_tasks.add_task(os.remove, filename)
     return FileResponse(filename, filename=filename)
 
+@app.post("/ecos/{eco_id}/report/jobs", status_code=202)
+def queue_report(eco_id: int, user: User = Depends(get_current_user)):
+    if not eco_system.get_eco_details(eco_id):
+        raise HTTPException(status_code=404, detail="ECO not found")
+    job_id = eco_system.enqueue_job("generate_report", {"eco_id": eco_id}, username=user.username)
+    return {"job_id": job_id, "message": "Report queued"}
+
+def get_visible_job(job_id: int, user: User) -> dict:
+    job = eco_system.get_job(job_id)
+    if not job or (job['created_by'] != user.username and not user.is_admin):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, user: User = Depends(get_current_user)):
+    return get_visible_job(job_id, user)
+
+@app.get("/jobs/{job_id}/file")
+def get_job_file(job_id: int, user: User = Depends(get_current_user)):
+    job = get_visible_job(job_id, user)
+    result = job['result'] or {}
+    if job['status'] != JOB_DONE or not result.get('blob_key'):
+        raise HTTPException(status_code=404, detail="Job has no file")
+    url = eco_system.blob_store.presigned_url(result['blob_key'], result.get('filename'))
+    if url:
+        return RedirectResponse(url, status_code=307)
+    file_path = eco_system.blob_store.local_path(result['blob_key'])
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Job has no file")
+    return FileResponse(file_path, filename=result.get('filename'))
+
 # Admin Endpoints
 @app.get("/admin/users", response_model=List[User])
 def list_users(admin: User = Depends(get_current_admin)):
     users = eco_system.get_all_users()
     return [User(**u) for u in users]
 
+@app.get("/admin/tokens/stats")
+def token_stats(admin: User = Depends(get_current_admin)):
+    return eco_system.token_stats()
+
+@app.post("/admin/profile")
+async def profile_worker(
+    admin: User = Depends(get_current_admin),
+    seconds: float = Query(default=10, gt=0),
+    interval_ms: float = Query(default=profiler.DEFAULT_INTERVAL * 1000, gt=0),
+    scope: str = Query(default="app", pattern="^(app|all)$"),
+):
+    """Sample the process that serves this request; returns collapsed stacks for a flame graph."""
+    if not profiler.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    result = await run_in_threadpool(profiler.sample, seconds, interval_ms / 1000, scope)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A profile is already running in this process")
+    return Response(profiler.collapsed(result["stacks"]), media_type="text/plain", headers={
+        "X-Profile-PID": str(os.getpid()),
+        "X-Profile-Samples": str(result["samples"]),
+        "X-Profile-Seconds": str(result["seconds"]),
+        "X-Profile-Overhead": str(result["overhead"]),
+    })
+
+@app.get("/audit", response_model=AuditPage)
+def query_audit(
+    admin: User = Depends(get_current_admin),
+    user: Optional[str] = Query(default=None),
+    action: Optional[str] = Query(default=None),
+    eco_id: Optional[int] = Query(default=None),
+    since: Optional[str] = Query(default=None, description="ISO timestamp, inclusive"),
+    until: Optional[str] = Query(default=None, description="ISO timestamp, exclusive"),
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: Optional[str] = Query(default=None),
+):
+    try:
+        for value in (since, until):
+            if value is not None:
+                datetime.datetime.fromisoformat(value)
+        entries, next_cursor = eco_system.query_audit(
+            username=user, action=action, eco_id=eco_id, since=since, until=until, limit=limit, cursor=cursor,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid timestamp or cursor")
+    return {"entries": entries, "next_cursor": next_cursor}
+
+@app.get("/changes", response_model=ChangesPage)
+def list_changes(
+    user: User = Depends(get_current_user),
+    since: int = Query(default=0, ge=0, description="next_since from the previous page; 0 for everything"),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    return eco_system.changes_since(since, limit=limit)
+
+@app.get("/audit/verify")
+def verify_audit(admin: User = Depends(get_current_admin)):
+    return eco_system.verify_audit_chain()
+
 @app.delete("/admin/users/{user_id}")
 def delete_user(user_id: int, admin: User = Depends(get_current_admin)):
     if user_id == admin.id:
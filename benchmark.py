@@ -0,0 +1,118 @@
+"""Micro-benchmarks for hot paths in eco_manager.
+
+Usage: python benchmark.py <name> [options]
+"""
+import argparse
+import datetime
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import sys
+import tempfile
+import time
+
+
+def _report(label: str, seconds: float, ops: int) -> None:
+    print(f"{label:<32} {ops / seconds:>12,.0f} ops/s  {seconds / ops * 1e6:>8.2f} us/op")
+
+
+def bench_auth(args: argparse.Namespace) -> None:
+    """Token lookup: legacy raw TEXT primary key vs HMAC-SHA256 BLOB primary key."""
+    key = secrets.token_bytes(32)
+    tokens = [secrets.token_hex(32) for _ in range(args.tokens)]
+    probes = [secrets.choice(tokens) for _ in range(args.lookups)]
+
+    def hash_token(token: str) -> bytes:
+        return hmac.new(key, token.encode('utf-8'), hashlib.sha256).digest()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, is_admin INTEGER);
+            INSERT INTO users VALUES (1, 'bench', 0);
+            CREATE TABLE text_tokens (token TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires_at TEXT);
+            CREATE TABLE hashed_tokens (
+                token_hash BLOB PRIMARY KEY, user_id INTEGER NOT NULL, expires_at TEXT
+            ) WITHOUT ROWID;
+        """)
+        conn.executemany("INSERT INTO text_tokens VALUES (?, 1, '2999')", ((t,) for t in tokens))
+        conn.executemany("INSERT INTO hashed_tokens VALUES (?, 1, '2999')", ((hash_token(t),) for t in tokens))
+        conn.commit()
+
+        start = time.perf_counter()
+        for token in probes:
+            conn.execute("""
+                SELECT u.id, u.username, u.is_admin FROM text_tokens t JOIN users u ON t.user_id = u.id
+                WHERE t.token = ? AND t.expires_at > '2000'
+            """, (token,)).fetchone()
+        _report("text PK lookup", time.perf_counter() - start, len(probes))
+
+        start = time.perf_counter()
+        for token in probes:
+            conn.execute("""
+                SELECT u.id, u.username, u.is_admin FROM hashed_tokens t JOIN users u ON t.user_id = u.id
+                WHERE t.token_hash = ? AND t.expires_at > '2000'
+            """, (hash_token(token),)).fetchone()
+        _report("HMAC + BLOB PK lookup", time.perf_counter() - start, len(probes))
+        conn.close()
+
+
+def bench_transitions(args: argparse.Namespace) -> None:
+    """Workflow transitions: read-then-write per-action methods vs one conditional UPDATE."""
+    from eco_manager import ECO
+
+    def legacy_submit(eco: ECO, eco_id: int, username: str) -> bool:
+        # The submit_eco that predates the workflow engine
+        user_id = eco.get_or_create_user(username)
+        now = datetime.datetime.now().isoformat()
+        with eco._connect() as conn:
+            c = conn.cursor()
+            c.execute("SELECT status FROM ecos WHERE id = ? AND deleted_at IS NULL", (eco_id,))
+            row = c.fetchone()
+            if not row or row[0] != "DRAFT":
+                return False
+            c.execute("UPDATE ecos SET status = ?, updated_at = ? WHERE id = ?", ("SUBMITTED", now, eco_id))
+            eco._record_history(c, eco_id, "SUBMITTED", None, user_id, username, now)
+            conn.commit()
+            return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        eco = ECO(db_path=os.path.join(tmp, "bench.db"), attachments_dir=os.path.join(tmp, "att"))
+        eco_ids = [eco.create_eco(f"ECO {i}", "Desc", "bench") for i in range(2 * args.ecos)]
+        legacy_ids, engine_ids = eco_ids[:args.ecos], eco_ids[args.ecos:]
+
+        start = time.perf_counter()
+        assert all(legacy_submit(eco, eco_id, "bench") for eco_id in legacy_ids)
+        _report("read-then-write submit", time.perf_counter() - start, args.ecos)
+
+        start = time.perf_counter()
+        assert all(eco.transition(eco_id, "submit", "bench") for eco_id in engine_ids)
+        _report("conditional UPDATE transition", time.perf_counter() - start, args.ecos)
+
+        # Rejected attempts are where the single statement saves most
+        start = time.perf_counter()
+        assert not any(eco.transition(eco_id, "submit", "bench") for eco_id in engine_ids)
+        _report("rejected transition", time.perf_counter() - start, args.ecos)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="name", required=True)
+
+    auth = sub.add_parser("auth", help=bench_auth.__doc__)
+    auth.add_argument("--tokens", type=int, default=100_000, help="rows in the token table")
+    auth.add_argument("--lookups", type=int, default=50_000, help="lookups to time")
+    auth.set_defaults(func=bench_auth)
+
+    transitions = sub.add_parser("transitions", help=bench_transitions.__doc__)
+    transitions.add_argument("--ecos", type=int, default=2000, help="ECOs moved by each implementation")
+    transitions.set_defaults(func=bench_transitions)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
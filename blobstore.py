@@ -0,0 +1,227 @@
+"""Attachment blob stores.
+
+ECO keeps attachment metadata in the database and the file contents in a
+blob store, addressed by key. LocalBlobStore keeps files in a directory;
+S3BlobStore keeps them in an S3-compatible bucket (AWS, MinIO, ...) and hands
+out presigned URLs so downloads go straight to the bucket instead of through
+the API workers. S3 support needs boto3 (``pip install ecomanager[s3]``).
+
+``put_file`` returns the SHA-256 of what it stored. LocalBlobStore computes
+it while copying and moves the finished file into place with a rename, so a
+crash part way through a write never leaves a truncated blob under its key.
+"""
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+try:
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = None
+    BotoCoreError = ClientError = ()
+
+PRESIGNED_URL_TTL = 300  # seconds
+HASH_CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = ".partial"  # temporary files of writes in progress, named ".<key>.<random>.partial"
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalBlobStore:
+    """Blobs stored as files in a local directory."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / Path(key).name
+
+    def location(self, key: str) -> str:
+        return str(self._path(key))
+
+    def put_file(self, key: str, src_path: Path) -> str:
+        dest = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=f".{dest.name}.", suffix=PARTIAL_SUFFIX)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as out, open(src_path, "rb") as src:
+                for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, dest)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        self._fsync_root()
+        return digest.hexdigest()
+
+    def _fsync_root(self) -> None:
+        # Makes the rename itself durable; not possible on every platform
+        try:
+            fd = os.open(self.root, os.O_RDONLY)
+        except OSError:  # pragma: no cover - e.g. Windows
+            return
+        try:
+            os.fsync(fd)
+        except OSError:  # pragma: no cover
+            pass
+        finally:
+            os.close(fd)
+
+    def remove_partial_writes(self, older_than: float) -> int:
+        """Delete temporary files left by writes interrupted before ``older_than`` (a timestamp)."""
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".") and entry.name.endswith(PARTIAL_SUFFIX):
+                try:
+                    if entry.stat().st_mtime < older_than:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def local_path(self, key: str) -> Optional[str]:
+        return str(self._path(key))
+
+    @contextmanager
+    def local_file(self, key: str) -> Iterator[Path]:
+        yield self._path(key)
+
+    def iter_blobs(self, start_after: str = "") -> Iterator[Tuple[str, float]]:
+        """Yield (key, modification time) for every blob, in key order.
+
+        Dot-files (previews, partial writes) are not attachment blobs.
+        """
+        names = sorted(
+            entry.name for entry in os.scandir(self.root)
+            if entry.name > start_after and not entry.name.startswith(".") and entry.is_file()
+        )
+        for name in names:
+            try:
+                yield name, (self.root / name).stat().st_mtime
+            except FileNotFoundError:
+                continue  # Deleted since the scan
+
+    def presigned_url(self, key: str, filename: str, expires: int = PRESIGNED_URL_TTL) -> Optional[str]:
+        return None  # Served by the API process
+
+
+class S3BlobStore:
+    """Blobs stored in an S3-compatible bucket under an optional key prefix."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("S3 attachment storage requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._key(key)}"
+
+    def put_file(self, key: str, src_path: Path) -> str:
+        # S3 only makes an object visible once its upload completes, and
+        # upload_file switches to a multipart upload for large files
+        sha256 = file_sha256(src_path)
+        try:
+            self.client.upload_file(str(src_path), self.bucket, self._key(key))
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 upload of '{key}' failed: {e}") from e
+        return sha256
+
+    def delete(self, key: str) -> None:
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 delete of '{key}' failed: {e}") from e
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError:
+            return False
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None  # Not on this host; use presigned_url
+
+    @contextmanager
+    def local_file(self, key: str) -> Iterator[Path]:
+        fd, tmp_path = tempfile.mkstemp(suffix=Path(key).suffix)
+        os.close(fd)
+        try:
+            try:
+                self.client.download_file(self.bucket, self._key(key), tmp_path)
+            except (BotoCoreError, ClientError) as e:
+                raise OSError(f"S3 download of '{key}' failed: {e}") from e
+            yield Path(tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    def iter_blobs(self, start_after: str = "") -> Iterator[Tuple[str, float]]:
+        """Yield (key, modification time) for every blob, in key order.
+
+        Dot-keys (previews) are not attachment blobs.
+        """
+        params = {"Bucket": self.bucket, "Prefix": self.prefix}
+        if start_after:
+            params["StartAfter"] = self._key(start_after)
+        try:
+            # S3 lists keys in UTF-8 byte order, the same order SQLite sorts TEXT in
+            for page in self.client.get_paginator("list_objects_v2").paginate(**params):
+                for obj in page.get("Contents", []):
+                    key = obj["Key"][len(self.prefix):]
+                    if not key.startswith("."):
+                        yield key, obj["LastModified"].timestamp()
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 listing of '{self.bucket}' failed: {e}") from e
+
+    def presigned_url(self, key: str, filename: str, expires: int = PRESIGNED_URL_TTL) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(key),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+            },
+            ExpiresIn=expires,
+        )
+
+
+def blob_store_from_env(attachments_dir: str):
+    """Build the blob store selected by the ATTACHMENT_STORE environment variable."""
+    backend = os.environ.get("ATTACHMENT_STORE", "local")
+    if backend == "local":
+        return LocalBlobStore(Path(attachments_dir))
+    if backend == "s3":
+        return S3BlobStore(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+        )
+    raise ValueError(f"Unknown ATTACHMENT_STORE '{backend}'")
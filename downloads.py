@@ -0,0 +1,83 @@
+"""Sending attachment files.
+
+Behind nginx or Apache, set ATTACHMENT_OFFLOAD and the API only authorises a
+download: it answers with an ``X-Accel-Redirect`` or ``X-Sendfile`` header
+naming the file, and the proxy sends it with sendfile(2). A large download
+then costs the worker a few database queries instead of the whole transfer.
+
+Without a proxy the worker sends the file itself. If the ASGI server offers
+the ``http.response.zerocopysend`` extension the file descriptor is handed
+to the server, which sends it with ``os.sendfile``; otherwise the file is
+read in large chunks.
+
+Configuration (environment):
+    ATTACHMENT_OFFLOAD         "x-accel-redirect" (nginx) or "x-sendfile"
+                               (Apache mod_xsendfile, lighttpd); unset to
+                               send files from the worker
+    ATTACHMENT_OFFLOAD_PREFIX  internal nginx location that serves the
+                               attachments directory
+"""
+import os
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+OFFLOAD_MODES = ("", "x-accel-redirect", "x-sendfile")
+ATTACHMENT_OFFLOAD = os.environ.get("ATTACHMENT_OFFLOAD", "").lower()
+ATTACHMENT_OFFLOAD_PREFIX = os.environ.get("ATTACHMENT_OFFLOAD_PREFIX", "/internal/attachments/")
+CHUNK_SIZE = 1024 * 1024  # read size when the server cannot send the file itself
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+if ATTACHMENT_OFFLOAD not in OFFLOAD_MODES:
+    raise ValueError(f"Unknown ATTACHMENT_OFFLOAD '{ATTACHMENT_OFFLOAD}'")
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """FileResponse that lets the server sendfile() the whole file when it supports it.
+
+    Range requests and servers without the extension get the usual
+    FileResponse behaviour, with larger reads.
+    """
+
+    chunk_size = CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            ZEROCOPY_EXTENSION not in (scope.get("extensions") or {})
+            or scope["type"] != "http"
+            or scope["method"].upper() != "GET"
+            or self.status_code != 200
+            or "range" in Headers(scope=scope)
+        ):
+            await super().__call__(scope, receive, send)
+            return
+        with open(self.path, "rb") as f:
+            stat_result = os.fstat(f.fileno())
+            self.set_stat_headers(stat_result)
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({
+                "type": ZEROCOPY_EXTENSION,
+                "file": f,
+                "offset": 0,
+                "count": stat_result.st_size,
+                "more_body": False,
+            })
+        if self.background is not None:
+            await self.background()
+
+
+def attachment_response(path: str, filename: str, root: str) -> Response:
+    """Download response for the attachment file at ``path``, which lies under ``root``."""
+    response = ZeroCopyFileResponse(path, filename=filename)
+    if not ATTACHMENT_OFFLOAD:
+        return response
+    # The proxy sends the body but keeps these headers from the API's response
+    headers = {"Content-Disposition": response.headers["content-disposition"]}
+    if ATTACHMENT_OFFLOAD == "x-accel-redirect":
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        headers["X-Accel-Redirect"] = ATTACHMENT_OFFLOAD_PREFIX.rstrip("/") + "/" + quote(relative)
+    else:
+        headers["X-Sendfile"] = os.path.abspath(path)
+    return Response(media_type=response.media_type, headers=headers)
@@ -1,123 +1,930 @@
 import sqlite3
 import datetime
+import json
 import logging
 import mimetypes
 import os
-import shutil
-from typing import List, Optional, Tuple
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 import secrets
+import hashlib
+import hmac
 import bcrypt
 
+from blobstore import LocalBlobStore, file_sha256
+from previews import generate_preview
+from storage import TEXT_SEARCH_CONFIG, SQLiteStorage, Storage
+from tracing import trace_methods
+from workflow import APPROVE, COMMENT_REQUIRED, REJECT, TransitionRejected, Workflow, workflow_from_env
+
 logger = logging.getLogger(__name__)
 
-# Status constants
+# Statuses of the built-in workflow (see workflow.py)
 STATUS_DRAFT = "DRAFT"
 STATUS_SUBMITTED = "SUBMITTED"
 STATUS_APPROVED = "APPROVED"
 STATUS_REJECTED = "REJECTED"
 
+# Background job states
+JOB_PENDING = "PENDING"
+JOB_RUNNING = "RUNNING"
+JOB_DONE = "DONE"
+JOB_FAILED = "FAILED"
+
 MIN_PASSWORD_LENGTH = 8
 
+# Audit log entries that are not ECO status changes
+AUDIT_CREATED = "CREATED"
+AUDIT_EDITED = "EDITED"
+AUDIT_DELETED = "DELETED"
+AUDIT_ATTACHMENT_ADDED = "ATTACHMENT_ADDED"
+AUDIT_APPROVERS_SET = "APPROVERS_SET"
+AUDIT_VOTES = {APPROVE: "APPROVAL_VOTE", REJECT: "REJECTION_VOTE"}  # votes that did not decide the ECO
+AUDIT_GENESIS_HASH = bytes(32)  # prev_hash of the first entry
+AUDIT_PAGE_SIZE = 100
+AUDIT_VERIFY_BATCH_SIZE = 5000
+
+# Preview derivatives are blobs, one per content hash. Dot-keys are never
+# attachment blobs, so the attachment GC leaves them alone.
+PREVIEW_KEY_PREFIX = ".preview-"
+
+# API token lifetime. Tokens slide: each use pushes expiry out by TOKEN_TTL,
+# but last_used_at is only written once per TOKEN_TOUCH_INTERVAL per token.
+TOKEN_TTL = 7 * 24 * 3600  # seconds
+TOKEN_TOUCH_INTERVAL = 300  # seconds
+MAX_TOKENS_PER_USER = 10
+TOKEN_PURGE_BATCH_SIZE = 1000
+
+# Job queue. A claimed job is leased to one worker; if the worker dies the
+# lease runs out and another worker picks the job up again.
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30  # seconds, doubled after each failed attempt
+JOB_RETENTION = 7 * 24 * 3600  # seconds finished jobs are kept for their status and results
+JOB_PURGE_BATCH_SIZE = 1000
+
+# Schema migrations. The database records the last applied migration in
+# PRAGMA user_version; each entry below runs once, in order, inside a BEGIN
+# IMMEDIATE transaction, which data migrations using _run_in_batches commit
+# between batches. One process at a time runs them, holding the storage's
+# migration lock for the whole run. Append new migrations -- never edit old ones.
+MIGRATION_BATCH_SIZE = 1000
+PURGE_BATCH_SIZE = 500  # rows deleted per transaction when purging soft-deleted records
+MIGRATION_LOCK_TIMEOUT = 30.0
+MIGRATION_WAIT_TIMEOUT = 600.0  # seconds a worker waits for another to finish migrating
+
+PENDING_PAGE_SIZE = 50
+CHANGES_PAGE_SIZE = 100
+ATTACHMENT_WRITE_THREADS = 8  # files written to the blob store at once by add_attachments
+BLOB_DELETE_CLAIM_TIMEOUT = 60  # seconds the attachment GC has to delete the blobs it claimed
+BLOB_CLAIM_RETRY_DELAY = 0.05  # seconds an upload waits before checking again for the GC's claim on its key
+
+# Outcomes of an approve or reject on an ECO with named approvers
+_VOTE_NOT_REQUIRED = "not_required"  # no approvers, or not awaiting them: a plain transition
+_VOTE_REFUSED = "refused"
+_VOTE_COUNTED = "counted"
+_VOTE_DECIDED = "decided"
+
+
+def _run_in_batches(conn: sqlite3.Connection, sql: str, params: tuple = (), batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """Run a batch-limited data migration statement until it matches no rows.
+
+    ``sql`` must limit itself to one batch and take the batch size as its last
+    parameter, e.g. ``UPDATE t SET x = ... WHERE rowid IN (SELECT rowid FROM t
+    WHERE x IS NULL LIMIT ?)``. The write lock is released between batches so
+    live traffic can interleave. An interrupted migration is run again from the
+    start and resumes from the rows that are left, so the statement, and every
+    statement the migration runs after it, must be idempotent.
+    """
+    total = 0
+    while True:
+        count = conn.execute(sql, (*params, batch_size)).rowcount
+        total += count
+        if count < batch_size:
+            return total
+        conn.execute("COMMIT")
+        conn.execute("BEGIN IMMEDIATE")
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: List[Tuple[str, str]]) -> None:
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, definition in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _audit_hash(prev_hash: bytes, eco_id: Optional[int], action: str, comment: Optional[str],
+                performed_by: Optional[int], username: Optional[str], performed_at: str) -> bytes:
+    """Chain hash of an audit entry: changing or removing any entry breaks every later one."""
+    record = json.dumps([eco_id, action, comment, performed_by, username, performed_at], separators=(",", ":"))
+    return hashlib.sha256(prev_hash + record.encode("utf-8")).digest()
+
+
+def _migrate_1_initial_schema(conn: sqlite3.Connection) -> None:
+    for statement in [
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT,
+            is_admin INTEGER DEFAULT 0,
+            first_name TEXT,
+            last_name TEXT,
+            email TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS ecos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'DRAFT',
+            created_by INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS eco_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            eco_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            comment TEXT,
+            performed_by INTEGER NOT NULL,
+            performed_at TEXT NOT NULL,
+            FOREIGN KEY (eco_id) REFERENCES ecos(id),
+            FOREIGN KEY (performed_by) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            eco_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            uploaded_by INTEGER NOT NULL,
+            uploaded_at TEXT NOT NULL,
+            FOREIGN KEY (eco_id) REFERENCES ecos(id),
+            FOREIGN KEY (uploaded_by) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS api_tokens (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )""",
+    ]:
+        conn.execute(statement)
+    # Databases created before these columns existed
+    _add_missing_columns(conn, "users", [
+        ("password_hash", "TEXT"),
+        ("is_admin", "INTEGER DEFAULT 0"),
+        ("first_name", "TEXT"),
+        ("last_name", "TEXT"),
+        ("email", "TEXT"),
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ecos_status ON ecos(status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ecos_created_by ON ecos(created_by)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_eco_history_eco_id ON eco_history(eco_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attachments_eco_id ON attachments(eco_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_api_tokens_user_id ON api_tokens(user_id)")
+
+
+def _migrate_2_token_expiry(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "api_tokens", [("expires_at", "TEXT"), ("last_used_at", "TEXT")])
+    # Give existing tokens the default lifetime, counted from when they were issued
+    _run_in_batches(conn, f"""
+        UPDATE api_tokens SET expires_at = strftime('%Y-%m-%dT%H:%M:%f', created_at, '+{TOKEN_TTL:d} seconds')
+        WHERE token IN (SELECT token FROM api_tokens WHERE expires_at IS NULL LIMIT ?)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at)")
+
+
+def _plaintext_token_count(conn: sqlite3.Connection) -> int:
+    # Tokens stored before _migrate_3_hashed_tokens, which hashes them with the server key
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(api_tokens)")]
+    if "token" not in columns:
+        return 0
+    return conn.execute("SELECT COUNT(*) FROM api_tokens").fetchone()[0]
+
+
+def _migrate_3_hashed_tokens(conn: sqlite3.Connection) -> None:
+    # token_hash() is registered on the connection by ECO._apply_migrations
+    conn.execute("DELETE FROM api_tokens WHERE expires_at <= ?", (datetime.datetime.now().isoformat(),))
+    conn.execute("""
+        CREATE TABLE api_tokens_hashed (
+            token_hash BLOB PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            last_used_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO api_tokens_hashed (token_hash, user_id, created_at, expires_at, last_used_at)
+        SELECT token_hash(token), user_id, created_at, expires_at, last_used_at FROM api_tokens
+    """)
+    conn.execute("DROP TABLE api_tokens")
+    conn.execute("ALTER TABLE api_tokens_hashed RENAME TO api_tokens")
+    conn.execute("CREATE INDEX idx_api_tokens_user_id ON api_tokens(user_id)")
+    conn.execute("CREATE INDEX idx_api_tokens_expires_at ON api_tokens(expires_at)")
+
+
+def _migrate_4_jobs(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at TEXT NOT NULL,
+            locked_by TEXT,
+            lease_expires_at TEXT,
+            result TEXT,
+            last_error TEXT,
+            dedupe_key TEXT,
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    """)
+    conn.execute("CREATE INDEX idx_jobs_status_run_at ON jobs(status, run_at)")
+    # At most one queued or running job per dedupe key (e.g. periodic jobs)
+    conn.execute("""
+        CREATE UNIQUE INDEX idx_jobs_dedupe_key ON jobs(dedupe_key)
+        WHERE dedupe_key IS NOT NULL AND status IN ('PENDING', 'RUNNING')
+    """)
+
+
+def _migrate_5_attachment_previews(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "attachments", [("sha256", "TEXT")])
+    conn.execute("CREATE INDEX idx_attachments_sha256 ON attachments(sha256)")
+    conn.execute("""
+        CREATE TABLE attachment_previews (
+            sha256 TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+def _migrate_6_attachment_blob_keys(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "attachments", [("blob_key", "TEXT")])
+    # Attachments were always stored as {eco_id}_{filename} in attachments_dir
+    _run_in_batches(conn, """
+        UPDATE attachments SET blob_key = eco_id || '_' || filename
+        WHERE id IN (SELECT id FROM attachments WHERE blob_key IS NULL LIMIT ?)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attachments_blob_key ON attachments(blob_key)")
+
+
+def _migrate_7_read_routing(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "users", [("last_write_at", "TEXT")])
+    conn.execute("CREATE INDEX idx_ecos_created_at ON ecos(created_at)")
+
+
+def _migrate_8_attachment_gc(conn: sqlite3.Connection) -> None:
+    # Re-uploads used to add a row per upload, all pointing at the latest file
+    conn.execute("""
+        DELETE FROM attachments WHERE id NOT IN (SELECT MAX(id) FROM attachments GROUP BY eco_id, filename)
+    """)
+    conn.execute("CREATE UNIQUE INDEX idx_attachments_eco_filename ON attachments(eco_id, filename)")
+    # Progress of resumable maintenance tasks such as the attachment GC
+    conn.execute("""
+        CREATE TABLE maintenance_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+
+def _migrate_9_audit_log(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            eco_id INTEGER,
+            action TEXT NOT NULL,
+            comment TEXT,
+            performed_by INTEGER,
+            username TEXT,
+            performed_at TEXT NOT NULL,
+            prev_hash BLOB NOT NULL,
+            row_hash BLOB NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_audit_log_performed_by ON audit_log(performed_by, performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_action ON audit_log(action, performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_performed_at ON audit_log(performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_eco_id ON audit_log(eco_id)")
+    for operation in ("UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER audit_log_no_{operation.lower()} BEFORE {operation} ON audit_log
+            BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END
+        """)
+    _seed_audit_log(conn)
+
+
+def _seed_audit_log(conn) -> None:
+    # The history recorded so far, oldest first, chained like new entries
+    prev_hash = AUDIT_GENESIS_HASH
+    rows = conn.execute("""
+        SELECT h.eco_id, h.action, h.comment, h.performed_by, u.username, h.performed_at
+        FROM eco_history h LEFT JOIN users u ON h.performed_by = u.id
+        ORDER BY h.id
+    """)
+    while True:
+        batch = rows.fetchmany(MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        entries = []
+        for row in batch:
+            row_hash = _audit_hash(prev_hash, *row)
+            entries.append((*row, prev_hash, row_hash))
+            prev_hash = row_hash
+        conn.executemany("""
+            INSERT INTO audit_log (eco_id, action, comment, performed_by, username, performed_at, prev_hash, row_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, entries)
+
+
+def _migrate_10_soft_delete(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "ecos", [("deleted_at", "TEXT")])
+    _add_missing_columns(conn, "users", [("deleted_at", "TEXT")])
+    # Request paths only read live ECOs, so their indexes skip tombstones
+    conn.execute("DROP INDEX IF EXISTS idx_ecos_status")
+    conn.execute("DROP INDEX IF EXISTS idx_ecos_created_at")
+    conn.execute("CREATE INDEX idx_ecos_live_status ON ecos(status, created_at) WHERE deleted_at IS NULL")
+    conn.execute("CREATE INDEX idx_ecos_live_created_at ON ecos(created_at) WHERE deleted_at IS NULL")
+    conn.execute("CREATE INDEX idx_ecos_deleted_at ON ecos(deleted_at) WHERE deleted_at IS NOT NULL")
+    conn.execute("CREATE INDEX idx_users_deleted_at ON users(deleted_at) WHERE deleted_at IS NOT NULL")
+
+
+def _migrate_11_row_versions(conn: sqlite3.Connection) -> None:
+    # Bumped by every change to an ECO row, for optimistic concurrency (If-Match)
+    _add_missing_columns(conn, "ecos", [("version", "INTEGER NOT NULL DEFAULT 1")])
+
+
+def _migrate_12_approvers(conn: sqlite3.Connection) -> None:
+    # quorum is NULL for ECOs without named approvers; approvals and
+    # rejections count the votes cast in the current approval round
+    _add_missing_columns(conn, "ecos", [
+        ("quorum", "INTEGER"),
+        ("approvals", "INTEGER NOT NULL DEFAULT 0"),
+        ("rejections", "INTEGER NOT NULL DEFAULT 0"),
+    ])
+    conn.execute("""
+        CREATE TABLE eco_approvers (
+            eco_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            decision TEXT,
+            decided_at TEXT,
+            pending INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (eco_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # An approver's queue is a range of this index, however many ECOs there are
+    conn.execute("CREATE INDEX idx_eco_approvers_pending ON eco_approvers(user_id, eco_id) WHERE pending = 1")
+
+
+def _migrate_13_attachment_checks(conn: sqlite3.Connection) -> None:
+    # Set by the scrub and by verified downloads: when the blob last matched
+    # its sha256, and when it was found not to
+    _add_missing_columns(conn, "attachments", [("verified_at", "TEXT"), ("corrupt_at", "TEXT")])
+    conn.execute("CREATE INDEX idx_attachments_corrupt ON attachments(corrupt_at) WHERE corrupt_at IS NOT NULL")
+
+
+def _migrate_14_change_feed(conn: sqlite3.Connection) -> None:
+    # One entry per ECO, moved to the next seq by every change to it, so a sync
+    # from any seq sees each changed ECO once. Deleted ECOs keep theirs as a
+    # tombstone after they are purged.
+    conn.execute("""
+        CREATE TABLE eco_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            eco_id INTEGER NOT NULL UNIQUE,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        INSERT INTO eco_changes (eco_id, deleted)
+        SELECT id, deleted_at IS NOT NULL FROM ecos ORDER BY id
+    """)
+
+
+def _migrate_15_audit_by_username(conn: sqlite3.Connection) -> None:
+    # Audit queries filter on the username recorded with each entry, which
+    # outlives the user's row once a deleted user is purged
+    conn.execute("DROP INDEX IF EXISTS idx_audit_log_performed_by")
+    conn.execute("CREATE INDEX idx_audit_log_username ON audit_log(username, performed_at)")
+
+
+def _migrate_16_user_references(conn: sqlite3.Connection) -> None:
+    # purge_deleted checks every table that refers to a user before removing
+    # it; without these each check scans the whole table
+    conn.execute("CREATE INDEX idx_eco_history_performed_by ON eco_history(performed_by)")
+    conn.execute("CREATE INDEX idx_attachments_uploaded_by ON attachments(uploaded_by)")
+    conn.execute("CREATE INDEX idx_jobs_created_by ON jobs(created_by)")
+
+
+def _migrate_17_blob_uploads(conn: sqlite3.Connection) -> None:
+    # Blob keys being written by uploads whose attachment rows are not yet
+    # committed; the attachment GC never deletes a claimed key
+    conn.execute("""
+        CREATE TABLE blob_uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            blob_key TEXT NOT NULL,
+            started_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_blob_uploads_blob_key ON blob_uploads(blob_key)")
+    conn.execute("CREATE INDEX idx_blob_uploads_started_at ON blob_uploads(started_at)")
+
+
+def _migrate_18_preview_blob_keys(conn: sqlite3.Connection) -> None:
+    _add_missing_columns(conn, "attachment_previews", [("blob_key", "TEXT")])
+    _requeue_local_previews(conn)
+
+
+def _requeue_local_previews(conn) -> None:
+    # Previews used to be files on the disk of the worker that made them; make
+    # them again in the blob store, where every host can read them
+    now = datetime.datetime.now().isoformat()
+    conn.execute("""
+        INSERT INTO jobs (kind, payload, max_attempts, run_at, dedupe_key, created_at, updated_at)
+        SELECT 'attachment_preview', '{"sha256": "' || p.sha256 || '"}', ?, ?, 'preview:' || p.sha256, ?, ?
+        FROM attachment_previews p
+        WHERE p.blob_key IS NULL AND NOT EXISTS (
+            SELECT 1 FROM jobs j WHERE j.dedupe_key = 'preview:' || p.sha256 AND j.status IN (?, ?)
+        )
+    """, (JOB_MAX_ATTEMPTS, now, now, now, JOB_PENDING, JOB_RUNNING))
+    conn.execute("DELETE FROM attachment_previews WHERE blob_key IS NULL")
+
+
+def _migrate_19_blob_delete_claims(conn: sqlite3.Connection) -> None:
+    # Claims the attachment GC takes on keys it is about to delete
+    _add_missing_columns(conn, "blob_uploads", [("deleting", "INTEGER NOT NULL DEFAULT 0")])
+
+
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _migrate_1_initial_schema),
+    (2, _migrate_2_token_expiry),
+    (3, _migrate_3_hashed_tokens),
+    (4, _migrate_4_jobs),
+    (5, _migrate_5_attachment_previews),
+    (6, _migrate_6_attachment_blob_keys),
+    (7, _migrate_7_read_routing),
+    (8, _migrate_8_attachment_gc),
+    (9, _migrate_9_audit_log),
+    (10, _migrate_10_soft_delete),
+    (11, _migrate_11_row_versions),
+    (12, _migrate_12_approvers),
+    (13, _migrate_13_attachment_checks),
+    (14, _migrate_14_change_feed),
+    (15, _migrate_15_audit_by_username),
+    (16, _migrate_16_user_references),
+    (17, _migrate_17_blob_uploads),
+    (18, _migrate_18_preview_blob_keys),
+    (19, _migrate_19_blob_delete_claims),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# PostgreSQL has its own migrations, numbered like the SQLite ones they
+# match. Its databases start at version 5, the schema when PostgreSQL support
+# was added; every later SQLite migration needs a PostgreSQL counterpart.
+# Foreign keys are left out because SQLite never enforced them.
+
+def _postgres_text(statement: str) -> str:
+    # Text compares bytewise, as in SQLite, so key ranges sort the same as in Python
+    return re.sub(r"\bTEXT\b", 'TEXT COLLATE "C"', statement)
+
+
+def _pg_migrate_5_initial_schema(conn) -> None:
+    for statement in [
+        """CREATE TABLE users (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT,
+            is_admin INTEGER DEFAULT 0,
+            first_name TEXT,
+            last_name TEXT,
+            email TEXT
+        )""",
+        """CREATE TABLE ecos (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'DRAFT',
+            created_by BIGINT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE eco_history (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            eco_id BIGINT NOT NULL,
+            action TEXT NOT NULL,
+            comment TEXT,
+            performed_by BIGINT NOT NULL,
+            performed_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE attachments (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            eco_id BIGINT NOT NULL,
+            filename TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_size BIGINT NOT NULL,
+            uploaded_by BIGINT NOT NULL,
+            uploaded_at TEXT NOT NULL,
+            sha256 TEXT
+        )""",
+        """CREATE TABLE api_tokens (
+            token_hash BYTEA PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            created_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            last_used_at TEXT
+        )""",
+        """CREATE TABLE jobs (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at TEXT NOT NULL,
+            locked_by TEXT,
+            lease_expires_at TEXT,
+            result TEXT,
+            last_error TEXT,
+            dedupe_key TEXT,
+            created_by BIGINT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE attachment_previews (
+            sha256 TEXT PRIMARY KEY,
+            mime_type TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_size BIGINT NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+    ]:
+        conn.execute(_postgres_text(statement))
+    conn.execute("CREATE INDEX idx_ecos_status ON ecos(status)")
+    conn.execute("CREATE INDEX idx_ecos_created_by ON ecos(created_by)")
+    # Serves PostgresStorage.text_search over title and description
+    conn.execute(f"""
+        CREATE INDEX idx_ecos_search ON ecos
+        USING GIN (to_tsvector('{TEXT_SEARCH_CONFIG}', title || ' ' || description))
+    """)
+    conn.execute("CREATE INDEX idx_eco_history_eco_id ON eco_history(eco_id)")
+    conn.execute("CREATE INDEX idx_attachments_eco_id ON attachments(eco_id)")
+    conn.execute("CREATE INDEX idx_attachments_sha256 ON attachments(sha256)")
+    conn.execute("CREATE INDEX idx_api_tokens_user_id ON api_tokens(user_id)")
+    conn.execute("CREATE INDEX idx_api_tokens_expires_at ON api_tokens(expires_at)")
+    conn.execute("CREATE INDEX idx_jobs_status_run_at ON jobs(status, run_at)")
+    conn.execute("""
+        CREATE UNIQUE INDEX idx_jobs_dedupe_key ON jobs(dedupe_key)
+        WHERE dedupe_key IS NOT NULL AND status IN ('PENDING', 'RUNNING')
+    """)
+
+
+def _pg_migrate_6_attachment_blob_keys(conn) -> None:
+    conn.execute(_postgres_text("ALTER TABLE attachments ADD COLUMN blob_key TEXT"))
+    conn.execute("UPDATE attachments SET blob_key = eco_id || '_' || filename WHERE blob_key IS NULL")
+    conn.execute("CREATE INDEX idx_attachments_blob_key ON attachments(blob_key)")
+
+
+def _pg_migrate_7_read_routing(conn) -> None:
+    conn.execute(_postgres_text("ALTER TABLE users ADD COLUMN last_write_at TEXT"))
+    conn.execute("CREATE INDEX idx_ecos_created_at ON ecos(created_at)")
+
+
+def _pg_migrate_8_attachment_gc(conn) -> None:
+    conn.execute("""
+        DELETE FROM attachments WHERE id NOT IN (SELECT MAX(id) FROM attachments GROUP BY eco_id, filename)
+    """)
+    conn.execute("CREATE UNIQUE INDEX idx_attachments_eco_filename ON attachments(eco_id, filename)")
+    conn.execute(_postgres_text("""
+        CREATE TABLE maintenance_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """))
+
+
+def _pg_migrate_9_audit_log(conn) -> None:
+    conn.execute(_postgres_text("""
+        CREATE TABLE audit_log (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            eco_id BIGINT,
+            action TEXT NOT NULL,
+            comment TEXT,
+            performed_by BIGINT,
+            username TEXT,
+            performed_at TEXT NOT NULL,
+            prev_hash BYTEA NOT NULL,
+            row_hash BYTEA NOT NULL
+        )
+    """))
+    conn.execute("CREATE INDEX idx_audit_log_performed_by ON audit_log(performed_by, performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_action ON audit_log(action, performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_performed_at ON audit_log(performed_at)")
+    conn.execute("CREATE INDEX idx_audit_log_eco_id ON audit_log(eco_id)")
+    conn.execute("""
+        CREATE FUNCTION audit_log_append_only() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN RAISE EXCEPTION 'audit_log is append-only'; END
+        $$
+    """)
+    conn.execute("""
+        CREATE TRIGGER audit_log_no_change BEFORE UPDATE OR DELETE ON audit_log
+        FOR EACH ROW EXECUTE FUNCTION audit_log_append_only()
+    """)
+    _seed_audit_log(conn)
 
+
+def _pg_migrate_10_soft_delete(conn) -> None:
+    conn.execute(_postgres_text("ALTER TABLE ecos ADD COLUMN deleted_at TEXT"))
+    conn.execute(_postgres_text("ALTER TABLE users ADD COLUMN deleted_at TEXT"))
+    conn.execute("DROP INDEX IF EXISTS idx_ecos_status")
+    conn.execute("DROP INDEX IF EXISTS idx_ecos_created_at")
+    conn.execute("CREATE INDEX idx_ecos_live_status ON ecos(status, created_at) WHERE deleted_at IS NULL")
+    conn.execute("CREATE INDEX idx_ecos_live_created_at ON ecos(created_at) WHERE deleted_at IS NULL")
+    conn.execute("CREATE INDEX idx_ecos_deleted_at ON ecos(deleted_at) WHERE deleted_at IS NOT NULL")
+    conn.execute("CREATE INDEX idx_users_deleted_at ON users(deleted_at) WHERE deleted_at IS NOT NULL")
+
+
+def _pg_migrate_11_row_versions(conn) -> None:
+    conn.execute("ALTER TABLE ecos ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+def _pg_migrate_12_approvers(conn) -> None:
+    conn.execute("""
+        ALTER TABLE ecos ADD COLUMN quorum INTEGER,
+            ADD COLUMN approvals INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN rejections INTEGER NOT NULL DEFAULT 0
+    """)
+    conn.execute(_postgres_text("""
+        CREATE TABLE eco_approvers (
+            eco_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            decision TEXT,
+            decided_at TEXT,
+            pending INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (eco_id, user_id)
+        )
+    """))
+    conn.execute("CREATE INDEX idx_eco_approvers_pending ON eco_approvers(user_id, eco_id) WHERE pending = 1")
+
+
+def _pg_migrate_13_attachment_checks(conn) -> None:
+    conn.execute(_postgres_text("ALTER TABLE attachments ADD COLUMN verified_at TEXT, ADD COLUMN corrupt_at TEXT"))
+    conn.execute("CREATE INDEX idx_attachments_corrupt ON attachments(corrupt_at) WHERE corrupt_at IS NOT NULL")
+
+
+def _pg_migrate_14_change_feed(conn) -> None:
+    conn.execute("""
+        CREATE TABLE eco_changes (
+            seq BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            eco_id BIGINT NOT NULL UNIQUE,
+            deleted INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        INSERT INTO eco_changes (eco_id, deleted)
+        SELECT id, CASE WHEN deleted_at IS NOT NULL THEN 1 ELSE 0 END FROM ecos ORDER BY id
+    """)
+
+
+def _pg_migrate_15_audit_by_username(conn) -> None:
+    conn.execute("DROP INDEX IF EXISTS idx_audit_log_performed_by")
+    conn.execute("CREATE INDEX idx_audit_log_username ON audit_log(username, performed_at)")
+
+
+def _pg_migrate_16_user_references(conn) -> None:
+    conn.execute("CREATE INDEX idx_eco_history_performed_by ON eco_history(performed_by)")
+    conn.execute("CREATE INDEX idx_attachments_uploaded_by ON attachments(uploaded_by)")
+    conn.execute("CREATE INDEX idx_jobs_created_by ON jobs(created_by)")
+
+
+def _pg_migrate_17_blob_uploads(conn) -> None:
+    conn.execute(_postgres_text("""
+        CREATE TABLE blob_uploads (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            blob_key TEXT NOT NULL,
+            started_at TEXT NOT NULL
+        )
+    """))
+    conn.execute("CREATE INDEX idx_blob_uploads_blob_key ON blob_uploads(blob_key)")
+    conn.execute("CREATE INDEX idx_blob_uploads_started_at ON blob_uploads(started_at)")
+
+
+def _pg_migrate_18_preview_blob_keys(conn) -> None:
+    conn.execute(_postgres_text("ALTER TABLE attachment_previews ADD COLUMN blob_key TEXT"))
+    _requeue_local_previews(conn)
+
+
+def _pg_migrate_19_blob_delete_claims(conn) -> None:
+    conn.execute("ALTER TABLE blob_uploads ADD COLUMN deleting INTEGER NOT NULL DEFAULT 0")
+
+
+POSTGRES_MIGRATIONS: List[Tuple[int, Callable]] = [
+    (5, _pg_migrate_5_initial_schema),
+    (6, _pg_migrate_6_attachment_blob_keys),
+    (7, _pg_migrate_7_read_routing),
+    (8, _pg_migrate_8_attachment_gc),
+    (9, _pg_migrate_9_audit_log),
+    (10, _pg_migrate_10_soft_delete),
+    (11, _pg_migrate_11_row_versions),
+    (12, _pg_migrate_12_approvers),
+    (13, _pg_migrate_13_attachment_checks),
+    (14, _pg_migrate_14_change_feed),
+    (15, _pg_migrate_15_audit_by_username),
+    (16, _pg_migrate_16_user_references),
+    (17, _pg_migrate_17_blob_uploads),
+    (18, _pg_migrate_18_preview_blob_keys),
+    (19, _pg_migrate_19_blob_delete_claims),
+]
+
+
+@trace_methods
 class ECO:
-    def __init__(self, db_path: str = "eco_system.db", attachments_dir: str = "attachments"):
-        self.db_path = db_path
+    def __init__(
+        self,
+        db_path: str = "eco_system.db",
+        attachments_dir: str = "attachments",
+        token_ttl: int = TOKEN_TTL,
+        max_tokens_per_user: int = MAX_TOKENS_PER_USER,
+        token_secret: Optional[str] = None,
+        storage: Optional[Storage] = None,
+        blob_store: Optional[LocalBlobStore] = None,
+        workflow: Optional[Workflow] = None,
+    ):
+        self.storage = storage or SQLiteStorage(db_path)
+        self.workflow = workflow or workflow_from_env()
+        self.db_path = self.storage.path
+        self.token_ttl = token_ttl
+        self.max_tokens_per_user = max_tokens_per_user
+        self._token_key = (token_secret or "").encode('utf-8')
         self.attachments_dir = Path(attachments_dir).resolve()
         self.attachments_dir.mkdir(exist_ok=True)
+        self.blob_store = blob_store or LocalBlobStore(self.attachments_dir)
         self._init_db()
 
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        return self.storage.connect(**kwargs)
+
+    def _connect_read(self, username: Optional[str] = None) -> sqlite3.Connection:
+        """Connection for read-only queries, routed by the storage backend.
+
+        Passing the acting ``username`` guarantees the user sees their own writes.
+        """
+        fresh_since = None
+        if username and self.storage.replica_path:
+            with self._connect() as conn:
+                row = conn.execute("SELECT last_write_at FROM users WHERE username = ?", (username,)).fetchone()
+            if row and row[0]:
+                fresh_since = datetime.datetime.fromisoformat(row[0])
+        return self.storage.connect_read(fresh_since)
+
+    def _note_write(self, c: sqlite3.Cursor, user_id: int, now: str) -> None:
+        # Lets reads by this user skip replicas that predate the write
+        c.execute("UPDATE users SET last_write_at = ? WHERE id = ?", (now, user_id))
+
+    def _append_audit(self, c: sqlite3.Cursor, eco_id: Optional[int], action: str, comment: Optional[str],
+                      user_id: Optional[int], username: Optional[str], now: str) -> None:
+        # Must run after the transaction's first write, so the write lock
+        # serializes appenders and the chain cannot fork.
+        c.execute("SELECT row_hash FROM audit_log ORDER BY id DESC LIMIT 1")
+        row = c.fetchone()
+        prev_hash = row[0] if row else AUDIT_GENESIS_HASH
+        c.execute("""
+            INSERT INTO audit_log (eco_id, action, comment, performed_by, username, performed_at, prev_hash, row_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (eco_id, action, comment, user_id, username, now, prev_hash,
+              _audit_hash(prev_hash, eco_id, action, comment, user_id, username, now)))
+
+    def _record_change(self, c: sqlite3.Cursor, eco_id: int, deleted: bool = False) -> None:
+        # Replacing the ECO's entry gives it the next seq. Writers hold the
+        # write lock from their first write to commit, so seqs become visible
+        # in order and a reader never skips past an uncommitted one.
+        c.execute("DELETE FROM eco_changes WHERE eco_id = ?", (eco_id,))
+        c.execute("INSERT INTO eco_changes (eco_id, deleted) VALUES (?, ?)", (eco_id, int(deleted)))
+
+    def _record_history(self, c: sqlite3.Cursor, eco_id: int, action: str, comment: Optional[str],
+                        user_id: int, username: str, now: str) -> None:
+        c.execute("""
+            INSERT INTO eco_history (eco_id, action, comment, performed_by, performed_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (eco_id, action, comment, user_id, now))
+        self._append_audit(c, eco_id, action, comment, user_id, username, now)
+        self._note_write(c, user_id, now)
+        self._record_change(c, eco_id)
+
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            c = conn.cursor()
-            c.executescript("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT,
-                    is_admin INTEGER DEFAULT 0,
-                    first_name TEXT,
-                    last_name TEXT,
-                    email TEXT
-                );
-
-                CREATE TABLE IF NOT EXISTS ecos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'DRAFT',
-                    created_by INTEGER NOT NULL,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    FOREIGN KEY (created_by) REFERENCES users(id)
-                );
-
-                CREATE TABLE IF NOT EXISTS eco_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    eco_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    comment TEXT,
-                    performed_by INTEGER NOT NULL,
-                    performed_at TEXT NOT NULL,
-                    FOREIGN KEY (eco_id) REFERENCES ecos(id),
-                    FOREIGN KEY (performed_by) REFERENCES users(id)
-                );
-
-                CREATE TABLE IF NOT EXISTS attachments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    eco_id INTEGER NOT NULL,
-                    filename TEXT NOT NULL,
-                    mime_type TEXT NOT NULL,
-                    file_path TEXT NOT NULL,
-                    file_size INTEGER NOT NULL,
-                    uploaded_by INTEGER NOT NULL,
-                    uploaded_at TEXT NOT NULL,
-                    FOREIGN KEY (eco_id) REFERENCES ecos(id),
-                    FOREIGN KEY (uploaded_by) REFERENCES users(id)
-                );
-
-                CREATE TABLE IF NOT EXISTS api_tokens (
-                    token TEXT PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                );
-
-                CREATE INDEX IF NOT EXISTS idx_ecos_status ON ecos(status);
-                CREATE INDEX IF NOT EXISTS idx_ecos_created_by ON ecos(created_by);
-                CREATE INDEX IF NOT EXISTS idx_eco_history_eco_id ON eco_history(eco_id);
-                CREATE INDEX IF NOT EXISTS idx_attachments_eco_id ON attachments(eco_id);
-                CREATE INDEX IF NOT EXISTS idx_api_tokens_user_id ON api_tokens(user_id);
-            """)
-            for column, definition in [
-                ("password_hash", "TEXT"),
-                ("is_admin", "INTEGER DEFAULT 0"),
-                ("first_name", "TEXT"),
-                ("last_name", "TEXT"),
-                ("email", "TEXT"),
-            ]:
-                try:
-                    c.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
-                except sqlite3.OperationalError:
-                    pass  # Column already exists
+        if self.storage.dialect == "postgresql":
+            self._init_postgres()
+            return
+        with self._connect(timeout=MIGRATION_LOCK_TIMEOUT, isolation_level=None) as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return  # Schema is current: nothing to do on the hot startup path
+            with self.storage.migration_lock(MIGRATION_WAIT_TIMEOUT):
+                # Another worker may have migrated while we waited for the lock
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    self._apply_migrations(conn, version)
 
-            conn.commit()
+    def _apply_migrations(self, conn: sqlite3.Connection, version: int) -> None:
+        conn.create_function("token_hash", 1, self._hash_token, deterministic=True)
+        if version < 3 and not self._token_key and _plaintext_token_count(conn):
+            # Hashed with an empty key, every existing token would stop working
+            # as soon as the API starts with TOKEN_SECRET set
+            raise RuntimeError("TOKEN_SECRET must be set to upgrade a database that holds API tokens")
+        if version == 0:
+            # Lets maintenance reclaim free pages in small steps (PRAGMA
+            # incremental_vacuum). Only takes effect before the first table exists.
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        for target, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another worker may have applied it while we waited for the write lock
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                    conn.execute("COMMIT")
+                    continue
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {target:d}")
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                logger.exception("Schema migration %d failed", target)
+                raise
+            logger.info("Applied schema migration %d (%s)", target, migrate.__name__)
+        # WAL lets readers use a snapshot without blocking writers. The mode is
+        # persistent and cannot be changed inside a transaction.
+        conn.execute("PRAGMA journal_mode=WAL")
+
+    def _init_postgres(self) -> None:
+        if POSTGRES_MIGRATIONS[-1][0] != SCHEMA_VERSION:
+            raise RuntimeError(f"Schema migration {SCHEMA_VERSION:d} has no PostgreSQL counterpart")
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            row = conn.execute("SELECT version FROM schema_version").fetchone()
+            if row is None:
+                conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+            version = row[0] if row else 0
+        if version >= SCHEMA_VERSION:
+            return
+        with self.storage.migration_lock(MIGRATION_WAIT_TIMEOUT):
+            for target, migrate in POSTGRES_MIGRATIONS:
+                if target <= version:
+                    continue
+                with self._connect() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    # Another process may have applied it while we waited for the lock
+                    if conn.execute("SELECT version FROM schema_version").fetchone()[0] >= target:
+                        continue
+                    try:
+                        migrate(conn)
+                        conn.execute("UPDATE schema_version SET version = ?", (target,))
+                    except BaseException:
+                        logger.exception("PostgreSQL schema migration %d failed", target)
+                        raise
+                logger.info("Applied PostgreSQL schema migration %d (%s)", target, migrate.__name__)
+
+    def _hash_token(self, token: str) -> bytes:
+        # API tokens are 256-bit random values, so a single keyed hash is enough
+        # to make a leaked table useless without slowing down every request.
+        return hmac.new(self._token_key, token.encode('utf-8'), hashlib.sha256).digest()
 
     def get_or_create_user(self, username: str) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             c = conn.cursor()
             c.execute("SELECT id FROM users WHERE username = ?", (username,))
             row = c.fetchone()
             if row:
                 return row[0]
             # Regular users created implicitly are not admins
-            c.execute("INSERT INTO users (username, is_admin) VALUES (?, 0)", (username,))
+            c.execute("INSERT INTO users (username, is_admin) VALUES (?, 0) RETURNING id", (username,))
+            user_id = c.fetchone()[0]
             conn.commit()
-            return c.lastrowid
+            return user_id
 
     def check_health(self) -> bool:
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("SELECT 1")
             return True
         except sqlite3.Error:
@@ -129,7 +936,7 @@ class ECO:
         # bcrypt.hashpw returns bytes, we decode to store as text
         password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 c = conn.cursor()
                 # Check if this is the first user
                 c.execute("SELECT COUNT(*) FROM users")
@@ -146,9 +953,9 @@ class ECO:
             return False
 
     def verify_password(self, username: str, password: str) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
+            c.execute("SELECT password_hash FROM users WHERE username = ? AND deleted_at IS NULL", (username,))
             row = c.fetchone()
             if not row or not row[0]:
                 return False
@@ -164,58 +971,127 @@ class ECO:
         # User exists and password correct, get ID
         user_id = self.get_or_create_user(username) 
         token = secrets.token_hex(32)
-        now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        now = datetime.datetime.now()
+        expires_at = now + datetime.timedelta(seconds=self.token_ttl)
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("INSERT INTO api_tokens (token, user_id, created_at) VALUES (?, ?, ?)", (token, user_id, now))
+            c.execute(
+                "INSERT INTO api_tokens (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (self._hash_token(token), user_id, now.isoformat(), expires_at.isoformat()),
+            )
+            # Drop the user's oldest tokens beyond the per-user limit
+            c.execute("""
+                DELETE FROM api_tokens WHERE user_id = ? AND token_hash NOT IN (
+                    SELECT token_hash FROM api_tokens WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+                )
+            """, (user_id, user_id, self.max_tokens_per_user))
             conn.commit()
         return token
 
     def get_user_from_token(self, token: str) -> Optional[dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        token_hash = self._hash_token(token)
+        now = datetime.datetime.now()
+        with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             c = conn.cursor()
             c.execute("""
-                SELECT u.id, u.username, u.is_admin 
+                SELECT u.id, u.username, u.is_admin, t.last_used_at
                 FROM api_tokens t 
                 JOIN users u ON t.user_id = u.id 
-                WHERE t.token = ?
-            """, (token,))
+                WHERE t.token_hash = ? AND t.expires_at > ? AND u.deleted_at IS NULL
+            """, (token_hash, now.isoformat()))
             row = c.fetchone()
-            return dict(row) if row else None
+            if not row:
+                return None
+            user = dict(row)
+            last_used_at = user.pop('last_used_at')
+            # Coalesce sliding-expiry writes: at most one per token per touch interval
+            touch_before = (now - datetime.timedelta(seconds=TOKEN_TOUCH_INTERVAL)).isoformat()
+            if last_used_at is None or last_used_at < touch_before:
+                expires_at = now + datetime.timedelta(seconds=self.token_ttl)
+                c.execute(
+                    "UPDATE api_tokens SET last_used_at = ?, expires_at = ? WHERE token_hash = ?",
+                    (now.isoformat(), expires_at.isoformat(), token_hash),
+                )
+                conn.commit()
+            return user
 
     def revoke_token(self, token: str) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("DELETE FROM api_tokens WHERE token = ?", (token,))
+            c.execute("DELETE FROM api_tokens WHERE token_hash = ?", (self._hash_token(token),))
             conn.commit()
             return c.rowcount > 0
 
+    def purge_expired_tokens(self, batch_size: int = TOKEN_PURGE_BATCH_SIZE) -> int:
+        """Delete expired tokens in short batches so logins are never blocked for long."""
+        now = datetime.datetime.now().isoformat()
+        total = 0
+        while True:
+            with self._connect() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    DELETE FROM api_tokens WHERE token_hash IN (
+                        SELECT token_hash FROM api_tokens WHERE expires_at <= ? LIMIT ?
+                    )
+                """, (now, batch_size))
+                conn.commit()
+            total += c.rowcount
+            if c.rowcount < batch_size:
+                break
+        if total:
+            logger.info("Purged %d expired API tokens", total)
+        return total
+
+    def token_stats(self) -> dict:
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT COUNT(*), COALESCE(SUM(CASE WHEN expires_at <= ? THEN 1 ELSE 0 END), 0), COUNT(DISTINCT user_id)
+                FROM api_tokens
+            """, (now,))
+            total, expired, users = c.fetchone()
+            try:
+                c.execute("""
+                    SELECT COALESCE(SUM(pgsize), 0) FROM dbstat
+                    WHERE name IN ('api_tokens', 'idx_api_tokens_user_id', 'idx_api_tokens_expires_at')
+                """)
+                size_bytes = c.fetchone()[0]
+            except sqlite3.OperationalError:
+                size_bytes = None  # SQLite built without the dbstat virtual table
+        return {"total": total, "expired": expired, "users": users, "size_bytes": size_bytes}
+
     def get_all_users(self) -> List[dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect_read() as conn:
             conn.row_factory = sqlite3.Row
             c = conn.cursor()
-            c.execute("SELECT id, username, is_admin, first_name, last_name, email FROM users")
+            c.execute("SELECT id, username, is_admin, first_name, last_name, email FROM users WHERE deleted_at IS NULL")
             return [dict(row) for row in c.fetchall()]
 
     def delete_user(self, user_id: int) -> bool:
+        """Mark a user deleted and sign them out.
+
+        The row stays as a tombstone so the ECOs and history they authored keep
+        their attribution; purge_deleted removes it once nothing refers to it.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 c = conn.cursor()
                 # Check if user is the last admin
-                c.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
+                c.execute("SELECT is_admin FROM users WHERE id = ? AND deleted_at IS NULL", (user_id,))
                 row = c.fetchone()
                 if not row:
                     return False
                 if row[0]:
-                    c.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1")
+                    c.execute("SELECT COUNT(*) FROM users WHERE is_admin = 1 AND deleted_at IS NULL")
                     admin_count = c.fetchone()[0]
                     if admin_count <= 1:
                         logger.warning("Attempted to delete the last admin user (id=%d)", user_id)
                         return False
                 # Clean up user's API tokens
                 c.execute("DELETE FROM api_tokens WHERE user_id = ?", (user_id,))
-                c.execute("DELETE FROM users WHERE id = ?", (user_id,))
+                c.execute("UPDATE users SET deleted_at = ? WHERE id = ?", (datetime.datetime.now().isoformat(), user_id))
                 logger.info("Deleted user id=%d", user_id)
                 return c.rowcount > 0
         except sqlite3.Error:
@@ -225,107 +1101,446 @@ class ECO:
     def create_eco(self, title: str, description: str, username: str) -> int:
         user_id = self.get_or_create_user(username)
         now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             c = conn.cursor()
             c.execute("""
-                INSERT INTO ecos (title, description, created_by, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (title, description, user_id, now, now))
-            eco_id = c.lastrowid
-            c.execute("""
-                INSERT INTO eco_history (eco_id, action, performed_by, performed_at)
-                VALUES (?, 'CREATED', ?, ?)
-            """, (eco_id, user_id, now))
+                INSERT INTO ecos (title, description, status, created_by, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """, (title, description, self.workflow.initial, user_id, now, now))
+            eco_id = c.fetchone()[0]
+            self._record_history(c, eco_id, AUDIT_CREATED, None, user_id, username, now)
             conn.commit()
             return eco_id
 
-    def update_eco(self, eco_id: int, title: str, description: str, username: str) -> bool:
+    def update_eco(self, eco_id: int, title: str, description: str, username: str,
+                   expected_version: Optional[int] = None) -> bool:
+        """Change an ECO's title and description.
+
+        False if the ECO is missing or, when ``expected_version`` is given,
+        someone else changed it since that version was read.
+        """
         user_id = self.get_or_create_user(username)
         now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        guard, guard_params = self._version_guard(expected_version)
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT id FROM ecos WHERE id = ?", (eco_id,))
-            if not c.fetchone():
+            c.execute("BEGIN IMMEDIATE")
+            c.execute(f"""
+                UPDATE ecos SET title = ?, description = ?, updated_at = ?, version = version + 1
+                WHERE id = ? AND deleted_at IS NULL{guard}
+                RETURNING version
+            """, (title, description, now, eco_id, *guard_params))
+            if not c.fetchall():
+                conn.rollback()
                 return False
-            c.execute(
-                "UPDATE ecos SET title = ?, description = ?, updated_at = ? WHERE id = ?",
-                (title, description, now, eco_id),
-            )
-            c.execute("""
-                INSERT INTO eco_history (eco_id, action, comment, performed_by, performed_at)
-                VALUES (?, 'EDITED', ?, ?, ?)
-            """, (eco_id, f"Title: {title}", user_id, now))
+            self._record_history(c, eco_id, AUDIT_EDITED, f"Title: {title}", user_id, username, now)
             conn.commit()
             return True
 
-    def delete_eco(self, eco_id: int) -> bool:
+    @staticmethod
+    def _version_guard(expected_version: Optional[int]) -> Tuple[str, tuple]:
+        if expected_version is None:
+            return "", ()
+        return " AND version = ?", (expected_version,)
+
+    def current_version(self, eco_id: int) -> Optional[int]:
+        """Row version of a live ECO (None if missing); it changes with every edit, transition or delete."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT version FROM ecos WHERE id = ? AND deleted_at IS NULL", (eco_id,)).fetchone()
+            return row[0] if row else None
+
+    def current_status(self, eco_id: int) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM ecos WHERE id = ? AND deleted_at IS NULL", (eco_id,)).fetchone()
+            return row[0] if row else None
+
+    def delete_eco(self, eco_id: int, username: Optional[str] = None,
+                   expected_version: Optional[int] = None) -> bool:
+        """Mark an ECO deleted.
+
+        It disappears from every lookup at once; its history, attachments and
+        files are removed in the background by purge_deleted. With
+        ``expected_version``, only deletes the ECO if it is still at that version.
+        """
+        user_id = self.get_or_create_user(username) if username else None
+        now = datetime.datetime.now().isoformat()
+        guard, guard_params = self._version_guard(expected_version)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 c = conn.cursor()
-                c.execute("SELECT id FROM ecos WHERE id = ?", (eco_id,))
-                if not c.fetchone():
+                c.execute(f"""
+                    UPDATE ecos SET deleted_at = ?, version = version + 1
+                    WHERE id = ? AND deleted_at IS NULL{guard}
+                    RETURNING title
+                """, (now, eco_id, *guard_params))
+                rows = c.fetchall()
+                if not rows:
                     return False
-                c.execute("DELETE FROM eco_history WHERE eco_id = ?", (eco_id,))
-                c.execute("DELETE FROM attachments WHERE eco_id = ?", (eco_id,))
-                c.execute("DELETE FROM ecos WHERE id = ?", (eco_id,))
+                c.execute("UPDATE eco_approvers SET pending = 0 WHERE eco_id = ? AND pending = 1", (eco_id,))
+                self._append_audit(c, eco_id, AUDIT_DELETED, f"Title: {rows[0][0]}", user_id, username, now)
+                self._record_change(c, eco_id, deleted=True)
+                if user_id is not None:
+                    self._note_write(c, user_id, now)
                 conn.commit()
                 logger.info("Deleted ECO id=%d", eco_id)
-                return True
         except sqlite3.Error:
             logger.exception("Failed to delete ECO id=%d", eco_id)
             return False
+        self.enqueue_job("purge_deleted", dedupe_key="purge_deleted")
+        return True
 
-    def submit_eco(self, eco_id: int, username: str, comment: Optional[str] = None) -> bool:
-        user_id = self.get_or_create_user(username)
-        now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+    def _purge_eco(self, eco_id: int, batch_size: int) -> int:
+        blob_keys = []
+        with self._connect() as conn:
+            c = conn.cursor()
+            while True:
+                c.execute("DELETE FROM eco_history WHERE id IN (SELECT id FROM eco_history WHERE eco_id = ? LIMIT ?)",
+                          (eco_id, batch_size))
+                conn.commit()
+                if c.rowcount < batch_size:
+                    break
+            while True:
+                c.execute("""
+                    DELETE FROM attachments WHERE id IN (SELECT id FROM attachments WHERE eco_id = ? LIMIT ?)
+                    RETURNING blob_key
+                """, (eco_id, batch_size))
+                keys = [row[0] for row in c.fetchall()]
+                conn.commit()
+                blob_keys.extend(keys)
+                if len(keys) < batch_size:
+                    break
+            c.execute("DELETE FROM eco_approvers WHERE eco_id = ?", (eco_id,))
+            conn.commit()
+            # The tombstone goes last, so an interrupted purge is picked up again
+            c.execute("DELETE FROM ecos WHERE id = ? AND deleted_at IS NOT NULL", (eco_id,))
+            conn.commit()
+        for blob_key in blob_keys:
+            try:
+                self.blob_store.delete(blob_key)
+            except OSError:
+                # Left for the attachment garbage collector
+                logger.warning("Could not delete attachment blob '%s' of ECO %d", blob_key, eco_id)
+        return len(blob_keys)
+
+    def purge_deleted(self, batch_size: int = PURGE_BATCH_SIZE) -> dict:
+        """Physically remove soft-deleted ECOs, and deleted users nothing refers to any more.
+
+        Rows are deleted in transactions of at most ``batch_size`` so the write
+        lock is only ever held briefly.
+        """
+        ecos = files = 0
+        while True:
+            with self._connect() as conn:
+                eco_ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM ecos WHERE deleted_at IS NOT NULL ORDER BY deleted_at LIMIT ?", (batch_size,))]
+            for eco_id in eco_ids:
+                files += self._purge_eco(eco_id, batch_size)
+                ecos += 1
+            if len(eco_ids) < batch_size:
+                break
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT status FROM ecos WHERE id = ?", (eco_id,))
-            row = c.fetchone()
-            if not row or row[0] != STATUS_DRAFT:
-                return False
-            c.execute("UPDATE ecos SET status = ?, updated_at = ? WHERE id = ?", (STATUS_SUBMITTED, now, eco_id))
             c.execute("""
-                INSERT INTO eco_history (eco_id, action, comment, performed_by, performed_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (eco_id, STATUS_SUBMITTED, comment, user_id, now))
+                DELETE FROM users WHERE id IN (
+                    SELECT id FROM users u WHERE deleted_at IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM ecos WHERE created_by = u.id)
+                    AND NOT EXISTS (SELECT 1 FROM eco_history WHERE performed_by = u.id)
+                    AND NOT EXISTS (SELECT 1 FROM attachments WHERE uploaded_by = u.id)
+                    AND NOT EXISTS (SELECT 1 FROM jobs WHERE created_by = u.id)
+                    AND NOT EXISTS (SELECT 1 FROM eco_approvers WHERE user_id = u.id)
+                    LIMIT ?
+                )
+            """, (batch_size,))
+            users = c.rowcount
             conn.commit()
-            return True
+        if ecos or users:
+            logger.info("Purged %d deleted ECOs (%d files) and %d deleted users", ecos, files, users)
+        return {"ecos": ecos, "files": files, "users": users}
+
+    def transition(self, eco_id: int, action: str, username: str, comment: Optional[str] = None,
+                   expected_version: Optional[int] = None) -> bool:
+        """Apply a workflow action; False if the ECO is missing or not in a state the action starts from.
 
-    def approve_eco(self, eco_id: int, username: str, comment: Optional[str] = None) -> bool:
+        The status check and change are one UPDATE in an IMMEDIATE
+        transaction, so of two concurrent actions on the same ECO exactly one
+        succeeds and neither fails on a lock upgrade. With ``expected_version``
+        the action also fails if the ECO changed since that version was read.
+
+        On an ECO awaiting its named approvers, approve and reject are votes:
+        False for anyone else or a second vote, and the status only changes
+        once the votes decide the ECO.
+        """
+        transition = self.workflow.transitions.get(action)
+        if transition is None or (transition.comment == COMMENT_REQUIRED and not comment):
+            return False
         user_id = self.get_or_create_user(username)
         now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        guard, guard_params = self._version_guard(expected_version)
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT status FROM ecos WHERE id = ?", (eco_id,))
-            row = c.fetchone()
-            if not row or row[0] != STATUS_SUBMITTED:
+            c.execute("BEGIN IMMEDIATE")
+            if action in AUDIT_VOTES:
+                vote = self._count_vote(c, eco_id, action, user_id, expected_version, now)
+                if vote == _VOTE_REFUSED:
+                    conn.rollback()
+                    return False
+                if vote == _VOTE_COUNTED:
+                    self._record_history(c, eco_id, AUDIT_VOTES[action], comment, user_id, username, now)
+                    conn.commit()
+                    return True
+                if vote == _VOTE_DECIDED:
+                    guard, guard_params = "", ()  # Checked with the vote, which bumped the version
+            placeholders = ", ".join("?" * len(transition.sources))
+            c.execute(f"""
+                UPDATE ecos SET status = ?, updated_at = ?, version = version + 1
+                WHERE id = ? AND deleted_at IS NULL AND status IN ({placeholders}){guard}
+                RETURNING version
+            """, (transition.target, now, eco_id, *transition.sources, *guard_params))
+            if not c.fetchall():
+                conn.rollback()
+                return False
+            self._sync_approvers(c, eco_id, transition.target)
+            self._record_history(c, eco_id, transition.target, comment, user_id, username, now)
+            try:
+                for hook in self.workflow.hooks(action):
+                    hook(c, eco_id, action, transition.target, username, comment)
+            except TransitionRejected as e:
+                conn.rollback()
+                logger.info("Transition %s of ECO %s rejected by hook: %s", action, eco_id, e)
                 return False
-            c.execute("UPDATE ecos SET status = ?, updated_at = ? WHERE id = ?", (STATUS_APPROVED, now, eco_id))
-            c.execute("""
-                INSERT INTO eco_history (eco_id, action, comment, performed_by, performed_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (eco_id, STATUS_APPROVED, comment, user_id, now))
             conn.commit()
             return True
 
-    def reject_eco(self, eco_id: int, username: str, comment: str) -> bool:
+    def _count_vote(self, c: sqlite3.Cursor, eco_id: int, action: str, user_id: int,
+                    expected_version: Optional[int], now: str) -> str:
+        c.execute("SELECT status, quorum, version FROM ecos WHERE id = ? AND deleted_at IS NULL", (eco_id,))
+        row = c.fetchone()
+        if row is None or row[1] is None or row[0] not in self.workflow.approval_states:
+            return _VOTE_NOT_REQUIRED
+        status, quorum, version = row
+        if status not in self.workflow.transitions[action].sources:
+            return _VOTE_REFUSED
+        if expected_version is not None and version != expected_version:
+            return _VOTE_REFUSED
+        c.execute("""
+            UPDATE eco_approvers SET decision = ?, decided_at = ?, pending = 0
+            WHERE eco_id = ? AND user_id = ? AND decision IS NULL
+        """, (action, now, eco_id, user_id))
+        if c.rowcount == 0:
+            return _VOTE_REFUSED  # Not an approver of this ECO, or already voted
+        counter = "approvals" if action == APPROVE else "rejections"
+        c.execute(f"""
+            UPDATE ecos SET {counter} = {counter} + 1, version = version + 1, updated_at = ?
+            WHERE id = ? RETURNING approvals, rejections
+        """, (now, eco_id))
+        approvals, rejections = c.fetchone()
+        c.execute("SELECT COUNT(*) FROM eco_approvers WHERE eco_id = ?", (eco_id,))
+        approvers = c.fetchone()[0]
+        # Approved on reaching the quorum; rejected once it can no longer be reached
+        if approvals >= quorum or approvers - rejections < quorum:
+            return _VOTE_DECIDED
+        return _VOTE_COUNTED
+
+    def _sync_approvers(self, c: sqlite3.Cursor, eco_id: int, status: str) -> None:
+        # An ECO is in its approvers' queues exactly while it is in an approval
+        # state; entering one starts a new round of votes
+        if status in self.workflow.approval_states:
+            c.execute("UPDATE eco_approvers SET decision = NULL, decided_at = NULL, pending = 1 WHERE eco_id = ?",
+                      (eco_id,))
+            c.execute("UPDATE ecos SET approvals = 0, rejections = 0 WHERE id = ?", (eco_id,))
+        else:
+            c.execute("UPDATE eco_approvers SET pending = 0 WHERE eco_id = ? AND pending = 1", (eco_id,))
+
+    def set_approvers(self, eco_id: int, approvers: List[str], username: str, quorum: Optional[int] = None) -> bool:
+        """Require sign-off from ``approvers`` before the ECO can be approved.
+
+        ``quorum`` approvals (default: all of them) approve the ECO; it is
+        rejected as soon as so many approvers reject that the quorum cannot
+        be reached. Changing the approvers starts the votes over, and an empty
+        list removes the requirement. Raises ValueError for unknown users or an
+        impossible quorum; returns False if the ECO is missing or approved.
+        """
+        approve = self.workflow.transitions.get(APPROVE)
+        if approve is None:
+            raise ValueError("The workflow has no approve action")
+        approvers = list(dict.fromkeys(approvers))
+        if quorum is None:
+            quorum = len(approvers)
+        if approvers and not 1 <= quorum <= len(approvers):
+            raise ValueError(f"Quorum must be between 1 and {len(approvers)}")
         user_id = self.get_or_create_user(username)
         now = datetime.datetime.now().isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT status FROM ecos WHERE id = ?", (eco_id,))
-            row = c.fetchone()
-            if not row or row[0] != STATUS_SUBMITTED:
-                return False
-            c.execute("UPDATE ecos SET status = ?, updated_at = ? WHERE id = ?", (STATUS_REJECTED, now, eco_id))
+            c.execute("BEGIN IMMEDIATE")
+            approver_ids = []
+            for name in approvers:
+                c.execute("SELECT id FROM users WHERE username = ? AND deleted_at IS NULL", (name,))
+                row = c.fetchone()
+                if not row:
+                    raise ValueError(f"Unknown user '{name}'")
+                approver_ids.append(row[0])
             c.execute("""
-                INSERT INTO eco_history (eco_id, action, comment, performed_by, performed_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (eco_id, STATUS_REJECTED, comment, user_id, now))
+                UPDATE ecos SET quorum = ?, approvals = 0, rejections = 0, version = version + 1, updated_at = ?
+                WHERE id = ? AND deleted_at IS NULL AND status != ?
+                RETURNING status
+            """, (quorum if approvers else None, now, eco_id, approve.target))
+            rows = c.fetchall()
+            if not rows:
+                conn.rollback()
+                return False
+            pending = int(rows[0][0] in self.workflow.approval_states)
+            c.execute("DELETE FROM eco_approvers WHERE eco_id = ?", (eco_id,))
+            c.executemany("INSERT INTO eco_approvers (eco_id, user_id, pending) VALUES (?, ?, ?)",
+                          [(eco_id, approver_id, pending) for approver_id in approver_ids])
+            comment = f"{quorum} of {', '.join(approvers)}" if approvers else None
+            self._record_history(c, eco_id, AUDIT_APPROVERS_SET, comment, user_id, username, now)
             conn.commit()
             return True
 
+    def pending_approvals(self, username: str, limit: int = PENDING_PAGE_SIZE, after: int = 0) -> List[dict]:
+        """ECOs waiting on ``username``'s vote, by id, starting after ECO ``after``.
+
+        Reads a range of the pending-approver index, so the cost depends on
+        the user's queue rather than on the number of ECOs.
+        """
+        with self._connect_read(username) as conn:
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute("""
+                SELECT e.id, e.title, e.status, e.created_at, u.username AS created_by, e.quorum, e.approvals
+                FROM eco_approvers a
+                JOIN ecos e ON e.id = a.eco_id
+                JOIN users u ON e.created_by = u.id
+                WHERE a.user_id = (SELECT id FROM users WHERE username = ?) AND a.pending = 1 AND a.eco_id > ?
+                ORDER BY a.eco_id
+                LIMIT ?
+            """, (username, after, limit))
+            return [dict(r) for r in c.fetchall()]
+
+    def submit_eco(self, eco_id: int, username: str, comment: Optional[str] = None,
+                   expected_version: Optional[int] = None) -> bool:
+        return self.transition(eco_id, "submit", username, comment, expected_version)
+
+    def approve_eco(self, eco_id: int, username: str, comment: Optional[str] = None,
+                    expected_version: Optional[int] = None) -> bool:
+        return self.transition(eco_id, "approve", username, comment, expected_version)
+
+    def reject_eco(self, eco_id: int, username: str, comment: str, expected_version: Optional[int] = None) -> bool:
+        return self.transition(eco_id, "reject", username, comment, expected_version)
+
+    def query_audit(
+        self,
+        username: Optional[str] = None,
+        action: Optional[str] = None,
+        eco_id: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = AUDIT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Audit entries, newest first, with the cursor for the next page (None on the last page).
+
+        ``since`` and ``until`` are ISO timestamps; ``until`` is exclusive.
+        """
+        conditions, params = [], []
+        if username is not None:
+            conditions.append("username = ?")
+            params.append(username)
+        if action is not None:
+            conditions.append("action = ?")
+            params.append(action)
+        if eco_id is not None:
+            conditions.append("eco_id = ?")
+            params.append(eco_id)
+        if since is not None:
+            conditions.append("performed_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("performed_at < ?")
+            params.append(until)
+        if cursor:
+            # Keyset pagination: resume after the last (performed_at, id) returned
+            last_at, _, last_id = cursor.rpartition("|")
+            conditions.append("(performed_at, id) < (?, ?)")
+            params.extend([last_at, int(last_id)])
+        query = "SELECT id, eco_id, action, comment, username, performed_at FROM audit_log"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY performed_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._connect_read() as conn:
+            conn.row_factory = sqlite3.Row
+            entries = [dict(r) for r in conn.execute(query, params)]
+        if len(entries) <= limit:
+            return entries, None
+        entries = entries[:limit]
+        return entries, f"{entries[-1]['performed_at']}|{entries[-1]['id']}"
+
+    def changes_since(self, since: int = 0, limit: int = CHANGES_PAGE_SIZE) -> dict:
+        """ECOs changed after change sequence number ``since``, oldest change first.
+
+        Each changed ECO appears once, with its current state and attachments,
+        or as a tombstone (``deleted`` true, no ``eco``) if it was deleted.
+        Returns ``{"changes", "next_since", "has_more"}``; pass ``next_since``
+        back as ``since`` to resume.
+        """
+        with self._connect_read() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("""
+                SELECT ch.seq, ch.eco_id, ch.deleted, e.id, e.title, e.description, e.status, e.version,
+                       e.created_at, u.username AS created_by, e.updated_at, e.quorum, e.approvals, e.rejections
+                FROM eco_changes ch
+                LEFT JOIN ecos e ON e.id = ch.eco_id AND e.deleted_at IS NULL
+                LEFT JOIN users u ON e.created_by = u.id
+                WHERE ch.seq > ?
+                ORDER BY ch.seq
+                LIMIT ?
+            """, (since, limit + 1)).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            live = [r["eco_id"] for r in rows if not r["deleted"] and r["id"] is not None]
+            attachments: Dict[int, List[dict]] = {eco_id: [] for eco_id in live}
+            if live:
+                # Read after the ECOs: a file attached in between also moved its
+                # ECO to a later seq, so the next sync picks it up either way
+                placeholders = ", ".join("?" * len(live))
+                for a in conn.execute(f"""
+                    SELECT eco_id, filename, mime_type, file_size, sha256, uploaded_at FROM attachments
+                    WHERE eco_id IN ({placeholders}) ORDER BY eco_id, filename
+                """, live):
+                    attachments[a["eco_id"]].append({k: a[k] for k in a.keys() if k != "eco_id"})
+        changes = []
+        for r in rows:
+            # Deleted ECOs, purged or not, have no live row to join
+            change = {"seq": r["seq"], "eco_id": r["eco_id"], "deleted": r["eco_id"] not in attachments, "eco": None}
+            if not change["deleted"]:
+                eco = {k: r[k] for k in r.keys() if k not in ("seq", "eco_id", "deleted")}
+                eco["attachments"] = attachments[r["eco_id"]]
+                change["eco"] = eco
+            changes.append(change)
+        return {"changes": changes, "next_since": changes[-1]["seq"] if changes else since, "has_more": has_more}
+
+    def verify_audit_chain(self, batch_size: int = AUDIT_VERIFY_BATCH_SIZE) -> dict:
+        """Recompute the audit hash chain; ``first_bad_id`` is the first entry that does not match."""
+        prev_hash, last_id, checked = AUDIT_GENESIS_HASH, 0, 0
+        while True:
+            with self._connect_read() as conn:
+                rows = conn.execute("""
+                    SELECT id, eco_id, action, comment, performed_by, username, performed_at, prev_hash, row_hash
+                    FROM audit_log WHERE id > ? ORDER BY id LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+            for entry_id, *fields, stored_prev, stored_hash in rows:
+                if stored_prev != prev_hash or stored_hash != _audit_hash(prev_hash, *fields):
+                    logger.error("Audit log hash chain broken at entry %d", entry_id)
+                    return {"ok": False, "checked": checked, "first_bad_id": entry_id}
+                prev_hash = stored_hash
+                checked += 1
+            if len(rows) < batch_size:
+                return {"ok": True, "checked": checked, "first_bad_id": None}
+            last_id = rows[-1][0]
+
     def add_attachment(self, eco_id: int, filename: str, file_path: str, username: str) -> bool:
         user_id = self.get_or_create_user(username)
         now = datetime.datetime.now().isoformat()
@@ -336,40 +1551,301 @@ class ECO:
 
             # Create unique filename
             safe_filename = Path(filename).name
-            dest_path = self.attachments_dir / f"{eco_id}_{safe_filename}"
-            shutil.copy2(src_path, dest_path)
-
-            file_size = dest_path.stat().st_size
-            mime_type = mimetypes.guess_type(safe_filename)[0] or "application/octet-stream"
+            blob_key = f"{eco_id}_{safe_filename}"
+            file_size = src_path.stat().st_size
+            claims = self._claim_blob_keys([blob_key])
+            try:
+                # Hashed as it is stored, so the digest describes the bytes in the blob store
+                sha256 = self.blob_store.put_file(blob_key, src_path)
 
-            with sqlite3.connect(self.db_path) as conn:
-                c = conn.cursor()
-                c.execute("""
-                    INSERT INTO attachments (eco_id, filename, mime_type, file_path, file_size, uploaded_by, uploaded_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (eco_id, safe_filename, mime_type, str(dest_path), file_size, user_id, now))
-                conn.commit()
+                with self._connect() as conn:
+                    c = conn.cursor()
+                    has_preview = self._record_attachment(c, eco_id, safe_filename, blob_key, file_size, sha256,
+                                                          user_id, username, now)
+                    self._note_write(c, user_id, now)
+                    conn.commit()
+            finally:
+                self._release_blob_keys(claims)
+            if not has_preview:
+                self.enqueue_job("attachment_preview", {"sha256": sha256}, dedupe_key=f"preview:{sha256}")
             return True
         except (OSError, sqlite3.Error):
             logger.exception("Failed to add attachment '%s' to ECO %d", filename, eco_id)
             return False
 
-    def get_attachment_path(self, eco_id: int, filename: str) -> Optional[str]:
-        with sqlite3.connect(self.db_path) as conn:
+    def add_attachments(self, eco_id: int, files: List[Tuple[str, str]], username: str,
+                        threads: int = ATTACHMENT_WRITE_THREADS) -> List[dict]:
+        """Attach several files at once; ``files`` holds ``(filename, path)`` pairs.
+
+        The files are written to the blob store concurrently and every one
+        that was stored is recorded in a single transaction. Returns one
+        ``{"filename", "ok", "size", "sha256"}`` result per file, in order,
+        with ``"error"`` instead of size and digest for files that failed.
+        """
+        user_id = self.get_or_create_user(username)
+        now = datetime.datetime.now().isoformat()
+        results = [{"filename": Path(filename).name, "ok": False} for filename, _ in files]
+        pending = []  # indexes of the files to store
+        seen = set()
+        for i, (_, path) in enumerate(files):
+            name = results[i]["filename"]
+            if name in seen:
+                results[i]["error"] = "Duplicate filename in upload"
+            elif not os.path.isfile(path):
+                results[i]["error"] = "File not found"
+            else:
+                seen.add(name)
+                pending.append(i)
+
+        def store(i: int) -> Tuple[int, str]:
+            blob_key = f"{eco_id}_{results[i]['filename']}"
+            return os.path.getsize(files[i][1]), self.blob_store.put_file(blob_key, Path(files[i][1]).resolve())
+
+        if not pending:
+            return results
+        try:
+            claims = self._claim_blob_keys([f"{eco_id}_{results[i]['filename']}" for i in pending])
+        except sqlite3.Error:
+            logger.exception("Failed to claim %d attachment blobs for ECO %d", len(pending), eco_id)
+            for i in pending:
+                results[i]["error"] = "Could not record attachment"
+            return results
+        try:
+            with ThreadPoolExecutor(max_workers=min(threads, len(pending))) as pool:
+                futures = [(i, pool.submit(store, i)) for i in pending]
+            stored = []
+            for i, future in futures:
+                try:
+                    results[i]["size"], results[i]["sha256"] = future.result()
+                    stored.append(i)
+                except OSError:
+                    logger.exception("Failed to store attachment '%s' for ECO %d", results[i]["filename"], eco_id)
+                    results[i]["error"] = "Could not store file"
+            if not stored:
+                return results
+
+            try:
+                with self._connect() as conn:
+                    c = conn.cursor()
+                    need_preview = set()
+                    for i in stored:
+                        r = results[i]
+                        if not self._record_attachment(c, eco_id, r["filename"], f"{eco_id}_{r['filename']}",
+                                                       r["size"], r["sha256"], user_id, username, now):
+                            need_preview.add(r["sha256"])
+                    self._note_write(c, user_id, now)
+                    conn.commit()
+            except sqlite3.Error:
+                logger.exception("Failed to record %d attachments for ECO %d", len(stored), eco_id)
+                for i in stored:
+                    results[i] = {"filename": results[i]["filename"], "ok": False,
+                                  "error": "Could not record attachment"}
+                return results
+        finally:
+            self._release_blob_keys(claims)
+        for i in stored:
+            results[i]["ok"] = True
+        for sha256 in need_preview:
+            self.enqueue_job("attachment_preview", {"sha256": sha256}, dedupe_key=f"preview:{sha256}")
+        return results
+
+    def _claim_blob_keys(self, keys: List[str]) -> List[int]:
+        """Record that blobs are about to be written under ``keys``; returns the claim ids.
+
+        The attachment GC leaves claimed keys alone, so a blob stored before
+        its attachment row is committed is never taken for an orphan. If the
+        GC has claimed one of the keys to delete its blob, this waits until
+        the GC is done with it.
+        """
+        placeholders = ",".join("?" * len(keys))
+        while True:
+            now = datetime.datetime.now()
+            stale = (now - datetime.timedelta(seconds=BLOB_DELETE_CLAIM_TIMEOUT)).isoformat()
+            with self._connect() as conn:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                c.execute(f"""
+                    SELECT 1 FROM blob_uploads WHERE deleting = 1 AND started_at > ? AND blob_key IN ({placeholders})
+                """, (stale, *keys))
+                if c.fetchone() is None:
+                    claims = [c.execute("INSERT INTO blob_uploads (blob_key, started_at) VALUES (?, ?) RETURNING id",
+                                        (key, now.isoformat())).fetchone()[0] for key in keys]
+                    conn.commit()
+                    return claims
+                conn.rollback()
+            time.sleep(BLOB_CLAIM_RETRY_DELAY)
+
+    def _release_blob_keys(self, claims: List[int]) -> None:
+        # A claim left behind only keeps the GC off its key until the claim expires
+        try:
+            with self._connect() as conn:
+                conn.executemany("DELETE FROM blob_uploads WHERE id = ?", [(claim,) for claim in claims])
+                conn.commit()
+        except sqlite3.Error:
+            logger.warning("Could not release %d blob upload claims", len(claims), exc_info=True)
+
+    def _record_attachment(self, c, eco_id: int, filename: str, blob_key: str, file_size: int, sha256: str,
+                           user_id: int, username: str, now: str) -> bool:
+        # Insert or replace the attachment row and audit it; returns whether its preview already exists
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        c.execute("""
+            INSERT INTO attachments (eco_id, filename, mime_type, file_path, blob_key, file_size, sha256,
+                                     uploaded_by, uploaded_at, verified_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (eco_id, filename) DO UPDATE SET
+                mime_type = excluded.mime_type, file_path = excluded.file_path,
+                blob_key = excluded.blob_key, file_size = excluded.file_size, sha256 = excluded.sha256,
+                uploaded_by = excluded.uploaded_by, uploaded_at = excluded.uploaded_at,
+                verified_at = excluded.verified_at, corrupt_at = NULL
+        """, (eco_id, filename, mime_type, self.blob_store.location(blob_key), blob_key,
+              file_size, sha256, user_id, now, now))
+        c.execute("SELECT 1 FROM attachment_previews WHERE sha256 = ?", (sha256,))
+        has_preview = c.fetchone() is not None
+        self._append_audit(c, eco_id, AUDIT_ATTACHMENT_ADDED, filename, user_id, username, now)
+        self._record_change(c, eco_id)
+        return has_preview
+
+    def _get_attachment_key(self, eco_id: int, filename: str) -> Optional[str]:
+        with self._connect() as conn:
             c = conn.cursor()
-            c.execute("SELECT file_path FROM attachments WHERE eco_id = ? AND filename = ?", (eco_id, filename))
+            c.execute("""
+                SELECT a.blob_key FROM attachments a JOIN ecos e ON a.eco_id = e.id
+                WHERE a.eco_id = ? AND a.filename = ? AND e.deleted_at IS NULL
+            """, (eco_id, filename))
             row = c.fetchone()
             return row[0] if row else None
 
-    def get_eco_details(self, eco_id: int) -> Optional[dict]:
-        with sqlite3.connect(self.db_path) as conn:
+    def record_attachment_check(self, attachment_id: int, expected: Optional[str], actual: Optional[str]) -> bool:
+        """Record the result of re-reading an attachment's blob; returns whether it is intact.
+
+        ``expected`` is the attachment's sha256 as read before hashing the blob
+        and ``actual`` the digest of the blob, or None if it could not be read.
+        Nothing is recorded if the attachment was re-uploaded meanwhile.
+        Attachments stored before hashes were kept take ``actual`` as theirs.
+        """
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as conn:
+            c = conn.cursor()
+            if expected is None and actual is not None:
+                c.execute("UPDATE attachments SET sha256 = ?, verified_at = ? WHERE id = ? AND sha256 IS NULL",
+                          (actual, now, attachment_id))
+                conn.commit()
+                if c.rowcount:
+                    self.enqueue_job("attachment_preview", {"sha256": actual}, dedupe_key=f"preview:{actual}")
+                return True
+            if actual is not None and actual == expected:
+                c.execute("UPDATE attachments SET verified_at = ?, corrupt_at = NULL WHERE id = ? AND sha256 = ?",
+                          (now, attachment_id, expected))
+                conn.commit()
+                return True
+            same_hash = "sha256 IS NULL" if expected is None else "sha256 = ?"
+            c.execute(f"""
+                UPDATE attachments SET corrupt_at = COALESCE(corrupt_at, ?) WHERE id = ? AND {same_hash}
+                RETURNING eco_id, filename
+            """, (now, attachment_id) + (() if expected is None else (expected,)))
+            rows = c.fetchall()
+            conn.commit()
+        if not rows:
+            return True  # Replaced or deleted while it was being checked
+        logger.error("Attachment '%s' of ECO %d is %s", rows[0][1], rows[0][0],
+                     "missing or unreadable" if actual is None else "corrupt (SHA-256 mismatch)")
+        return False
+
+    def verify_attachment(self, eco_id: int, filename: str) -> Optional[bool]:
+        """Re-hash an attachment's blob and record the result; None if there is no such attachment."""
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT a.id, a.blob_key, a.sha256 FROM attachments a JOIN ecos e ON a.eco_id = e.id
+                WHERE a.eco_id = ? AND a.filename = ? AND e.deleted_at IS NULL
+            """, (eco_id, filename)).fetchone()
+        if not row:
+            return None
+        attachment_id, blob_key, expected = row
+        try:
+            with self.blob_store.local_file(blob_key) as path:
+                actual = file_sha256(path)
+        except OSError:
+            actual = None
+        return self.record_attachment_check(attachment_id, expected, actual)
+
+    def get_attachment_path(self, eco_id: int, filename: str) -> Optional[str]:
+        """Local filesystem path of an attachment, or None if it is not stored on this host."""
+        blob_key = self._get_attachment_key(eco_id, filename)
+        return self.blob_store.local_path(blob_key) if blob_key else None
+
+    def get_attachment_url(self, eco_id: int, filename: str) -> Optional[str]:
+        """Short-lived direct download URL, if the blob store supports them."""
+        blob_key = self._get_attachment_key(eco_id, filename)
+        return self.blob_store.presigned_url(blob_key, filename) if blob_key else None
+
+    def create_attachment_preview(self, sha256: str) -> bool:
+        """Generate and record the preview for attachment content ``sha256``.
+
+        Returns False if no attachment has that content or its type has no preview.
+        """
+        with self._connect() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM attachment_previews WHERE sha256 = ?", (sha256,))
+            if c.fetchone():
+                return True
+            c.execute("SELECT blob_key, mime_type FROM attachments WHERE sha256 = ? LIMIT 1", (sha256,))
+            row = c.fetchone()
+        if not row:
+            return False
+        # Stored like the attachments, so any API host can serve it
+        with self.blob_store.local_file(row[0]) as src, tempfile.TemporaryDirectory() as tmp_dir:
+            preview = generate_preview(src, row[1], Path(tmp_dir) / sha256)
+            if not preview:
+                return False
+            preview_path, preview_mime = preview
+            blob_key = PREVIEW_KEY_PREFIX + preview_path.name
+            self.blob_store.put_file(blob_key, preview_path)
+            file_size = preview_path.stat().st_size
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO attachment_previews (sha256, mime_type, file_path, blob_key, file_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sha256) DO UPDATE SET
+                    mime_type = excluded.mime_type, file_path = excluded.file_path, blob_key = excluded.blob_key,
+                    file_size = excluded.file_size, created_at = excluded.created_at
+            """, (sha256, preview_mime, self.blob_store.location(blob_key), blob_key, file_size,
+                  datetime.datetime.now().isoformat()))
+            conn.commit()
+        return True
+
+    def get_attachment_preview(self, eco_id: int, filename: str) -> Optional[dict]:
+        """An attachment's preview, or None if it has none yet.
+
+        ``url`` is a direct download URL if the blob store supports them, and
+        ``file_path`` the preview's path on this host otherwise.
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute("""
+                SELECT p.sha256, p.mime_type, p.blob_key, p.file_size
+                FROM attachments a JOIN attachment_previews p ON a.sha256 = p.sha256
+                JOIN ecos e ON a.eco_id = e.id
+                WHERE a.eco_id = ? AND a.filename = ? AND e.deleted_at IS NULL
+            """, (eco_id, filename))
+            row = c.fetchone()
+        if not row:
+            return None
+        preview = dict(row)
+        preview_name = preview['blob_key'][len(PREVIEW_KEY_PREFIX):]
+        preview['url'] = self.blob_store.presigned_url(preview['blob_key'], preview_name)
+        preview['file_path'] = self.blob_store.local_path(preview['blob_key'])
+        return preview
+
+    def get_eco_details(self, eco_id: int, username: Optional[str] = None) -> Optional[dict]:
+        with self._connect_read(username) as conn:
             conn.row_factory = sqlite3.Row
             c = conn.cursor()
             c.execute("""
-                SELECT e.id, e.title, e.description, e.status, e.created_at, e.updated_at,
-                       u.username AS created_by
+                SELECT e.id, e.title, e.description, e.status, e.version, e.created_at, e.updated_at,
+                       u.username AS created_by, e.quorum, e.approvals, e.rejections
                 FROM ecos e JOIN users u ON e.created_by = u.id
-                WHERE e.id = ?
+                WHERE e.id = ? AND e.deleted_at IS NULL
             """, (eco_id,))
             row = c.fetchone()
             if not row:
@@ -385,39 +1861,89 @@ class ECO:
             eco['history'] = [dict(r) for r in c.fetchall()]
 
             c.execute("""
-                SELECT a.id, filename, mime_type, file_path, file_size, uploaded_at, u.username AS uploaded_by
+                SELECT u.username, a.decision, a.decided_at
+                FROM eco_approvers a JOIN users u ON a.user_id = u.id
+                WHERE a.eco_id = ?
+                ORDER BY u.username
+            """, (eco_id,))
+            eco['approvers'] = [dict(r) for r in c.fetchall()]
+
+            c.execute("""
+                SELECT a.id, filename, a.mime_type, a.file_path, a.file_size, a.sha256, uploaded_at, a.corrupt_at,
+                       u.username AS uploaded_by, p.mime_type AS preview_mime_type
                 FROM attachments a JOIN users u ON a.uploaded_by = u.id
+                LEFT JOIN attachment_previews p ON a.sha256 = p.sha256
                 WHERE a.eco_id = ?
             """, (eco_id,))
             eco['attachments'] = [dict(r) for r in c.fetchall()]
             return eco
 
+    def eco_version(self, eco_id: int, username: Optional[str] = None) -> Optional[str]:
+        """Changes whenever ``get_eco_details`` would return something different.
+
+        Edits, workflow steps and uploads all append to the audit log; previews
+        are generated and attachments marked corrupt or intact later without
+        an entry, so the preview count and the corrupt attachments' count and
+        latest ``corrupt_at`` are included too. Returns None if the ECO does
+        not exist.
+        """
+        with self._connect_read(username) as conn:
+            row = conn.execute("""
+                SELECT (SELECT MAX(id) FROM audit_log WHERE eco_id = e.id),
+                       (SELECT COUNT(*) FROM attachments a JOIN attachment_previews p ON a.sha256 = p.sha256
+                        WHERE a.eco_id = e.id),
+                       (SELECT COUNT(corrupt_at) || '.' || COALESCE(MAX(corrupt_at), '')
+                        FROM attachments WHERE eco_id = e.id)
+                FROM ecos e WHERE e.id = ? AND e.deleted_at IS NULL
+            """, (eco_id,)).fetchone()
+            return f"{row[0]}.{row[1]}.{row[2]}" if row else None
+
     def list_ecos(
         self,
         limit: int = 50,
         offset: int = 0,
         search: Optional[str] = None,
         status: Optional[str] = None,
+        username: Optional[str] = None,
     ) -> List[Tuple[int, str, str, str]]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect_read(username) as conn:
             c = conn.cursor()
-            query = "SELECT e.id, e.title, e.status, e.created_at, u.username AS created_by FROM ecos e JOIN users u ON e.created_by = u.id"
-            conditions = []
-            params: list = []
-            if search:
-                conditions.append("(title LIKE ? OR description LIKE ?)")
-                pattern = f"%{search}%"
-                params.extend([pattern, pattern])
-            if status:
-                conditions.append("status = ?")
-                params.append(status)
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-            query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            c.execute(query, params)
+            where, params = self._list_filters(search, status)
+            # id breaks ties so offset windows never overlap or skip rows
+            query = ("SELECT e.id, e.title, e.status, e.created_at, u.username AS created_by "
+                     "FROM ecos e JOIN users u ON e.created_by = u.id"
+                     f" WHERE {where} ORDER BY e.created_at DESC, e.id DESC LIMIT ? OFFSET ?")
+            c.execute(query, params + [limit, offset])
             return c.fetchall()
 
+    def _list_filters(self, search: Optional[str], status: Optional[str]) -> Tuple[str, list]:
+        conditions = ["e.deleted_at IS NULL"]
+        params: list = []
+        if search:
+            condition, search_params = self.storage.text_search(["e.title", "e.description"], search)
+            conditions.append(condition)
+            params.extend(search_params)
+        if status:
+            conditions.append("e.status = ?")
+            params.append(status)
+        return " AND ".join(conditions), params
+
+    def count_ecos(self, search: Optional[str] = None, status: Optional[str] = None,
+                   username: Optional[str] = None) -> int:
+        """Number of ECOs ``list_ecos`` would page through with these filters."""
+        with self._connect_read(username) as conn:
+            where, params = self._list_filters(search, status)
+            return conn.execute(f"SELECT COUNT(*) FROM ecos e WHERE {where}", params).fetchone()[0]
+
+    def list_version(self, username: Optional[str] = None) -> int:
+        """Changes whenever any ECO is created, changed or deleted.
+
+        Every such change appends to the audit log, so its newest id serves
+        as a version that clients can cache list windows under.
+        """
+        with self._connect_read(username) as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM audit_log").fetchone()[0]
+
     def generate_report(self, eco_id: int, output_file: str) -> bool:
         data = self.get_eco_details(eco_id)
         if not data:
@@ -457,6 +1983,169 @@ class ECO:
         except IOError:
             return False
 
+    def enqueue_job(
+        self,
+        kind: str,
+        payload: Optional[dict] = None,
+        run_at: Optional[datetime.datetime] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        dedupe_key: Optional[str] = None,
+        username: Optional[str] = None,
+    ) -> int:
+        """Queue a job and return its id.
+
+        If ``dedupe_key`` matches a job that is still pending or running, no new
+        job is queued and the existing job's id is returned instead.
+        """
+        user_id = self.get_or_create_user(username) if username else None
+        now = datetime.datetime.now()
+        with self._connect() as conn:
+            c = conn.cursor()
+            while True:
+                try:
+                    c.execute("""
+                        INSERT INTO jobs (kind, payload, max_attempts, run_at, dedupe_key, created_by, created_at,
+                                          updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        RETURNING id
+                    """, (kind, json.dumps(payload or {}), max_attempts, (run_at or now).isoformat(),
+                          dedupe_key, user_id, now.isoformat(), now.isoformat()))
+                    job_id = c.fetchone()[0]
+                    conn.commit()
+                    return job_id
+                except sqlite3.IntegrityError:
+                    c.execute("SELECT id FROM jobs WHERE dedupe_key = ? AND status IN (?, ?)",
+                              (dedupe_key, JOB_PENDING, JOB_RUNNING))
+                    row = c.fetchone()
+                    if row:
+                        return row[0]
+                    # The job finished between the INSERT and the SELECT: queue a new one
+
+    def claim_job(self, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[dict]:
+        """Lease the next runnable job to ``worker_id``, or return None if there is none.
+
+        Jobs whose lease has run out are runnable again. The claim is a single
+        UPDATE, so concurrent workers in any number of processes never get the
+        same job.
+        """
+        now = datetime.datetime.now()
+        runnable = "(status = ? AND run_at <= ?) OR (status = ? AND lease_expires_at <= ?)"
+        runnable_params = (JOB_PENDING, now.isoformat(), JOB_RUNNING, now.isoformat())
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            # Cheap read first so idle workers don't take the write lock on every poll
+            c.execute(f"SELECT 1 FROM jobs WHERE {runnable} LIMIT 1", runnable_params)
+            if not c.fetchone():
+                return None
+            lease_expires_at = now + datetime.timedelta(seconds=lease_seconds)
+            c.execute(f"""
+                UPDATE jobs SET status = ?, locked_by = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ?
+                WHERE id = (SELECT id FROM jobs WHERE {runnable} ORDER BY run_at LIMIT 1)
+                RETURNING id, kind, payload, attempts, max_attempts
+            """, (JOB_RUNNING, worker_id, lease_expires_at.isoformat(), now.isoformat(), *runnable_params))
+            row = c.fetchone()
+            conn.commit()
+            if not row:
+                return None
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'])
+            return job
+
+    def extend_job_lease(self, job_id: int, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+        lease_expires_at = datetime.datetime.now() + datetime.timedelta(seconds=lease_seconds)
+        with self._connect() as conn:
+            c = conn.cursor()
+            c.execute("UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = ? AND locked_by = ?",
+                      (lease_expires_at.isoformat(), job_id, JOB_RUNNING, worker_id))
+            conn.commit()
+            return c.rowcount > 0
+
+    def complete_job(self, job_id: int, worker_id: str, result: Optional[dict] = None) -> bool:
+        """Mark a job done. Returns False if the worker no longer holds the lease."""
+        now = datetime.datetime.now().isoformat()
+        with self._connect() as conn:
+            c = conn.cursor()
+            c.execute("""
+                UPDATE jobs SET status = ?, result = ?, locked_by = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE id = ? AND status = ? AND locked_by = ?
+            """, (JOB_DONE, json.dumps(result), now, job_id, JOB_RUNNING, worker_id))
+            conn.commit()
+            return c.rowcount > 0
+
+    def fail_job(self, job_id: int, worker_id: str, error: str) -> bool:
+        """Record a failed attempt, scheduling a retry with backoff while attempts remain."""
+        now = datetime.datetime.now()
+        with self._connect() as conn:
+            c = conn.cursor()
+            c.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = ? AND locked_by = ?",
+                      (job_id, JOB_RUNNING, worker_id))
+            row = c.fetchone()
+            if not row:
+                return False
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                status = JOB_PENDING
+                run_at = now + datetime.timedelta(seconds=JOB_RETRY_DELAY * 2 ** (attempts - 1))
+            else:
+                status, run_at = JOB_FAILED, now
+            c.execute("""
+                UPDATE jobs SET status = ?, run_at = ?, last_error = ?, locked_by = NULL, lease_expires_at = NULL, updated_at = ?
+                WHERE id = ?
+            """, (status, run_at.isoformat(), error, now.isoformat(), job_id))
+            conn.commit()
+            return True
+
+    def purge_finished_jobs(self, retention: int = JOB_RETENTION,
+                            batch_size: int = JOB_PURGE_BATCH_SIZE) -> Tuple[int, List[str]]:
+        """Delete DONE and FAILED jobs last updated more than ``retention`` seconds ago.
+
+        Deletes in short batches like purge_expired_tokens. Returns the number
+        purged and the blob keys named in their results (e.g. generated
+        reports), which the caller may delete from the blob store.
+        """
+        cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=retention)).isoformat()
+        total, blob_keys = 0, []
+        while True:
+            with self._connect() as conn:
+                c = conn.cursor()
+                c.execute("""
+                    DELETE FROM jobs WHERE id IN (
+                        SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ? LIMIT ?
+                    )
+                    RETURNING result
+                """, (JOB_DONE, JOB_FAILED, cutoff, batch_size))
+                rows = c.fetchall()
+                conn.commit()
+            total += len(rows)
+            for (result,) in rows:
+                result = json.loads(result) if result else None
+                if isinstance(result, dict) and isinstance(result.get("blob_key"), str):
+                    blob_keys.append(result["blob_key"])
+            if len(rows) < batch_size:
+                break
+        if total:
+            logger.info("Purged %d finished jobs", total)
+        return total, blob_keys
+
+    def get_job(self, job_id: int) -> Optional[dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            c = conn.cursor()
+            c.execute("""
+                SELECT j.id, j.kind, j.payload, j.status, j.attempts, j.max_attempts, j.run_at, j.result,
+                       j.last_error, j.created_at, j.updated_at, u.username AS created_by
+                FROM jobs j LEFT JOIN users u ON j.created_by = u.id
+                WHERE j.id = ?
+            """, (job_id,))
+            row = c.fetchone()
+            if not row:
+                return None
+            job = dict(row)
+            job['payload'] = json.loads(job['payload'])
+            job['result'] = json.loads(job['result']) if job['result'] else None
+            return job
+
 # Example
 if __name__ == "__main__":  # pragma: no cover
     eco = ECO()
@@ -0,0 +1,442 @@
+"""Database maintenance: online backups, vacuuming, statistics and integrity checks.
+
+Every task works in short steps so it can run while the API is serving
+requests. The worker runs ``run_maintenance`` periodically; this module is
+also a command line tool:
+
+    python maintenance.py backup /var/backups/eco
+    python maintenance.py vacuum
+    python maintenance.py analyze
+    python maintenance.py check
+    python maintenance.py gc [--delete] [--limit N]
+    python maintenance.py scrub [--limit N] [--max-mb-per-s X]
+    python maintenance.py all --backup-dir /var/backups/eco
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import logging
+import os
+import sys
+import time
+from typing import Callable, Iterator, List, Optional
+
+from blobstore import blob_store_from_env
+from eco_manager import BLOB_DELETE_CLAIM_TIMEOUT, ECO
+from storage import BACKUP_PAGES_PER_STEP, storage_from_env
+
+logger = logging.getLogger(__name__)
+
+BACKUP_STEP_SLEEP = 0.05  # seconds paused after each backup step, holding no lock
+BACKUP_KEEP = 7  # backups kept in the backup directory
+VACUUM_PAGES_PER_STEP = 256  # pages freed per incremental_vacuum transaction
+VACUUM_STEP_SLEEP = 0.05
+ANALYSIS_LIMIT = 1000  # rows sampled per index by PRAGMA optimize
+MAX_REPORTED_ERRORS = 20
+GC_GRACE_PERIOD = 3600  # seconds; newer blobs may belong to an upload still in progress
+GC_BATCH_SIZE = 100  # orphans deleted per batch
+GC_BATCH_SLEEP = 0.1  # seconds between delete batches
+GC_DB_PAGE_SIZE = 1000  # attachment keys read per query during the merge
+GC_CHECKPOINT = "attachment_gc"
+SCRUB_MAX_MB_PER_S = float(os.environ.get("SCRUB_MAX_MB_PER_S", 10))  # read rate the scrub stays under (0: unlimited)
+SCRUB_CHUNK_SIZE = 256 * 1024  # bytes read between rate checks
+SCRUB_PAGE_SIZE = 100  # attachments read per query, and between checkpoints
+SCRUB_CHECKPOINT = "attachment_scrub"
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _timed(func: Callable[..., dict], *args, **kwargs) -> dict:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def backup(eco: ECO, backup_dir: str, keep: int = BACKUP_KEEP,
+           pages: int = BACKUP_PAGES_PER_STEP, sleep: float = BACKUP_STEP_SLEEP) -> dict:
+    """Write a timestamped copy of the database to ``backup_dir`` and prune old copies."""
+    if eco.storage.dialect != "sqlite":
+        return {"skipped": "back up PostgreSQL with pg_dump or its continuous archiving"}
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(eco.db_path))[0]
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    dest = os.path.join(backup_dir, f"{stem}-{stamp}.db")
+    eco.storage.backup(dest, pages=pages, sleep=sleep)
+    # Timestamps sort chronologically, so everything before the last `keep` is old
+    removed = sorted(glob.glob(os.path.join(backup_dir, f"{stem}-*.db")))[:-keep]
+    for path in removed:
+        os.remove(path)
+    return {"path": dest, "bytes": os.path.getsize(dest), "removed": len(removed)}
+
+
+def vacuum(eco: ECO, pages_per_step: int = VACUUM_PAGES_PER_STEP, sleep: float = VACUUM_STEP_SLEEP) -> dict:
+    """Return free pages to the filesystem a few at a time.
+
+    Needs ``auto_vacuum=INCREMENTAL``, which new databases get. Older
+    databases are converted once with ``convert_to_incremental``.
+    """
+    if eco.storage.dialect != "sqlite":
+        return {"freed_pages": 0, "skipped": "PostgreSQL reclaims free space with autovacuum"}
+    with eco._connect() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return {"freed_pages": 0, "skipped": "auto_vacuum is not INCREMENTAL; run 'vacuum --full' once"}
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        start_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        remaining = start_pages
+        while remaining:
+            # Each call is its own short write transaction
+            conn.execute(f"PRAGMA incremental_vacuum({pages_per_step:d})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining:
+                time.sleep(sleep)
+    freed = start_pages - remaining
+    return {"freed_pages": freed, "freed_bytes": freed * page_size}
+
+
+def convert_to_incremental(eco: ECO) -> dict:
+    """Switch an existing database to incremental auto-vacuum.
+
+    This rewrites the whole file with VACUUM and blocks writers while it runs,
+    so it is a one-off for a maintenance window.
+    """
+    if eco.storage.dialect != "sqlite":
+        return {"skipped": "PostgreSQL reclaims free space with autovacuum"}
+    with eco._connect(isolation_level=None) as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    return {"auto_vacuum": "INCREMENTAL"}
+
+
+def analyze(eco: ECO, full: bool = False) -> dict:
+    """Refresh query planner statistics.
+
+    By default this runs ``PRAGMA optimize`` with a sampling limit, which only
+    analyzes tables whose statistics are out of date. ``full`` runs a complete
+    ANALYZE.
+    """
+    with eco._connect() as conn:
+        if full or eco.storage.dialect != "sqlite":
+            conn.execute("ANALYZE")
+        else:
+            conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT:d}")
+            conn.execute("PRAGMA optimize")
+        conn.commit()
+    return {"full": full}
+
+
+def check(eco: ECO) -> dict:
+    """Check database structure, the audit hash chain, and that every attachment has an intact file.
+
+    The structure check is SQLite's; PostgreSQL checks its own pages as it reads them.
+    """
+    errors, missing, checked = [], [], 0
+    with eco._connect() as conn:
+        if eco.storage.dialect == "sqlite":
+            errors = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        corrupt = conn.execute("SELECT COUNT(*) FROM attachments WHERE corrupt_at IS NOT NULL").fetchone()[0]
+        for eco_id, filename, key in eco.storage.iterate(
+                conn, "SELECT eco_id, filename, blob_key FROM attachments ORDER BY id"):
+            checked += 1
+            if not eco.blob_store.exists(key):
+                missing.append(f"ECO {eco_id}: {filename}")
+    if errors == ["ok"]:
+        errors = []
+    audit = eco.verify_audit_chain()
+    return {
+        "ok": not errors and not missing and not corrupt and audit["ok"],
+        "database_errors": errors[:MAX_REPORTED_ERRORS],
+        "attachments_checked": checked,
+        "missing_attachments": missing[:MAX_REPORTED_ERRORS],
+        "missing_count": len(missing),
+        "corrupt_count": corrupt,  # found by the scrub or verified downloads
+        "audit_entries_checked": audit["checked"],
+        "audit_first_bad_id": audit["first_bad_id"],
+    }
+
+
+def _get_state(eco: ECO, name: str) -> Optional[str]:
+    with eco._connect() as conn:
+        row = conn.execute("SELECT value FROM maintenance_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(eco: ECO, name: str, value: str) -> None:
+    with eco._connect() as conn:
+        conn.execute("""
+            INSERT INTO maintenance_state (name, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """, (name, value, datetime.datetime.now().isoformat()))
+        conn.commit()
+
+
+def _attachment_keys(eco: ECO, start_after: str) -> Iterator[str]:
+    """Blob keys referenced by the attachments table, in order, a page per query."""
+    while True:
+        with eco._connect() as conn:
+            keys = [row[0] for row in conn.execute(
+                "SELECT DISTINCT blob_key FROM attachments WHERE blob_key > ? ORDER BY blob_key LIMIT ?",
+                (start_after, GC_DB_PAGE_SIZE),
+            )]
+        yield from keys
+        if len(keys) < GC_DB_PAGE_SIZE:
+            return
+        start_after = keys[-1]
+
+
+def _delete_orphans(eco: ECO, keys: List[str]) -> int:
+    # Check again just before deleting, in the same short transaction that
+    # claims the keys: an upload may have claimed one since the scan, and an
+    # upload of a key the GC has claimed waits until the claim is released.
+    # The blobs are deleted after the commit, holding no database lock.
+    started = time.monotonic()
+    with eco._connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        placeholders = ",".join("?" * len(keys))
+        claimed = {row[0] for row in conn.execute(f"""
+            SELECT blob_key FROM attachments WHERE blob_key IN ({placeholders})
+            UNION SELECT blob_key FROM blob_uploads WHERE blob_key IN ({placeholders})
+        """, keys + keys)}
+        keys = [key for key in keys if key not in claimed]
+        now = datetime.datetime.now().isoformat()
+        claims = [conn.execute("INSERT INTO blob_uploads (blob_key, started_at, deleting) VALUES (?, ?, 1) RETURNING id",
+                               (key, now)).fetchone()[0] for key in keys]
+        conn.commit()
+    deleted = 0
+    try:
+        for key in keys:
+            if time.monotonic() - started > BLOB_DELETE_CLAIM_TIMEOUT:
+                # Uploads no longer wait for the claims; leave the rest for the next run
+                logger.warning("Attachment GC ran out of time deleting orphaned blobs")
+                break
+            try:
+                eco.blob_store.delete(key)
+                deleted += 1
+            except OSError:
+                logger.warning("Could not delete orphaned attachment blob '%s'", key)
+    finally:
+        eco._release_blob_keys(claims)
+    return deleted
+
+
+def _expire_upload_claims(eco: ECO, cutoff: float) -> None:
+    # Claims outlive uploads that crashed before releasing them
+    with eco._connect() as conn:
+        conn.execute("DELETE FROM blob_uploads WHERE started_at < ?",
+                     (datetime.datetime.fromtimestamp(cutoff).isoformat(),))
+        conn.commit()
+
+
+def collect_garbage(
+    eco: ECO,
+    delete: bool = False,
+    limit: Optional[int] = None,
+    batch_size: int = GC_BATCH_SIZE,
+    sleep: float = GC_BATCH_SLEEP,
+    grace_period: float = GC_GRACE_PERIOD,
+) -> dict:
+    """Find (and with ``delete``, remove) attachment blobs no attachment row refers to.
+
+    The blob listing and the attachments table are both walked in key order
+    and merged, so memory use does not grow with the number of attachments.
+    Blobs modified within ``grace_period``, and keys an upload in progress has
+    claimed, are left alone because their attachment row may not have been
+    committed yet. With ``limit``, at most that many blobs are examined and the
+    next run resumes where this one stopped. Deleting also removes the
+    temporary files and claims of uploads that were interrupted.
+    """
+    start_after = (_get_state(eco, GC_CHECKPOINT) or "") if limit is not None else ""
+    cutoff = time.time() - grace_period
+    db_keys = _attachment_keys(eco, start_after)
+    db_key = next(db_keys, None)
+    scanned = missing = deleted = 0
+    orphans, batch = [], []
+    last_key, complete = start_after, True
+    for key, mtime in eco.blob_store.iter_blobs(start_after):
+        if limit is not None and scanned >= limit:
+            complete = False
+            break
+        scanned += 1
+        last_key = key
+        while db_key is not None and db_key < key:
+            missing += 1  # Attachment row without a blob
+            db_key = next(db_keys, None)
+        if db_key == key:
+            db_key = next(db_keys, None)
+            continue
+        if mtime > cutoff:
+            continue
+        orphans.append(key)
+        if delete:
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += _delete_orphans(eco, batch)
+                batch = []
+                time.sleep(sleep)
+    if complete:
+        missing += (db_key is not None) + sum(1 for _ in db_keys)
+    if batch:
+        deleted += _delete_orphans(eco, batch)
+    partial = 0
+    if delete:
+        _expire_upload_claims(eco, cutoff)
+    remove_partial_writes = getattr(eco.blob_store, "remove_partial_writes", None)
+    if delete and remove_partial_writes is not None:
+        partial = remove_partial_writes(cutoff)
+    if limit is not None:
+        _set_state(eco, GC_CHECKPOINT, "" if complete else last_key)
+    if orphans:
+        logger.info("Attachment GC found %d orphaned blobs, deleted %d", len(orphans), deleted)
+    return {
+        "scanned": scanned,
+        "orphans": len(orphans),
+        "orphan_keys": orphans[:MAX_REPORTED_ERRORS],
+        "deleted": deleted,
+        "missing_blobs": missing,
+        "partial_writes_removed": partial,
+        "complete": complete,
+    }
+
+
+class _Pacer:
+    """Sleeps as needed to keep the bytes read since it was created under a rate."""
+
+    def __init__(self, bytes_per_second: float):
+        self.bytes_per_second = bytes_per_second
+        self.start = time.monotonic()
+        self.total = 0
+
+    def consumed(self, count: int) -> None:
+        self.total += count
+        if self.bytes_per_second <= 0:
+            return
+        ahead = self.total / self.bytes_per_second - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _paced_sha256(path, pacer: _Pacer) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(SCRUB_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            pacer.consumed(len(chunk))
+    return digest.hexdigest()
+
+
+def scrub_attachments(eco: ECO, limit: Optional[int] = None, max_mb_per_s: float = SCRUB_MAX_MB_PER_S) -> dict:
+    """Re-read attachment blobs and check them against their recorded SHA-256.
+
+    Reads are paced to stay under ``max_mb_per_s`` so live traffic keeps its
+    I/O. With ``limit``, at most that many attachments are checked and the
+    next run carries on from the checkpoint kept in maintenance_state,
+    starting over once it reaches the end. Damaged or missing blobs
+    are marked on their attachment row (``corrupt_at``) and logged.
+    """
+    start_after = int(_get_state(eco, SCRUB_CHECKPOINT) or 0) if limit is not None else 0
+    pacer = _Pacer(max_mb_per_s * 1024 * 1024)
+    checked = 0
+    corrupt: List[str] = []
+    last_id, complete = start_after, True
+    while complete:
+        with eco._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, eco_id, filename, blob_key, sha256 FROM attachments WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, SCRUB_PAGE_SIZE),
+            ).fetchall()
+        for attachment_id, eco_id, filename, blob_key, expected in rows:
+            if limit is not None and checked >= limit:
+                complete = False
+                break
+            try:
+                with eco.blob_store.local_file(blob_key) as path:
+                    actual = _paced_sha256(path, pacer)
+            except OSError:
+                actual = None
+            if not eco.record_attachment_check(attachment_id, expected, actual):
+                corrupt.append(f"ECO {eco_id}: {filename}")
+            checked += 1
+            last_id = attachment_id
+        if len(rows) < SCRUB_PAGE_SIZE:
+            break
+        _set_state(eco, SCRUB_CHECKPOINT, str(last_id))
+    _set_state(eco, SCRUB_CHECKPOINT, str(last_id) if not complete else "0")
+    elapsed = time.monotonic() - pacer.start
+    return {
+        "checked": checked,
+        "corrupt": len(corrupt),
+        "corrupt_attachments": corrupt[:MAX_REPORTED_ERRORS],
+        "mb_read": round(pacer.total / (1024 * 1024), 1),
+        "mb_per_s": round(pacer.total / (1024 * 1024) / elapsed, 1) if elapsed else 0.0,
+        "complete": complete,
+    }
+
+
+def run_maintenance(eco: ECO, backup_dir: Optional[str] = None) -> dict:
+    """Run every maintenance task and return their results with timings."""
+    results = {}
+    if backup_dir:
+        results["backup"] = _timed(backup, eco, backup_dir)
+    results["vacuum"] = _timed(vacuum, eco)
+    results["analyze"] = _timed(analyze, eco)
+    results["check"] = _timed(check, eco)
+    if not results["check"]["ok"]:
+        logger.warning("Maintenance check found problems: %s", results["check"])
+    return results
+
+
+def _print_result(task: str, result: dict) -> None:
+    seconds = result.pop("seconds")
+    details = ", ".join(f"{k}={v}" for k, v in result.items())
+    print(f"{task:<8} {seconds:>8.3f}s  {details}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="ECO Manager database maintenance")
+    sub = parser.add_subparsers(dest="task", required=True)
+    p = sub.add_parser("backup", help="online backup to a timestamped file")
+    p.add_argument("backup_dir")
+    p.add_argument("--keep", type=int, default=BACKUP_KEEP, help="backups to keep")
+    p = sub.add_parser("vacuum", help="release free pages incrementally")
+    p.add_argument("--full", action="store_true",
+                   help="one-off blocking VACUUM that enables incremental vacuum on older databases")
+    p = sub.add_parser("analyze", help="refresh query planner statistics")
+    p.add_argument("--full", action="store_true", help="run a complete ANALYZE")
+    sub.add_parser("check", help="database and attachment integrity check")
+    p = sub.add_parser("gc", help="report orphaned attachment blobs")
+    p.add_argument("--delete", action="store_true", help="delete the orphans found")
+    p.add_argument("--limit", type=int, help="examine at most this many blobs, resuming from the last run")
+    p = sub.add_parser("scrub", help="verify attachment blobs against their SHA-256")
+    p.add_argument("--limit", type=int, help="check at most this many attachments, resuming from the last run")
+    p.add_argument("--max-mb-per-s", type=float, default=SCRUB_MAX_MB_PER_S, help="read rate limit (0: unlimited)")
+    p = sub.add_parser("all", help="every task (backup only with --backup-dir)")
+    p.add_argument("--backup-dir")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    attachments_dir = os.environ.get("ATTACHMENTS_DIR", "attachments")
+    eco = ECO(
+        storage=storage_from_env(),
+        attachments_dir=attachments_dir,
+        blob_store=blob_store_from_env(attachments_dir),
+        token_secret=os.environ.get("TOKEN_SECRET"),
+    )
+
+    if args.task == "all":
+        results = run_maintenance(eco, args.backup_dir)
+    elif args.task == "backup":
+        results = {"backup": _timed(backup, eco, args.backup_dir, keep=args.keep)}
+    elif args.task == "vacuum":
+        results = {"vacuum": _timed(convert_to_incremental if args.full else vacuum, eco)}
+    elif args.task == "analyze":
+        results = {"analyze": _timed(analyze, eco, full=args.full)}
+    elif args.task == "gc":
+        results = {"gc": _timed(collect_garbage, eco, delete=args.delete, limit=args.limit)}
+    elif args.task == "scrub":
+        results = {"scrub": _timed(scrub_attachments, eco, limit=args.limit, max_mb_per_s=args.max_mb_per_s)}
+    else:
+        results = {"check": _timed(check, eco)}
+    for task, result in results.items():
+        _print_result(task, result)
+    sys.exit(0 if results.get("check", {}).get("ok", True) else 1)
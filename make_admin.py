@@ -2,16 +2,17 @@ import os
 import sys
 
 from eco_manager import ECO
+from storage import storage_from_env
 
 
 def promote_user(username: str) -> None:
-    db_path = os.environ.get("DATABASE_PATH", "eco_system.db")
+    storage = storage_from_env()
 
-    if not os.path.exists(db_path):
-        print(f"Database not found at {db_path}")
+    if storage.dialect == "sqlite" and not os.path.exists(storage.path):
+        print(f"Database not found at {storage.path}")
         sys.exit(1)
 
-    eco = ECO(db_path=db_path)
+    eco = ECO(storage=storage, token_secret=os.environ.get("TOKEN_SECRET"))
     users = eco.get_all_users()
     user = next((u for u in users if u["username"] == username), None)
 
@@ -23,8 +24,7 @@ def promote_user(username: str) -> None:
         print(f"User '{username}' is already an admin.")
         return
 
-    import sqlite3
-    with sqlite3.connect(db_path) as conn:
+    with eco._connect() as conn:
         c = conn.cursor()
         c.execute("UPDATE users SET is_admin = 1 WHERE username = ?", (username,))
         conn.commit()
@@ -0,0 +1,79 @@
+"""Preview derivatives for attachments.
+
+Previews are small stand-ins for an attachment: a thumbnail for images and a
+text excerpt for text files and PDFs. Image thumbnails need Pillow and PDF
+excerpts need pypdf; both are optional (``pip install ecomanager[previews]``)
+and attachments of that type simply get no preview without them.
+"""
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+    UnidentifiedImageError = ()
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - optional dependency
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (320, 320)
+TEXT_PREVIEW_BYTES = 4096
+
+
+def _image_preview(src: Path, dest_stem: Path) -> Optional[Tuple[Path, str]]:
+    if Image is None:
+        return None
+    dest = dest_stem.with_suffix(".jpg")
+    try:
+        with Image.open(src) as img:
+            img.thumbnail(THUMBNAIL_SIZE)
+            img.convert("RGB").save(dest, "JPEG", quality=80, optimize=True)
+    except (UnidentifiedImageError, OSError):
+        # Formats Pillow cannot read, such as SVG or HEIC, or a damaged file
+        logger.info("No thumbnail for %s: not an image Pillow can read", src.name)
+        return None
+    return dest, "image/jpeg"
+
+
+def _text_excerpt(text: str, dest_stem: Path) -> Tuple[Path, str]:
+    dest = dest_stem.with_suffix(".txt")
+    excerpt = text.encode("utf-8")[:TEXT_PREVIEW_BYTES].decode("utf-8", errors="ignore")
+    dest.write_text(excerpt, encoding="utf-8")
+    return dest, "text/plain"
+
+
+def _text_preview(src: Path, dest_stem: Path) -> Tuple[Path, str]:
+    with open(src, "rb") as f:
+        head = f.read(TEXT_PREVIEW_BYTES)
+    return _text_excerpt(head.decode("utf-8", errors="replace"), dest_stem)
+
+
+def _pdf_preview(src: Path, dest_stem: Path) -> Optional[Tuple[Path, str]]:
+    if PdfReader is None:
+        return None
+    reader = PdfReader(src)
+    if not reader.pages:
+        return None
+    return _text_excerpt(reader.pages[0].extract_text() or "", dest_stem)
+
+
+def generate_preview(src: Path, mime_type: str, dest_stem: Path) -> Optional[Tuple[Path, str]]:
+    """Write a preview of ``src`` next to ``dest_stem`` and return (path, MIME type).
+
+    Returns None when the type is not previewable or the optional library it
+    needs is not installed.
+    """
+    dest_stem.parent.mkdir(parents=True, exist_ok=True)
+    if mime_type.startswith("image/"):
+        return _image_preview(src, dest_stem)
+    if mime_type == "application/pdf":
+        return _pdf_preview(src, dest_stem)
+    if mime_type.startswith("text/"):
+        return _text_preview(src, dest_stem)
+    return None
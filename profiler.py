@@ -0,0 +1,120 @@
+"""Statistical profiler for a running API process.
+
+Samples the stack of every thread at a fixed interval with
+``sys._current_frames()`` and counts identical stacks, producing the
+collapsed-stack format read by flamegraph.pl, speedscope and similar tools.
+It needs nothing beyond the standard library, so it works in the stock
+image and can be switched on in a live worker without a restart.
+
+Only one profile runs per process at a time. Sampling backs off when taking
+samples costs more than MAX_OVERHEAD of the wall time, so a busy process is
+never slowed by more than that.
+
+Configuration (environment):
+    PROFILER_ENABLED      set to 1 to allow profiling through the API
+    PROFILE_MAX_SECONDS   longest profile that may be requested
+"""
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 60))
+DEFAULT_INTERVAL = 0.01  # seconds between samples
+MIN_INTERVAL = 0.001
+MAX_OVERHEAD = 0.02  # share of wall time sampling may use before it backs off
+MAX_STACKS = 5000  # distinct stacks kept; further new stacks are counted as [truncated]
+MAX_DEPTH = 128  # frames kept per stack, innermost first
+
+# Stacks in "app" scope start at the first frame in one of these modules
+APP_MODULES = ("api.py", "eco_manager.py")
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # Collapsed-stack format separates frames with ';' and ends with ' <count>'
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(";", ":").replace(" ", "_")
+
+
+def _is_app_frame(frame) -> bool:
+    filename = frame.f_code.co_filename
+    return os.path.dirname(os.path.abspath(filename)) == _APP_DIR and os.path.basename(filename) in APP_MODULES
+
+
+def _collapse(frame, scope: str) -> Optional[str]:
+    frames = []
+    while frame is not None and len(frames) < MAX_DEPTH:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    if scope == "app":
+        first = next((i for i, f in enumerate(frames) if _is_app_frame(f)), None)
+        if first is None:
+            return None  # Idle threads and library internals
+        frames = frames[first:]
+    return ";".join(_frame_label(f) for f in frames)
+
+
+def sample(seconds: float, interval: float = DEFAULT_INTERVAL, scope: str = "app") -> Optional[Dict]:
+    """Sample this process for ``seconds`` and return the collapsed stacks.
+
+    ``scope`` is "app" for stacks that pass through the API handlers or the
+    ECO layer (trimmed to start there), or "all" for every thread.
+
+    Returns None if another profile is already running, otherwise
+    ``{"stacks": {stack: count}, "samples", "seconds", "overhead"}``.
+    """
+    if scope not in ("app", "all"):
+        raise ValueError(f"Unknown profile scope '{scope}'")
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        return _sample(min(seconds, PROFILE_MAX_SECONDS), max(interval, MIN_INTERVAL), scope)
+    finally:
+        _lock.release()
+
+
+def _sample(seconds: float, interval: float, scope: str) -> Dict:
+    me = threading.get_ident()
+    stacks: Dict[str, int] = {}
+    samples = 0
+    busy = 0.0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        tick = time.perf_counter()
+        if tick >= deadline:
+            break
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = _collapse(frame, scope)
+            if stack is None:
+                continue
+            if stack not in stacks and len(stacks) >= MAX_STACKS:
+                stack = "[truncated]"
+            stacks[stack] = stacks.get(stack, 0) + 1
+        samples += 1
+        cost = time.perf_counter() - tick
+        busy += cost
+        # Stretch the interval so sampling stays under MAX_OVERHEAD
+        time.sleep(max(interval, cost / MAX_OVERHEAD - cost))
+    elapsed = time.perf_counter() - start
+    return {
+        "stacks": stacks,
+        "samples": samples,
+        "seconds": round(elapsed, 3),
+        "overhead": round(busy / elapsed, 4) if elapsed else 0.0,
+    }
+
+
+def collapsed(stacks: Dict[str, int]) -> str:
+    """Render stacks as collapsed-stack text, most frequent first."""
+    lines: List[str] = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1])]
+    return "\n".join(lines) + ("\n" if lines else "")
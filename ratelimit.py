@@ -0,0 +1,158 @@
+"""Rate limiting state for the API.
+
+Each request falls into a route class (see ``classify``) and each client, the
+user behind a valid API token or else the client's IP address, gets a token
+bucket per class. Buckets live in process memory by default, or in a small SQLite
+file shared by every worker process on the host (``SQLiteBuckets``).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Route class: (sustained requests per second, burst size)
+ROUTE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "auth": (0.2, 5),  # every login is a bcrypt check
+    "search": (2.0, 10),
+    "report": (0.5, 5),
+    "upload": (1.0, 10),
+    "write": (5.0, 20),
+    "read": (20.0, 60),
+}
+# Classes that also need a slot under the per-process concurrency cap
+EXPENSIVE_CLASSES = frozenset({"search", "report", "upload"})
+
+MAX_MEMORY_BUCKETS = 100_000  # full buckets are evicted past this
+SQLITE_PRUNE_EVERY = 10_000  # takes per process between prunes of idle buckets
+
+
+def classify(method: str, path: str, has_search: bool = False) -> Optional[str]:
+    """Route class of a request, or None if it is not rate limited."""
+    if method == "OPTIONS" or path in ("/", "/health") or path.startswith("/static/"):
+        return None
+    if path in ("/token", "/register"):
+        return "auth"
+    if path.endswith("/report") or path.endswith("/report/jobs"):
+        return "report"
+    if method == "POST" and path.endswith(("/attachments", "/attachments/batch")):
+        return "upload"
+    if method == "GET" and path == "/ecos" and has_search:
+        return "search"
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+def client_key(user_id: Optional[int], ip: Optional[str]) -> str:
+    # Only a validated token may choose the bucket: keying on whatever token
+    # header was sent would give a client a fresh bucket per made-up token
+    if user_id is not None:
+        return f"u:{user_id}"
+    return f"ip:{ip or 'unknown'}"
+
+
+class MemoryBuckets:
+    """Token buckets in this process's memory."""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take one token; returns 0 on success, otherwise seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._evict(now)
+            return 0.0
+
+    def _evict(self, now: float) -> None:
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < _full_refill_seconds()}
+
+
+def _full_refill_seconds() -> float:
+    # A bucket idle this long is full again, which is the same as no bucket
+    return max(burst / rate for rate, burst in ROUTE_LIMITS.values())
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file, shared by every process that opens it.
+
+    This is throwaway state kept apart from the application database, so it
+    trades durability for speed (synchronous=OFF).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take one token; returns 0 on success, otherwise seconds until one is available.
+
+        Fails open: if the bucket file is unavailable the request is allowed.
+        """
+        try:
+            return self._take(key, rate, burst)
+        except sqlite3.Error:
+            logger.warning("Rate limit store %s unavailable; allowing request", self.path, exc_info=True)
+            return 0.0
+
+    def _take(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        conn = self._connect()
+        # A single statement, so the refill-and-take is atomic across processes
+        rows = conn.execute("""
+            INSERT INTO rate_buckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = min(:burst, tokens + (:now - updated) * :rate) - 1, updated = :now
+            WHERE min(:burst, tokens + (:now - updated) * :rate) >= 1
+            RETURNING tokens
+        """, {"key": key, "burst": burst, "now": now, "rate": rate}).fetchall()
+        self._takes += 1
+        if self._takes % SQLITE_PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - _full_refill_seconds(),))
+        if rows:
+            return 0.0
+        row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0.0  # Pruned by another process in the meantime
+        tokens = min(burst, row[0] + (now - row[1]) * rate)
+        return max((1 - tokens) / rate, 0.001)
+
+
+def buckets_from_env():
+    """Bucket store selected by RATE_LIMIT_BACKEND: memory (default), sqlite or off."""
+    backend = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    if backend == "memory":
+        return MemoryBuckets()
+    if backend == "sqlite":
+        return SQLiteBuckets(os.environ.get("RATE_LIMIT_DB", "rate_limits.db"))
+    if backend == "off":
+        return None
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}'")
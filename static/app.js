@@ -15,6 +15,103 @@ function showToast(message, type = 'success') {
     setTimeout(() => toast.remove(), 3000);
 }
 
+// Data layer
+//
+// Dashboard requests go through apiFetch, which adds the API token and signs
+// out on 401. GETs made with apiGet are also
+//  - de-duplicated: identical requests in flight share one fetch;
+//  - cancellable: requests tagged with a channel are aborted together by
+//    abortChannel, so a superseded query cannot land after a newer one;
+//  - cached: responses with an ETag are kept and revalidated with
+//    If-None-Match, and callers passing onUpdate get the cached copy at once
+//    while it is revalidated (stale-while-revalidate).
+const CACHE_FRESH_MS = 2000; // cached responses younger than this are used without asking the server
+const CACHE_MAX_ENTRIES = 300;
+const responseCache = new Map(); // path -> { etag, data, headers, fetchedAt }
+const inFlight = new Map();      // path -> Promise of a cache entry
+const channels = new Map();      // channel -> Set of AbortControllers
+
+async function apiFetch(path, options = {}) {
+    const headers = Object.assign({ 'X-API-Token': localStorage.getItem('eco_token') }, options.headers);
+    const res = await fetch(`${API_URL}${path}`, Object.assign({}, options, { headers }));
+    if (res.status === 401) logout();
+    if (res.ok && options.method && options.method !== 'GET') markCacheStale();
+    return res;
+}
+
+// After a change, cached responses are revalidated before they are used again
+function markCacheStale(prefix = '') {
+    responseCache.forEach((entry, path) => {
+        if (path.startsWith(prefix)) entry.fetchedAt = 0;
+    });
+}
+
+function isAbort(err) {
+    return err && err.name === 'AbortError';
+}
+
+function abortChannel(channel) {
+    const controllers = channels.get(channel);
+    if (!controllers) return;
+    controllers.forEach(controller => controller.abort());
+    channels.delete(channel);
+}
+
+async function apiGet(path, { channel = null, onUpdate = null } = {}) {
+    const cached = responseCache.get(path);
+    if (cached && Date.now() - cached.fetchedAt < CACHE_FRESH_MS) return cached;
+    if (cached && onUpdate) {
+        revalidate(path, channel)
+            .then(entry => { if (entry.etag !== cached.etag) onUpdate(entry); })
+            .catch(err => { if (!isAbort(err)) console.warn(err); });
+        return cached;
+    }
+    return revalidate(path, channel);
+}
+
+function revalidate(path, channel) {
+    if (inFlight.has(path)) return inFlight.get(path);
+    const controller = new AbortController();
+    if (channel) {
+        if (!channels.has(channel)) channels.set(channel, new Set());
+        channels.get(channel).add(controller);
+    }
+    const cached = responseCache.get(path);
+    const request = (async () => {
+        const res = await apiFetch(path, {
+            headers: cached && cached.etag ? { 'If-None-Match': cached.etag } : {},
+            signal: controller.signal,
+            cache: 'no-store', // this layer is the cache
+        });
+        if (res.status === 304 && cached) {
+            cached.fetchedAt = Date.now();
+            return cached;
+        }
+        if (!res.ok) throw new Error(`Request failed (${res.status})`);
+        const entry = {
+            etag: res.headers.get('ETag'),
+            data: await res.json(),
+            headers: Object.fromEntries(res.headers.entries()),
+            fetchedAt: Date.now(),
+        };
+        if (entry.etag) cacheResponse(path, entry);
+        return entry;
+    })().finally(() => {
+        inFlight.delete(path);
+        if (channel && channels.has(channel)) channels.get(channel).delete(controller);
+    });
+    inFlight.set(path, request);
+    return request;
+}
+
+function cacheResponse(path, entry) {
+    responseCache.delete(path); // Re-insert so Map order tracks recency
+    responseCache.set(path, entry);
+    if (responseCache.size > CACHE_MAX_ENTRIES) {
+        responseCache.delete(responseCache.keys().next().value);
+    }
+}
+
 // Auth
 function toggleAuth() {
     const login = document.getElementById('login-form');
@@ -91,42 +188,50 @@ function logout() {
 }
 
 // Dashboard
+//
+// The ECO table scrolls virtually: only the rows in view (plus ECO_OVERSCAN
+// either side) exist in the DOM. Rows are fetched in blocks as they come into
+// view and cached under the server's list version, and re-renders reuse each
+// ECO's <tr> instead of rebuilding the table.
+const ECO_ROW_HEIGHT = 56; // px; must match .eco-table tbody tr in style.css
+const ECO_BLOCK_SIZE = 100; // rows per fetch
+const ECO_OVERSCAN = 10;
+const ECO_MAX_BLOCKS = 50; // cached blocks; the furthest from view are dropped
+const ECO_FETCH_DELAY = 100; // ms scrolling must pause before off-screen blocks are fetched
+
 let searchTimeout = null;
-let currentPage = 0;
 
-function getPerPage() {
-    const el = document.getElementById('per-page');
-    return el ? parseInt(el.value, 10) : 50;
-}
+const ecoList = {
+    key: null,           // filters the cache belongs to
+    generation: 0,       // bumped by loadECOs; older responses are ignored
+    version: null,       // X-List-Version of the cached blocks
+    total: null,         // X-Total-Count for the current version
+    needCount: true,     // next fetch should ask for X-Total-Count
+    counting: false,     // a fetch asking for it is in flight
+    blocks: new Map(),   // block index -> ECOs at the current version
+    stale: new Map(),    // blocks from an older version, shown until replaced
+    pending: new Map(),  // block index -> in-flight fetch
+    rows: new Map(),     // row key -> rendered <tr>
+    frame: null,
+    fetchTimer: null,
+};
 
 function initSearch() {
     const searchInput = document.getElementById('search-input');
     const statusFilter = document.getElementById('status-filter');
-    const perPage = document.getElementById('per-page');
     if (!searchInput) return;
 
     searchInput.addEventListener('input', () => {
         clearTimeout(searchTimeout);
-        currentPage = 0;
         searchTimeout = setTimeout(loadECOs, 300);
     });
-    statusFilter.addEventListener('change', () => { currentPage = 0; loadECOs(); });
-    perPage.addEventListener('change', () => { currentPage = 0; loadECOs(); });
-}
-
-function changePage(direction) {
-    currentPage += direction;
-    if (currentPage < 0) currentPage = 0;
-    loadECOs();
+    statusFilter.addEventListener('change', loadECOs);
+    document.getElementById('eco-scroll').addEventListener('scroll', scheduleEcoRender, { passive: true });
+    window.addEventListener('resize', scheduleEcoRender);
 }
 
-async function loadECOs() {
-    const token = localStorage.getItem('eco_token');
-    const limit = getPerPage();
-    const offset = currentPage * limit;
+function ecoFilterParams() {
     const params = new URLSearchParams();
-    params.set('limit', limit);
-    params.set('offset', offset);
     const searchInput = document.getElementById('search-input');
     const statusFilter = document.getElementById('status-filter');
     if (searchInput && searchInput.value.trim()) {
@@ -135,89 +240,296 @@ async function loadECOs() {
     if (statusFilter && statusFilter.value) {
         params.set('status', statusFilter.value);
     }
+    return params;
+}
 
-    const tbody = document.getElementById('eco-list');
-    // Show loading state
-    tbody.innerHTML = '';
-    const loadingRow = document.createElement('tr');
-    loadingRow.className = 'loading-row';
-    const loadingTd = document.createElement('td');
-    loadingTd.colSpan = 6;
-    loadingTd.innerHTML = '<span class="spinner"></span> Loading...';
-    loadingRow.appendChild(loadingTd);
-    tbody.appendChild(loadingRow);
-
-    const url = `${API_URL}/ecos?${params.toString()}`;
-    const res = await fetch(url, {
-        headers: { 'X-API-Token': token }
-    });
+// Called on filter changes and after every action that may change the list
+function loadECOs() {
+    const key = ecoFilterParams().toString();
+    if (key !== ecoList.key) {
+        abortChannel('eco-list'); // Blocks for the previous filters are no longer wanted
+        ecoList.key = key;
+        ecoList.stale = new Map();
+        ecoList.total = null;
+        ecoList.rows.forEach(tr => tr.remove());
+        ecoList.rows.clear();
+        document.getElementById('eco-scroll').scrollTop = 0;
+    } else {
+        // Same filters: keep showing what we have while it is revalidated
+        ecoList.blocks.forEach((rows, index) => ecoList.stale.set(index, rows));
+        markCacheStale('/ecos?');
+    }
+    ecoList.generation++;
+    ecoList.version = null;
+    ecoList.needCount = true;
+    ecoList.counting = false;
+    ecoList.blocks = new Map();
+    ecoList.pending.clear();
+    scheduleEcoRender();
+}
 
-    if (res.status === 401) logout();
+function scheduleEcoRender() {
+    if (ecoList.frame === null) {
+        ecoList.frame = requestAnimationFrame(() => {
+            ecoList.frame = null;
+            renderEcoWindow();
+        });
+    }
+}
 
-    const list = await res.json();
-    tbody.innerHTML = '';
+async function fetchEcoBlock(index) {
+    const generation = ecoList.generation;
+    const params = new URLSearchParams(ecoList.key);
+    params.set('limit', ECO_BLOCK_SIZE);
+    params.set('offset', index * ECO_BLOCK_SIZE);
+    const counting = ecoList.needCount && !ecoList.counting;
+    if (counting) {
+        params.set('count', 'true');
+        ecoList.counting = true;
+    }
 
-    if (list.length === 0) {
-        const emptyRow = document.createElement('tr');
-        const emptyTd = document.createElement('td');
-        emptyTd.colSpan = 6;
-        emptyTd.style.cssText = 'text-align: center; padding: 2rem; color: var(--text-muted);';
-        emptyTd.textContent = 'No ECOs found. Create one or adjust your search filters.';
-        emptyRow.appendChild(emptyTd);
-        tbody.appendChild(emptyRow);
+    let entry;
+    try {
+        entry = await apiGet(`/ecos?${params.toString()}`, { channel: 'eco-list' });
+    } finally {
+        if (counting) ecoList.counting = false;
     }
+    const list = entry.data;
+    if (generation !== ecoList.generation) return; // Reloaded while this was in flight
 
-    list.forEach(eco => {
-        const tr = document.createElement('tr');
-        tr.style.borderBottom = '1px solid var(--border)';
+    const version = parseInt(entry.headers['x-list-version'], 10);
+    if (ecoList.version !== null && version < ecoList.version) {
+        ecoList.stale.set(index, list); // Overtaken by a newer response
+        return;
+    }
+    if (ecoList.version !== null && version > ecoList.version) {
+        // The list changed since the cached blocks were fetched
+        ecoList.blocks.forEach((rows, i) => ecoList.stale.set(i, rows));
+        ecoList.blocks = new Map();
+        ecoList.needCount = true;
+    }
+    ecoList.version = version;
+    const total = entry.headers['x-total-count'];
+    if (total !== undefined) {
+        ecoList.total = parseInt(total, 10);
+        ecoList.needCount = false;
+    }
+    ecoList.blocks.set(index, list);
+    ecoList.stale.delete(index);
+    pruneEcoBlocks(index);
+}
+
+function ensureEcoBlock(index) {
+    if (ecoList.pending.has(index)) return;
+    const fetching = fetchEcoBlock(index)
+        // A failed block is retried on the next scroll or reload, not in a loop
+        .then(scheduleEcoRender, err => { if (!isAbort(err)) showToast(err.message, 'error'); })
+        .finally(() => {
+            if (ecoList.pending.get(index) === fetching) ecoList.pending.delete(index);
+        });
+    ecoList.pending.set(index, fetching);
+}
+
+// Fetch the blocks under the view once scrolling pauses, so a fast scroll
+// through thousands of rows does not request every block it passes
+function requestEcoBlocks(firstBlock, lastBlock) {
+    clearTimeout(ecoList.fetchTimer);
+    ecoList.fetchTimer = setTimeout(() => {
+        for (let b = firstBlock; b <= lastBlock; b++) {
+            if (!ecoList.blocks.has(b)) ensureEcoBlock(b);
+        }
+    }, ECO_FETCH_DELAY);
+}
+
+function pruneEcoBlocks(near) {
+    for (const cache of [ecoList.blocks, ecoList.stale]) {
+        if (cache.size <= ECO_MAX_BLOCKS) continue;
+        const furthest = [...cache.keys()].sort((a, b) => Math.abs(b - near) - Math.abs(a - near));
+        furthest.slice(0, cache.size - ECO_MAX_BLOCKS).forEach(i => cache.delete(i));
+    }
+}
 
-        const tdId = document.createElement('td');
-        tdId.style.padding = '1rem';
-        tdId.textContent = `#${eco.id}`;
-
-        const tdTitle = document.createElement('td');
-        tdTitle.style.padding = '1rem';
-        tdTitle.style.fontWeight = '600';
-        tdTitle.textContent = eco.title;
-
-        const tdCreator = document.createElement('td');
-        tdCreator.style.padding = '1rem';
-        tdCreator.style.color = 'var(--text-muted)';
-        tdCreator.textContent = eco.created_by;
-
-        const tdStatus = document.createElement('td');
-        tdStatus.style.padding = '1rem';
-        const badge = document.createElement('span');
-        badge.className = `badge ${getStatusClass(eco.status)}`;
-        badge.textContent = eco.status;
-        tdStatus.appendChild(badge);
-
-        const tdDate = document.createElement('td');
-        tdDate.style.padding = '1rem';
-        tdDate.style.color = 'var(--text-muted)';
-        tdDate.textContent = new Date(eco.created_at).toLocaleDateString();
-
-        const tdAction = document.createElement('td');
-        tdAction.style.padding = '1rem';
+function ecoAt(position) {
+    const index = Math.floor(position / ECO_BLOCK_SIZE);
+    const block = ecoList.blocks.get(index) || ecoList.stale.get(index);
+    return block ? block[position % ECO_BLOCK_SIZE] : undefined;
+}
+
+function renderEcoWindow() {
+    const scroller = document.getElementById('eco-scroll');
+    if (!scroller) return;
+    const top = scroller.scrollTop;
+    const height = scroller.clientHeight || ECO_ROW_HEIGHT * 10;
+    const first = Math.max(0, Math.floor(top / ECO_ROW_HEIGHT) - ECO_OVERSCAN);
+    let last = Math.ceil((top + height) / ECO_ROW_HEIGHT) + ECO_OVERSCAN;
+
+    const firstBlock = Math.floor(first / ECO_BLOCK_SIZE);
+    if (ecoList.total === null || ecoList.needCount) {
+        // Until the size of the list is known, load the window at the top of the view
+        if (!ecoList.blocks.has(firstBlock) || ecoList.pending.size === 0) ensureEcoBlock(firstBlock);
+    }
+    if (ecoList.total === null) {
+        renderEcoMessage('<span class="spinner"></span> Loading...', true);
+        return;
+    }
+    if (ecoList.total === 0) {
+        renderEcoMessage('No ECOs found. Create one or adjust your search filters.');
+        return;
+    }
+    last = Math.min(last, ecoList.total);
+
+    requestEcoBlocks(firstBlock, Math.floor((last - 1) / ECO_BLOCK_SIZE));
+
+    const wanted = [];
+    for (let position = first; position < last; position++) {
+        const eco = ecoAt(position);
+        // Rows past the end of a shrunken block are just placeholders until refetched
+        wanted.push(eco ? ecoRow(eco) : ecoPlaceholderRow(position));
+    }
+    placeEcoRows(wanted, first, last);
+    updateEcoCount();
+}
+
+function placeEcoRows(wanted, first, last) {
+    const tbody = document.getElementById('eco-list');
+    const topSpacer = document.getElementById('eco-spacer-top');
+    const bottomSpacer = document.getElementById('eco-spacer-bottom');
+    document.getElementById('eco-message').classList.add('hidden');
+    topSpacer.style.height = `${first * ECO_ROW_HEIGHT}px`;
+    bottomSpacer.style.height = `${(ecoList.total - last) * ECO_ROW_HEIGHT}px`;
+
+    const keep = new Set(wanted);
+    ecoList.rows.forEach((tr, key) => {
+        if (!keep.has(tr)) {
+            tr.remove();
+            ecoList.rows.delete(key);
+        }
+    });
+    // Move only rows that are out of place, so unchanged rows are not touched
+    let previous = topSpacer;
+    for (const tr of wanted) {
+        if (previous.nextSibling !== tr) tbody.insertBefore(tr, previous.nextSibling);
+        previous = tr;
+    }
+}
+
+function ecoRow(eco) {
+    const key = `eco-${eco.id}`;
+    const signature = `${eco.title}\u0000${eco.status}\u0000${eco.created_by}\u0000${eco.created_at}`;
+    let tr = ecoList.rows.get(key);
+    if (tr && tr.dataset.signature === signature) return tr;
+    if (!tr) {
+        tr = document.createElement('tr');
+        for (let i = 0; i < 6; i++) tr.appendChild(document.createElement('td'));
         const viewBtn = document.createElement('button');
-        viewBtn.className = 'btn btn-primary';
-        viewBtn.style.padding = '0.5rem 1rem';
-        viewBtn.style.fontSize = '0.8rem';
+        viewBtn.className = 'btn btn-primary btn-small';
         viewBtn.textContent = 'View';
         viewBtn.onclick = () => openDetail(eco.id);
-        tdAction.appendChild(viewBtn);
+        tr.cells[5].appendChild(viewBtn);
+        ecoList.rows.set(key, tr);
+    }
+    tr.dataset.signature = signature;
+    const [tdId, tdTitle, tdCreator, tdStatus, tdDate] = tr.cells;
+    tdId.textContent = `#${eco.id}`;
+    tdTitle.textContent = eco.title;
+    tdTitle.className = 'eco-title';
+    tdTitle.title = eco.title;
+    tdCreator.textContent = eco.created_by;
+    tdCreator.className = 'muted';
+    tdStatus.textContent = '';
+    const badge = document.createElement('span');
+    badge.className = `badge ${getStatusClass(eco.status)}`;
+    badge.textContent = eco.status;
+    tdStatus.appendChild(badge);
+    tdDate.textContent = new Date(eco.created_at).toLocaleDateString();
+    tdDate.className = 'muted';
+    return tr;
+}
 
-        tr.append(tdId, tdTitle, tdCreator, tdStatus, tdDate, tdAction);
-        tbody.appendChild(tr);
+function ecoPlaceholderRow(position) {
+    const key = `placeholder-${position}`;
+    let tr = ecoList.rows.get(key);
+    if (!tr) {
+        tr = document.createElement('tr');
+        tr.className = 'eco-row-placeholder';
+        const td = document.createElement('td');
+        td.colSpan = 6;
+        td.textContent = '…';
+        tr.appendChild(td);
+        ecoList.rows.set(key, tr);
+    }
+    return tr;
+}
+
+function renderEcoMessage(html, isLoading = false) {
+    ecoList.rows.forEach(tr => tr.remove());
+    ecoList.rows.clear();
+    document.getElementById('eco-spacer-top').style.height = '0px';
+    document.getElementById('eco-spacer-bottom').style.height = '0px';
+    const message = document.getElementById('eco-message');
+    message.classList.remove('hidden');
+    message.classList.toggle('loading-row', isLoading);
+    message.cells[0].innerHTML = html;
+    updateEcoCount();
+}
+
+function updateEcoCount() {
+    const countInfo = document.getElementById('eco-count');
+    if (!countInfo) return;
+    const total = ecoList.total;
+    countInfo.textContent = total === null ? '' : `${total.toLocaleString()} ECO${total === 1 ? '' : 's'}`;
+}
+
+// Workflow
+let workflow = null; // states and transitions, from GET /workflow
+
+async function loadWorkflow() {
+    const res = await apiFetch('/workflow');
+    if (!res.ok) return;
+    workflow = await res.json();
+    const statusFilter = document.getElementById('status-filter');
+    if (!statusFilter) return;
+    statusFilter.length = 1; // Keep "All Statuses"
+    workflow.states.forEach(state => {
+        const option = document.createElement('option');
+        option.value = state;
+        option.textContent = state.charAt(0) + state.slice(1).toLowerCase().split('_').join(' ');
+        statusFilter.appendChild(option);
     });
+}
 
-    // Update pagination controls
-    const prevBtn = document.getElementById('prev-btn');
-    const nextBtn = document.getElementById('next-btn');
-    const pageInfo = document.getElementById('page-info');
-    if (prevBtn) prevBtn.disabled = currentPage === 0;
-    if (nextBtn) nextBtn.disabled = list.length < limit;
-    if (pageInfo) pageInfo.textContent = `Page ${currentPage + 1}`;
+// Approvals waiting on the current user
+async function loadPending() {
+    const panel = document.getElementById('pending-panel');
+    if (!panel) return;
+    let entry;
+    try {
+        entry = await apiGet('/me/pending?limit=20', { channel: 'pending' });
+    } catch (err) {
+        return;
+    }
+    const list = document.getElementById('pending-list');
+    list.innerHTML = '';
+    entry.data.forEach(eco => {
+        const li = document.createElement('li');
+        li.style.marginBottom = '0.5rem';
+        const link = document.createElement('a');
+        link.href = '#';
+        link.textContent = `#${eco.id} ${eco.title}`;
+        link.onclick = (e) => { e.preventDefault(); openDetail(eco.id); };
+        const info = document.createElement('span');
+        info.style.color = 'var(--text-muted)';
+        info.textContent = ` (${eco.approvals} of ${eco.quorum} approvals, by ${eco.created_by})`;
+        li.append(link, info);
+        list.appendChild(li);
+    });
+    panel.classList.toggle('hidden', entry.data.length === 0);
+}
+
+function transitionButtonClass(transition) {
+    if (transition.to === 'APPROVED') return 'btn-success';
+    if (transition.to === 'REJECTED') return 'btn-danger';
+    return 'btn-primary';
 }
 
 function getStatusClass(status) {
@@ -243,14 +555,10 @@ async function handleCreateECO(e) {
     e.preventDefault();
     const title = document.getElementById('eco-title').value;
     const desc = document.getElementById('eco-desc').value;
-    const token = localStorage.getItem('eco_token');
 
-    const res = await fetch(`${API_URL}/ecos`, {
+    const res = await apiFetch('/ecos', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-API-Token': token
-        },
+        headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ title: title, description: desc })
     });
 
@@ -265,18 +573,46 @@ async function handleCreateECO(e) {
 
 // Detail & Actions
 let currentEcoId = null;
+let currentEcoVersion = null; // Row version the open ECO was read at
 
-async function openDetail(id) {
-    currentEcoId = id;
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/ecos/${id}`, {
-        headers: { 'X-API-Token': token }
-    });
+// Writes send the version they were based on; the server answers 412 if the
+// ECO changed since, and the detail view is reloaded instead of overwriting.
+function ifMatchHeaders() {
+    return currentEcoVersion === null ? {} : { 'If-Match': `"${currentEcoVersion}"` };
+}
 
-    if (!res.ok) return;
+async function showWriteError(res, fallback) {
+    const d = await res.json();
+    if (res.status === 412) {
+        showToast('This ECO was changed by someone else. Showing the latest version.', 'error');
+        markCacheStale(`/ecos/${currentEcoId}`);
+        openDetail(currentEcoId, true);
+        return;
+    }
+    showToast(d.detail || fallback, 'error');
+}
 
-    const data = await res.json();
+// Opening an ECO from the list shows a cached copy at once and updates it if
+// the server has something newer; after an action, pass refresh to wait for
+// the current version instead.
+async function openDetail(id, refresh = false) {
+    currentEcoId = id;
+    const onUpdate = refresh ? null : entry => {
+        if (currentEcoId === id) renderDetail(entry.data);
+    };
+    let entry;
+    try {
+        entry = await apiGet(`/ecos/${id}`, { onUpdate });
+    } catch (err) {
+        return;
+    }
+    if (currentEcoId !== id) return; // Another ECO was opened meanwhile
+    renderDetail(entry.data);
+    document.getElementById('detail-modal').classList.remove('hidden');
+}
 
+function renderDetail(data) {
+    currentEcoVersion = data.version;
     document.getElementById('detail-id').textContent = data.id;
     document.getElementById('detail-title').textContent = data.title;
     document.getElementById('detail-desc').textContent = data.description;
@@ -297,9 +633,31 @@ async function openDetail(id) {
         uploader.style.fontSize = '0.9em';
         uploader.textContent = ` (${f.uploaded_by})`;
         li.append(link, uploader);
+        if (f.corrupt_at) {
+            const warning = document.createElement('span');
+            warning.style.color = 'var(--danger)';
+            warning.textContent = ' (damaged: failed its integrity check)';
+            li.appendChild(warning);
+        }
+        if (f.preview_mime_type) {
+            appendPreview(li, f);
+        }
         fileList.appendChild(li);
     });
 
+    // Approvers
+    const approversDiv = document.getElementById('detail-approvers');
+    approversDiv.classList.toggle('hidden', data.approvers.length === 0);
+    document.getElementById('detail-quorum').textContent = `${data.approvals} of ${data.quorum} needed`;
+    const approverList = document.getElementById('detail-approver-list');
+    approverList.innerHTML = '';
+    data.approvers.forEach(a => {
+        const li = document.createElement('li');
+        const decision = a.decision === 'approve' ? 'approved' : a.decision === 'reject' ? 'rejected' : 'pending';
+        li.textContent = `${a.username}: ${decision}`;
+        approverList.appendChild(li);
+    });
+
     // History
     const historyDiv = document.getElementById('detail-history');
     historyDiv.innerHTML = '';
@@ -323,27 +681,16 @@ async function openDetail(id) {
     const actionsDiv = document.getElementById('actions-area');
     actionsDiv.innerHTML = '';
 
-    if (data.status === 'DRAFT') {
+    // One button per workflow action that starts from the ECO's status
+    const transitions = workflow ? workflow.transitions.filter(t => t.from.includes(data.status)) : [];
+    transitions.forEach((t, i) => {
         const btn = document.createElement('button');
-        btn.className = 'btn btn-primary';
-        btn.textContent = 'Submit for Approval';
-        btn.onclick = () => performAction('submit');
+        btn.className = `btn ${transitionButtonClass(t)}`;
+        btn.textContent = t.label;
+        if (i < transitions.length - 1) btn.style.marginBottom = '0.5rem';
+        btn.onclick = () => performAction(t);
         actionsDiv.appendChild(btn);
-    } else if (data.status === 'SUBMITTED') {
-        const approveBtn = document.createElement('button');
-        approveBtn.className = 'btn btn-success';
-        approveBtn.textContent = 'Approve';
-        approveBtn.style.marginBottom = '0.5rem';
-        approveBtn.onclick = () => performAction('approve');
-
-        const rejectBtn = document.createElement('button');
-        rejectBtn.className = 'btn btn-danger';
-        rejectBtn.textContent = 'Reject';
-        rejectBtn.onclick = () => performAction('reject', true);
-
-        actionsDiv.appendChild(approveBtn);
-        actionsDiv.appendChild(rejectBtn);
-    }
+    });
 
     // Admin actions: Edit and Delete
     if (localStorage.getItem('eco_is_admin') === 'true') {
@@ -358,6 +705,13 @@ async function openDetail(id) {
         editBtn.onclick = () => openEditModal(data);
         actionsDiv.appendChild(editBtn);
 
+        const approversBtn = document.createElement('button');
+        approversBtn.className = 'btn';
+        approversBtn.style.cssText = 'background: rgba(255,255,255,0.1); border: 1px solid var(--border); width: 100%; margin-bottom: 0.5rem;';
+        approversBtn.textContent = 'Set Approvers';
+        approversBtn.onclick = () => setApprovers(data);
+        actionsDiv.appendChild(approversBtn);
+
         const deleteBtn = document.createElement('button');
         deleteBtn.className = 'btn btn-danger';
         deleteBtn.style.width = '100%';
@@ -365,37 +719,56 @@ async function openDetail(id) {
         deleteBtn.onclick = () => handleDeleteECO(data.id);
         actionsDiv.appendChild(deleteBtn);
     }
-
-    document.getElementById('detail-modal').classList.remove('hidden');
 }
 
 function hideDetailModal() {
     document.getElementById('detail-modal').classList.add('hidden');
     loadECOs(); // Refresh list
+    loadPending();
+}
+
+async function setApprovers(data) {
+    const names = prompt('Approvers (comma-separated usernames, empty for none):',
+        data.approvers.map(a => a.username).join(', '));
+    if (names === null) return;
+    const approvers = names.split(',').map(n => n.trim()).filter(n => n);
+    let quorum = null;
+    if (approvers.length > 1) {
+        const answer = prompt(`Approvals needed (1-${approvers.length}):`, String(data.quorum || approvers.length));
+        if (answer === null) return;
+        quorum = parseInt(answer, 10);
+    }
+    const res = await apiFetch(`/ecos/${data.id}/approvers`, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ approvers: approvers, quorum: quorum })
+    });
+    if (res.ok) {
+        openDetail(data.id, true);
+    } else {
+        const d = await res.json();
+        showToast(d.detail || 'Failed to set approvers', 'error');
+    }
 }
 
-async function performAction(action, requireComment = false) {
+async function performAction(transition) {
     let comment = null;
-    if (requireComment || action !== 'submit') { // submit can vary, but generally good to ask
-        comment = prompt('Add a comment (optional for submit/approve, required for reject):');
-        if (requireComment && !comment) return;
+    if (transition.comment !== 'none') {
+        const required = transition.comment === 'required';
+        comment = prompt(`Add a comment (${required ? 'required' : 'optional'}):`);
+        if (comment === null || (required && !comment)) return;
     }
 
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/ecos/${currentEcoId}/${action}`, {
+    const res = await apiFetch(`/ecos/${currentEcoId}/transitions/${transition.action}`, {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-API-Token': token
-        },
+        headers: { 'Content-Type': 'application/json', ...ifMatchHeaders() },
         body: JSON.stringify({ comment: comment })
     });
 
     if (res.ok) {
-        openDetail(currentEcoId); // Refresh details
+        openDetail(currentEcoId, true); // Refresh details
     } else {
-        const d = await res.json();
-        showToast(d.detail || 'Action failed', 'error');
+        await showWriteError(res, 'Action failed');
     }
 }
 
@@ -413,72 +786,68 @@ async function handleEditECO(e) {
     e.preventDefault();
     const title = document.getElementById('edit-eco-title').value;
     const desc = document.getElementById('edit-eco-desc').value;
-    const token = localStorage.getItem('eco_token');
 
-    const res = await fetch(`${API_URL}/ecos/${currentEcoId}`, {
+    const res = await apiFetch(`/ecos/${currentEcoId}`, {
         method: 'PUT',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-API-Token': token
-        },
+        headers: { 'Content-Type': 'application/json', ...ifMatchHeaders() },
         body: JSON.stringify({ title: title, description: desc })
     });
 
     if (res.ok) {
         hideEditModal();
-        openDetail(currentEcoId);
+        openDetail(currentEcoId, true);
     } else {
-        const d = await res.json();
-        showToast(d.detail || 'Failed to update ECO', 'error');
+        if (res.status === 412) hideEditModal();
+        await showWriteError(res, 'Failed to update ECO');
     }
 }
 
 async function handleDeleteECO(ecoId) {
     if (!confirm('Are you sure you want to permanently delete this ECO? This cannot be undone.')) return;
 
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/ecos/${ecoId}`, {
-        method: 'DELETE',
-        headers: { 'X-API-Token': token }
-    });
+    const res = await apiFetch(`/ecos/${ecoId}`, { method: 'DELETE', headers: ifMatchHeaders() });
 
     if (res.ok) {
         hideDetailModal();
     } else {
-        const d = await res.json();
-        showToast(d.detail || 'Failed to delete ECO', 'error');
+        await showWriteError(res, 'Failed to delete ECO');
     }
 }
 
 async function handleUpload(e) {
     e.preventDefault();
     const fileInput = document.getElementById('upload-file');
-    if (!fileInput.files[0]) return;
+    if (!fileInput.files.length) return;
 
+    // Every chosen file (and the contents of any .zip) goes up in one request
     const formData = new FormData();
-    formData.append('file', fileInput.files[0]);
+    for (const file of fileInput.files) {
+        formData.append('files', file);
+    }
 
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/ecos/${currentEcoId}/attachments`, {
+    const res = await apiFetch(`/ecos/${currentEcoId}/attachments/batch`, {
         method: 'POST',
-        headers: { 'X-API-Token': token },
         body: formData
     });
 
     if (res.ok) {
         fileInput.value = '';
-        showToast('File uploaded successfully');
-        openDetail(currentEcoId);
+        const body = await res.json();
+        const failed = body.results.filter(r => !r.ok);
+        if (failed.length) {
+            const names = failed.map(r => `${r.filename} (${r.error})`).join(', ');
+            showToast(`${body.uploaded} uploaded; failed: ${names}`, 'error');
+        } else {
+            showToast(body.uploaded === 1 ? 'File uploaded successfully' : `${body.uploaded} files uploaded`);
+        }
+        openDetail(currentEcoId, true);
     } else {
         showToast('Upload failed', 'error');
     }
 }
 
 async function downloadReport() {
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/ecos/${currentEcoId}/report`, {
-        headers: { 'X-API-Token': token }
-    });
+    const res = await apiFetch(`/ecos/${currentEcoId}/report`);
 
     if (res.ok) {
         const blob = await res.blob();
@@ -495,11 +864,8 @@ async function downloadReport() {
 }
 
 async function viewAttachment(filename) {
-    const token = localStorage.getItem('eco_token');
     try {
-        const res = await fetch(`${API_URL}/ecos/${currentEcoId}/attachments/${filename}`, {
-            headers: { 'X-API-Token': token }
-        });
+        const res = await apiFetch(`/ecos/${currentEcoId}/attachments/${filename}`);
 
         if (res.ok) {
             const blob = await res.blob();
@@ -515,6 +881,42 @@ async function viewAttachment(filename) {
     }
 }
 
+// Previews are small derivatives (thumbnails, text excerpts) served instead of the full file
+async function fetchPreview(filename) {
+    const res = await apiFetch(`/ecos/${currentEcoId}/attachments/${encodeURIComponent(filename)}/preview`);
+    return res.ok ? res.blob() : null;
+}
+
+async function appendPreview(li, attachment) {
+    if (attachment.preview_mime_type.startsWith('image/')) {
+        const blob = await fetchPreview(attachment.filename);
+        if (!blob) return;
+        const img = document.createElement('img');
+        img.className = 'attachment-thumb';
+        img.alt = attachment.filename;
+        img.src = window.URL.createObjectURL(blob);
+        img.onload = () => window.URL.revokeObjectURL(img.src);
+        img.onclick = () => viewAttachment(attachment.filename);
+        li.appendChild(img);
+    } else {
+        const previewLink = document.createElement('a');
+        previewLink.href = '#';
+        previewLink.className = 'attachment-preview-link';
+        previewLink.textContent = 'preview';
+        previewLink.onclick = (e) => { e.preventDefault(); viewPreview(attachment.filename); };
+        li.appendChild(previewLink);
+    }
+}
+
+async function viewPreview(filename) {
+    const blob = await fetchPreview(filename);
+    if (!blob) {
+        showToast('Preview not available', 'error');
+        return;
+    }
+    window.open(window.URL.createObjectURL(blob), '_blank');
+}
+
 // Admin
 function openAdmin() {
     loadUsers();
@@ -526,10 +928,7 @@ function hideAdminModal() {
 }
 
 async function loadUsers() {
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/admin/users`, {
-        headers: { 'X-API-Token': token }
-    });
+    const res = await apiFetch('/admin/users');
 
     if (!res.ok) {
         showToast('Failed to load users', 'error');
@@ -592,11 +991,7 @@ async function loadUsers() {
 async function deleteUser(userId) {
     if (!confirm("Are you sure you want to delete this user?")) return;
 
-    const token = localStorage.getItem('eco_token');
-    const res = await fetch(`${API_URL}/admin/users/${userId}`, {
-        method: 'DELETE',
-        headers: { 'X-API-Token': token }
-    });
+    const res = await apiFetch(`/admin/users/${userId}`, { method: 'DELETE' });
 
     if (res.ok) {
         showToast('User deleted');
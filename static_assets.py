@@ -0,0 +1,243 @@
+"""Build and serve the web UI's static assets.
+
+``build`` copies ``static/`` to a build directory with scripts and
+stylesheets minified and renamed after their content hash (``app.1a2b3c4d.js``),
+rewrites the pages to point at the new names, and writes gzip and, when the
+``brotli`` package is installed, brotli copies of every text file next to
+the original. ``PrecompressedStaticFiles`` serves that directory: it picks the
+smallest variant the browser accepts, and lets browsers keep hashed files
+forever since their names change whenever their content does.
+
+    python static_assets.py build [--source static] [--dest build/static]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from typing import Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+STATIC_SOURCE_DIR = "static"
+STATIC_BUILD_DIR = os.environ.get("STATIC_BUILD_DIR", "build/static")
+MANIFEST = "manifest.json"
+FINGERPRINTED = (".js", ".css")  # renamed after their hash; pages keep their names
+COMPRESSIBLE = (".js", ".css", ".html", ".json", ".svg", ".txt")
+MIN_COMPRESS_SIZE = 256  # bytes; smaller files are not worth a compressed copy
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{8}\.[A-Za-z0-9]+$")
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+
+
+def _strip_line_comment(line: str) -> str:
+    # Drop a trailing // comment, ignoring // inside string literals
+    quote = None
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        if quote:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif line.startswith("//", i):
+            return line[:i]
+        i += 1
+    return line
+
+
+def minify_js(source: str) -> str:
+    """Remove comments, indentation and blank lines.
+
+    Line breaks are kept, so automatic semicolon insertion behaves exactly as
+    in the source. This is deliberately conservative: it knows nothing of
+    regular expression literals or multi-line template strings, and refuses
+    sources that contain either.
+    """
+    if re.search(r"[=(,:]\s*/[^/*]", source) or any(line.count("`") % 2 for line in source.splitlines()):
+        raise ValueError("Source contains a regex literal or multi-line template string")
+    lines = []
+    in_block_comment = False
+    for line in source.splitlines():
+        line = line.strip()
+        if in_block_comment:
+            if "*/" in line:
+                in_block_comment = False
+            continue
+        if line.startswith("/*"):
+            in_block_comment = "*/" not in line
+            continue
+        line = _strip_line_comment(line).rstrip()
+        if line:
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def minify_css(source: str) -> str:
+    source = _CSS_COMMENT_RE.sub("", source)
+    source = re.sub(r"\s+", " ", source)
+    source = re.sub(r"\s*([{};,>])\s*", r"\1", source)
+    source = re.sub(r":\s+", ":", source)  # Not before ':', which may start a pseudo-class
+    return source.replace(";}", "}").strip() + "\n"
+
+
+def minify_html(source: str) -> str:
+    # Indentation only: inline scripts and text keep their meaning
+    return "\n".join(line.strip() for line in source.splitlines() if line.strip()) + "\n"
+
+
+_MINIFIERS = {".js": minify_js, ".css": minify_css, ".html": minify_html}
+
+
+def _compress(path: str) -> None:
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+    with open(path + ".gz", "wb") as f:
+        # mtime=0 keeps the output identical between builds of the same input
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build(source_dir: str = STATIC_SOURCE_DIR, dest_dir: str = STATIC_BUILD_DIR) -> Dict[str, str]:
+    """Build ``source_dir`` into ``dest_dir``; returns the source-to-built name manifest."""
+    tmp_dir = dest_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    manifest: Dict[str, str] = {}
+    pages = []
+    for name in sorted(os.listdir(source_dir)):
+        src = os.path.join(source_dir, name)
+        if not os.path.isfile(src) or name.startswith("."):
+            continue
+        ext = os.path.splitext(name)[1]
+        if ext in _MINIFIERS:
+            with open(src, encoding="utf-8") as f:
+                text = _MINIFIERS[ext](f.read())
+            if ext == ".html":
+                pages.append((name, text))
+                continue
+            data = text.encode("utf-8")
+        else:
+            with open(src, "rb") as f:
+                data = f.read()
+        if ext in FINGERPRINTED:
+            digest = hashlib.sha256(data).hexdigest()[:8]
+            manifest[name] = f"{os.path.splitext(name)[0]}.{digest}{ext}"
+        else:
+            manifest[name] = name
+        with open(os.path.join(tmp_dir, manifest[name]), "wb") as f:
+            f.write(data)
+    for name, text in pages:
+        for original, built in manifest.items():
+            if original != built:
+                text = re.sub(rf'((?:src|href)=")({re.escape(original)})"', rf'\g<1>{built}"', text)
+        manifest[name] = name
+        with open(os.path.join(tmp_dir, name), "w", encoding="utf-8") as f:
+            f.write(text)
+    for built in manifest.values():
+        if built.endswith(COMPRESSIBLE):
+            _compress(os.path.join(tmp_dir, built))
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    # Swap in the new build in one step so a running server never sees half of it
+    old_dir = dest_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(dest_dir):
+        os.rename(dest_dir, old_dir)
+    os.rename(tmp_dir, dest_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def static_dir_from_env() -> str:
+    """The built assets when a build exists, otherwise the sources as they are."""
+    if os.path.isfile(os.path.join(STATIC_BUILD_DIR, MANIFEST)):
+        return STATIC_BUILD_DIR
+    return STATIC_SOURCE_DIR
+
+
+def accepted_encodings(header: Optional[str]) -> set:
+    """Content codings allowed by an Accept-Encoding header (ignoring those with q=0)."""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves ``.br``/``.gz`` siblings and long-lived caching for hashed names."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = accepted_encodings(request_headers.get("accept-encoding"))
+        response = None
+        for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if coding not in accepted:
+                continue
+            try:
+                variant_stat = os.stat(str(full_path) + suffix)
+            except OSError:
+                continue
+            media_type = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+            response = FileResponse(str(full_path) + suffix, status_code=status_code, stat_result=variant_stat,
+                                    media_type=media_type, headers={"Content-Encoding": coding})
+            break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = IMMUTABLE if _HASHED_NAME_RE.search(str(full_path)) else "no-cache"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def compress(data: bytes, accepted: set) -> Tuple[Optional[str], bytes]:
+    """Compress a response body on the fly with the best coding the client accepts.
+
+    Uses fast settings, unlike the build, since it runs for every response.
+    Returns ``(None, data)`` if the client accepts neither brotli nor gzip.
+    """
+    if brotli is not None and "br" in accepted:
+        return "br", brotli.compress(data, quality=4)
+    if "gzip" in accepted:
+        return "gzip", gzip.compress(data, compresslevel=5)
+    return None, data
+
+
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="ECO Manager static assets")
+    sub = parser.add_subparsers(dest="task", required=True)
+    p = sub.add_parser("build", help="minify, fingerprint and precompress the web UI")
+    p.add_argument("--source", default=STATIC_SOURCE_DIR)
+    p.add_argument("--dest", default=STATIC_BUILD_DIR)
+    args = parser.parse_args()
+
+    result = build(args.source, args.dest)
+    for original, built in sorted(result.items()):
+        print(f"{original} -> {built}")
+    if brotli is None:
+        print("brotli not installed; wrote gzip copies only")
@@ -0,0 +1,496 @@
+"""Database storage backends.
+
+ECO does not open database connections itself; it asks its storage backend
+for one. This keeps connection setup in one place and is the seam for
+routing reads or tracing statements.
+
+eco_manager is written against the sqlite3 module: ``?`` placeholders,
+``with conn:`` committing or rolling back, ``sqlite3.Row`` rows, sqlite3
+exceptions, and ``BEGIN IMMEDIATE`` to take the write lock up front. Every
+backend hands out connections that behave that way.
+
+SQLiteStorage keeps the database in one file on one host. PostgresStorage
+lets API workers on several hosts share a PostgreSQL database (``pip install
+ecomanager[postgres]``); its pooled connections are wrapped to accept the
+same interface, with the differences listed on PostgresConnection.
+
+Configuration (environment):
+    DATABASE_URL        postgresql://... to use PostgreSQL; unset for SQLite
+    DATABASE_POOL_SIZE  connections per process in the PostgreSQL pool
+    DATABASE_PATH       the SQLite database file
+"""
+import datetime
+import itertools
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Tuple
+
+from tracing import TracingConnection, current_trace, sql_tracing_enabled
+
+try:
+    import psycopg
+    from psycopg.adapt import Loader
+    from psycopg.types.numeric import IntDumper
+    from psycopg_pool import ConnectionPool, PoolTimeout
+except ImportError:  # pragma: no cover - optional dependency
+    psycopg = None
+
+DEFAULT_BUSY_TIMEOUT = 5.0  # seconds to wait for a lock held by another connection
+REPLICA_MAX_STALENESS = 30.0  # seconds a replica may lag before reads fall back to the primary
+BACKUP_PAGES_PER_STEP = 1024  # pages copied per step of a replica refresh
+DATABASE_POOL_SIZE = 10  # PostgreSQL connections per process
+STREAM_BATCH_SIZE = 1000  # rows fetched per round trip from a server-side cursor
+TEXT_SEARCH_CONFIG = "english"  # PostgreSQL full-text search configuration, also used by the search index
+WRITE_LOCK_KEY = 0x45434F  # advisory lock that serializes PostgreSQL writers
+MIGRATION_LOCK_KEY = 0x45434D  # advisory lock held by the process running PostgreSQL schema migrations
+
+_WRITE_STATEMENTS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER"}
+_PLACEHOLDER_RE = re.compile(r"'(?:[^']|'')*'|\?|%")
+
+
+class Storage(ABC):
+    """A database backend for ECO.
+
+    ``dialect`` names the schema and SQL variants ECO uses with it.
+    """
+
+    dialect = ""
+    path = ""
+    replica_path: Optional[str] = None
+
+    @abstractmethod
+    def connect(self, **kwargs):
+        """Connection for reads and writes."""
+
+    @abstractmethod
+    def connect_read(self, fresh_since: Optional[datetime.datetime] = None):
+        """Connection for read-only queries, which may be served by a replica."""
+
+    def text_search(self, columns: Sequence[str], query: str) -> Tuple[str, list]:
+        """SQL condition, and its parameters, for rows whose ``columns`` contain ``query``."""
+        pattern = f"%{query}%"
+        return "(" + " OR ".join(f"{column} LIKE ?" for column in columns) + ")", [pattern] * len(columns)
+
+    def iterate(self, conn, sql: str, params: Sequence = ()) -> Iterator[tuple]:
+        """Rows of a query whose result may be too large to hold in memory."""
+        return iter(conn.execute(sql, params))
+
+    def replica_refreshed_at(self) -> Optional[datetime.datetime]:
+        return None
+
+    def refresh_replica(self) -> bool:
+        return False
+
+    @contextmanager
+    def migration_lock(self, timeout: float = DEFAULT_BUSY_TIMEOUT) -> Iterator[None]:
+        """Hold a lock that lets one process at a time migrate the schema.
+
+        Unlike the write lock it is kept across commits, so data migrations
+        can commit between batches. Waiting longer than ``timeout`` seconds
+        raises ``sqlite3.OperationalError``.
+        """
+        yield
+
+    def backup(self, dest_path: str, pages: int = BACKUP_PAGES_PER_STEP, sleep: float = 0.0) -> None:
+        raise NotImplementedError(f"{type(self).__name__} has no online backup; use the database's own tools")
+
+
+class SQLiteStorage(Storage):
+    """Connections to a single SQLite database file.
+
+    Read-only queries can be routed to a separate connection set with
+    ``connect_read``. By default that is a read-only connection to the
+    primary, which in WAL mode reads a consistent snapshot without blocking
+    or being blocked by writers. With ``replica_path`` set, reads go to a copy
+    of the database refreshed by ``refresh_replica`` (normally a periodic
+    job), as long as the copy is fresh enough.
+    """
+
+    dialect = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        timeout: float = DEFAULT_BUSY_TIMEOUT,
+        replica_path: Optional[str] = None,
+        replica_max_staleness: float = REPLICA_MAX_STALENESS,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.replica_path = replica_path
+        self.replica_max_staleness = replica_max_staleness
+        self._refresh_lock = threading.Lock()
+
+    def connect(self, **kwargs) -> sqlite3.Connection:
+        kwargs.setdefault("timeout", self.timeout)
+        if sql_tracing_enabled():
+            kwargs.setdefault("factory", TracingConnection)
+        return sqlite3.connect(self.path, **kwargs)
+
+    def _connect_readonly(self, path: str) -> sqlite3.Connection:
+        factory = TracingConnection if sql_tracing_enabled() else sqlite3.Connection
+        return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=self.timeout,
+                               factory=factory)
+
+    def replica_refreshed_at(self) -> Optional[datetime.datetime]:
+        if not self.replica_path:
+            return None
+        try:
+            return datetime.datetime.fromtimestamp(os.stat(self.replica_path).st_mtime)
+        except FileNotFoundError:
+            return None
+
+    def connect_read(self, fresh_since: Optional[datetime.datetime] = None) -> sqlite3.Connection:
+        """Read-only connection for queries that tolerate bounded staleness.
+
+        The replica is only used if it was refreshed within the staleness
+        bound and, when ``fresh_since`` is given, after that moment (so a user
+        always reads their own writes).
+        """
+        refreshed_at = self.replica_refreshed_at()
+        if refreshed_at is not None:
+            age = (datetime.datetime.now() - refreshed_at).total_seconds()
+            if age <= self.replica_max_staleness and (fresh_since is None or refreshed_at > fresh_since):
+                return self._connect_readonly(self.replica_path)
+        return self._connect_readonly(self.path)
+
+    @contextmanager
+    def migration_lock(self, timeout: float = DEFAULT_BUSY_TIMEOUT) -> Iterator[None]:
+        # An exclusive transaction on a file next to the database, which the
+        # operating system releases if the process dies
+        lock = sqlite3.connect(self.path + "-migrate", timeout=timeout, isolation_level=None)
+        try:
+            lock.execute("BEGIN EXCLUSIVE")
+            yield
+        finally:
+            lock.close()
+
+    def backup(self, dest_path: str, pages: int = BACKUP_PAGES_PER_STEP, sleep: float = 0.0) -> None:
+        """Copy the database to ``dest_path`` with the online backup API.
+
+        The copy is made ``pages`` pages at a time, pausing ``sleep`` seconds
+        after each step, when no lock on the database is held. (SQLite's own
+        ``sleep`` argument only applies after a step that found the database
+        busy.) A write by another connection during the copy makes SQLite
+        start it over. It goes to a temporary file that atomically replaces
+        ``dest_path``, so readers never see a half-written copy.
+        """
+        def pause(status: int, remaining: int, total: int) -> None:
+            if remaining:
+                time.sleep(sleep)
+
+        dest_dir = os.path.dirname(os.path.abspath(dest_path))
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            with self.connect() as src:
+                dest = sqlite3.connect(tmp_path)
+                try:
+                    src.backup(dest, pages=pages, progress=pause if sleep > 0 else None)
+                    dest.execute("PRAGMA journal_mode=DELETE")  # A self-contained single-file copy
+                finally:
+                    dest.close()
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def refresh_replica(self) -> bool:
+        """Bring the replica up to date with a backup of the primary."""
+        if not self.replica_path:
+            return False
+        with self._refresh_lock:
+            self.backup(self.replica_path)
+        return True
+
+
+class _NumericLoader(Loader if psycopg else object):
+    # SUM() over integer columns is NUMERIC in PostgreSQL; SQLite returns an int
+    def load(self, data) -> object:
+        value = Decimal(bytes(data).decode())
+        return int(value) if value == value.to_integral_value() else float(value)
+
+
+class _Row(tuple):
+    """Result row readable by position or by column name, like sqlite3.Row."""
+
+    def __new__(cls, values, names):
+        row = super().__new__(cls, values)
+        row._names = names
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._names.index(key)
+        return tuple.__getitem__(self, key)
+
+    def keys(self) -> list:
+        return list(self._names)
+
+
+@lru_cache(maxsize=512)
+def _pyformat(sql: str) -> str:
+    # ? placeholders to %s and literal % signs to %%; a ? inside a string literal stays
+    return _PLACEHOLDER_RE.sub(lambda m: "%s" if m.group() == "?" else m.group().replace("%", "%%"), sql)
+
+
+def _sqlite_error(error: Exception) -> sqlite3.Error:
+    """The sqlite3 exception ECO's error handling expects for a psycopg error."""
+    if isinstance(error, (psycopg.IntegrityError, psycopg.errors.RaiseException)):
+        return sqlite3.IntegrityError(str(error))
+    if isinstance(error, (psycopg.OperationalError, psycopg.ProgrammingError, PoolTimeout)):
+        return sqlite3.OperationalError(str(error))
+    return sqlite3.DatabaseError(str(error))
+
+
+class PostgresCursor:
+    """The parts of sqlite3.Cursor that ECO uses, over a psycopg cursor."""
+
+    def __init__(self, connection: "PostgresConnection"):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, sql: str, params: Sequence = ()) -> "PostgresCursor":
+        self.connection._run(self._cursor, sql, params)
+        return self
+
+    def executemany(self, sql: str, seq_of_params) -> "PostgresCursor":
+        self.connection._run(self._cursor, sql, list(seq_of_params), many=True)
+        return self
+
+    def fetchone(self):
+        if self._cursor.description is None:
+            return None
+        row = self._cursor.fetchone()
+        return None if row is None else self.connection._make_row(row, self._cursor.description)
+
+    def fetchmany(self, size: int = 1) -> list:
+        if self._cursor.description is None:
+            return []
+        return [self.connection._make_row(row, self._cursor.description) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self) -> list:
+        if self._cursor.description is None:
+            return []
+        return [self.connection._make_row(row, self._cursor.description) for row in self._cursor.fetchall()]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.fetchall())
+
+
+class PostgresConnection:
+    """A pooled PostgreSQL connection that behaves like the sqlite3 connections ECO expects.
+
+    - ``?`` placeholders are rewritten to ``%s``.
+    - Writers are serialized as in SQLite: the first write of a transaction,
+      or ``BEGIN IMMEDIATE``, takes an advisory lock held until commit or
+      rollback. The audit hash chain and the change feed rely on that order.
+    - A failed statement rolls back the whole transaction, since PostgreSQL
+      aborts it; SQLite would only undo the statement.
+    - psycopg errors are raised as the matching sqlite3 exception, and bools
+      are stored as integers.
+    - Leaving ``with`` commits or rolls back and returns the connection to
+      the pool, so it cannot be used afterwards.
+    """
+
+    _stream_names = itertools.count()
+
+    def __init__(self, pool: "ConnectionPool"):
+        self._pool = pool
+        try:
+            self._conn = pool.getconn()
+        except PoolTimeout as e:
+            raise _sqlite_error(e) from e
+        self._locked = False
+        self.row_factory = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+
+    def cursor(self) -> PostgresCursor:
+        return PostgresCursor(self)
+
+    def execute(self, sql: str, params: Sequence = ()) -> PostgresCursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params) -> PostgresCursor:
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self) -> None:
+        self._locked = False
+        try:
+            self._conn.commit()
+        except psycopg.Error as e:
+            raise _sqlite_error(e) from e
+
+    def rollback(self) -> None:
+        self._locked = False
+        self._conn.rollback()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
+
+    def __enter__(self) -> "PostgresConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+
+    def stream(self, sql: str, params: Sequence = (), batch_size: int = STREAM_BATCH_SIZE) -> Iterator:
+        """Rows of a query, fetched ``batch_size`` at a time through a server-side cursor."""
+        try:
+            with self._conn.cursor(name=f"eco_stream_{next(self._stream_names)}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(_pyformat(sql) if params else sql, params or None)
+                for row in cursor:
+                    yield self._make_row(row, cursor.description)
+        except psycopg.Error as e:
+            self.rollback()
+            raise _sqlite_error(e) from e
+
+    def _make_row(self, row: tuple, description) -> tuple:
+        if self.row_factory is None:
+            return row
+        return _Row(row, [column.name for column in description])
+
+    def _take_write_lock(self, cursor) -> None:
+        if not self._locked:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (WRITE_LOCK_KEY,))
+            self._locked = True
+
+    def _run(self, cursor, sql: str, params, many: bool = False) -> None:
+        words = sql.split(None, 2)
+        keyword = words[0].upper() if words else ""
+        start = time.perf_counter()
+        try:
+            if keyword == "BEGIN":
+                if len(words) > 1 and words[1].upper() in ("IMMEDIATE", "EXCLUSIVE"):
+                    self._take_write_lock(cursor)
+            elif keyword in ("COMMIT", "END"):
+                self.commit()
+            elif keyword == "ROLLBACK":
+                self.rollback()
+            else:
+                if keyword in _WRITE_STATEMENTS:
+                    self._take_write_lock(cursor)
+                if many:
+                    cursor.executemany(_pyformat(sql), params)
+                else:
+                    cursor.execute(_pyformat(sql) if params else sql, params or None)
+        except psycopg.Error as e:
+            self.rollback()
+            raise _sqlite_error(e) from e
+        finally:
+            trace = current_trace()
+            if trace is not None:
+                trace.add_sql(time.perf_counter() - start)
+
+
+class PostgresStorage(Storage):
+    """Pooled connections to a PostgreSQL database, shared by processes on any number of hosts.
+
+    Lists that may return many rows are read through server-side cursors
+    (``iterate``), and ``text_search`` uses PostgreSQL full-text search.
+    There is no read replica routing; point ``url`` at a connection pooler
+    or the primary.
+    """
+
+    dialect = "postgresql"
+
+    def __init__(self, url: str, pool_size: int = DATABASE_POOL_SIZE, timeout: float = DEFAULT_BUSY_TIMEOUT):
+        if psycopg is None:
+            raise RuntimeError("PostgreSQL storage requires psycopg (pip install 'psycopg[binary,pool]')")
+        self.path = url
+        self.timeout = timeout
+        self.pool = ConnectionPool(url, min_size=1, max_size=pool_size, timeout=timeout,
+                                   configure=self._configure, open=True)
+
+    def _configure(self, conn) -> None:
+        conn.adapters.register_loader("numeric", _NumericLoader)
+        conn.adapters.register_dumper(bool, IntDumper)
+        # Like SQLite's busy timeout: how long a writer waits for the write lock
+        conn.execute(f"SET lock_timeout = {int(self.timeout * 1000):d}")
+        conn.commit()
+
+    def connect(self, **kwargs) -> PostgresConnection:
+        # sqlite3 options (timeout, isolation_level, factory) have no counterpart here
+        return PostgresConnection(self.pool)
+
+    def connect_read(self, fresh_since: Optional[datetime.datetime] = None) -> PostgresConnection:
+        return PostgresConnection(self.pool)
+
+    def text_search(self, columns: Sequence[str], query: str) -> Tuple[str, list]:
+        # Every word of the query, as a prefix, so partial words still match as
+        # they do with LIKE. The expression matches the idx_ecos_search index
+        # when given ECO's title and description.
+        words = re.findall(r"\w+", query)
+        if not words:
+            return "1 = 0", []
+        document = " || ' ' || ".join(columns)
+        return (f"to_tsvector('{TEXT_SEARCH_CONFIG}', {document}) @@ to_tsquery('{TEXT_SEARCH_CONFIG}', ?)",
+                [" & ".join(f"{word}:*" for word in words)])
+
+    def iterate(self, conn: PostgresConnection, sql: str, params: Sequence = ()) -> Iterator[tuple]:
+        return conn.stream(sql, params)
+
+    @contextmanager
+    def migration_lock(self, timeout: float = DEFAULT_BUSY_TIMEOUT) -> Iterator[None]:
+        # A session lock on a pooled connection of its own, so it outlives
+        # the migrations' transactions; the server drops it if the process dies
+        with self.pool.connection() as conn:
+            try:
+                conn.execute(f"SET lock_timeout = {int(timeout * 1000):d}")
+                conn.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.execute(f"SET lock_timeout = {int(self.timeout * 1000):d}")
+                conn.commit()
+            except psycopg.Error as e:
+                raise _sqlite_error(e) from e
+            try:
+                yield
+            finally:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def storage_from_env() -> Storage:
+    """Build the storage backend: PostgreSQL if DATABASE_URL is set, else SQLite.
+
+    SQLite uses DATABASE_PATH and the READ_REPLICA_* variables.
+    """
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return PostgresStorage(url, pool_size=int(os.environ.get("DATABASE_POOL_SIZE", DATABASE_POOL_SIZE)))
+    return SQLiteStorage(
+        os.environ.get("DATABASE_PATH", "eco_system.db"),
+        replica_path=os.environ.get("READ_REPLICA_PATH") or None,
+        replica_max_staleness=float(os.environ.get("READ_REPLICA_MAX_STALENESS", REPLICA_MAX_STALENESS)),
+    )
@@ -1,14 +1,58 @@
 import pytest
 import os
 import sys
+import uuid
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from eco_manager import ECO
+from storage import PostgresStorage
+
+# Set to a PostgreSQL URL to run the eco_system tests against PostgreSQL
+# instead of SQLite; each test gets a schema of its own
+TEST_DATABASE_URL = os.environ.get("ECO_TEST_DATABASE_URL")
+
+
+def postgres_storage():
+    """PostgresStorage on a new, empty schema; pass it to drop_postgres_storage when done."""
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    schema = f"eco_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f"CREATE SCHEMA {schema}")
+    storage = PostgresStorage(make_conninfo(TEST_DATABASE_URL, options=f"-csearch_path={schema}"), pool_size=4)
+    storage.schema = schema
+    return storage
+
+
+def drop_postgres_storage(storage):
+    import psycopg
+    storage.close()
+    with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA {storage.schema} CASCADE")
 
 
 @pytest.fixture
-def eco_system(tmp_path):
-    db_path = tmp_path / "test_eco.db"
+def eco_system(tmp_path, request):
     attachments_dir = tmp_path / "test_attachments"
-    return ECO(db_path=str(db_path), attachments_dir=str(attachments_dir))
+    if not TEST_DATABASE_URL:
+        yield ECO(db_path=str(tmp_path / "test_eco.db"), attachments_dir=str(attachments_dir))
+        return
+    if request.node.get_closest_marker("sqlite_only"):
+        pytest.skip("tests SQLite-specific behaviour")
+    storage = postgres_storage()
+    try:
+        yield ECO(storage=storage, attachments_dir=str(attachments_dir))
+    finally:
+        drop_postgres_storage(storage)
+
+
+@pytest.fixture
+def pg_storage():
+    if not TEST_DATABASE_URL:
+        pytest.skip("set ECO_TEST_DATABASE_URL to a PostgreSQL database")
+    storage = postgres_storage()
+    try:
+        yield storage
+    finally:
+        drop_postgres_storage(storage)
@@ -3,26 +3,27 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 
 from api import app
-from eco_manager import ECO
 
 client = TestClient(app)
 
 @pytest.fixture(autouse=True)
-def test_eco_system(tmp_path):
-    # Setup
-    db_path = tmp_path / "api_test.db"
-    new_eco = ECO(db_path=str(db_path), attachments_dir=str(tmp_path))
-    
+def test_eco_system(eco_system):
     # Swap the global instance in api module
     import api
     original_eco = api.eco_system
-    api.eco_system = new_eco
+    api.eco_system = eco_system
     
-    yield new_eco
+    yield eco_system
     
     # Teardown
     api.eco_system = original_eco
 
+@pytest.fixture(autouse=True)
+def fresh_rate_limits(monkeypatch):
+    import api
+    from ratelimit import MemoryBuckets
+    monkeypatch.setattr(api, "rate_limit_buckets", MemoryBuckets())
+
 @pytest.fixture
 def auth_headers(test_eco_system):
     # Must register to get token now
@@ -164,6 +165,59 @@ def test_attachment_upload(auth_headers, tmp_path):
     resp = client.get(f"/ecos/{eco_id}/attachments/ghost.txt", headers=auth_headers)
     assert resp.status_code == 404
 
+def test_batch_attachment_upload(auth_headers, monkeypatch):
+    import io
+    import zipfile
+    eco_id = client.post("/ecos", json={"title": "Package", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("drawings/", "")
+        zf.writestr("drawings/sheet1.dxf", b"sheet one")
+        zf.writestr("drawings/sheet2.dxf", b"sheet two")
+        zf.writestr("__MACOSX/drawings/._sheet1.dxf", b"resource fork")
+        zf.writestr("big.bin", b"x" * 4096)  # Small compressed, too large once expanded
+    files = [
+        ("files", ("bom.csv", b"part,qty", "text/csv")),
+        ("files", ("package.zip", archive.getvalue(), "application/zip")),
+        ("files", ("broken.zip", b"not a zip", "application/zip")),
+    ]
+    monkeypatch.setattr("api.MAX_UPLOAD_SIZE", 1024)
+
+    resp = client.post(f"/ecos/{eco_id}/attachments/batch", headers=auth_headers, files=files)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert (body["uploaded"], body["failed"]) == (3, 2)
+    assert [(r["filename"], r["ok"]) for r in body["results"]] == [
+        ("bom.csv", True), ("sheet1.dxf", True), ("sheet2.dxf", True), ("big.bin", False), ("broken.zip", False),
+    ]
+    assert body["results"][3]["error"].startswith("File too large")
+    assert body["results"][4]["error"] == "Not a valid zip archive"
+    resp = client.get(f"/ecos/{eco_id}/attachments/sheet2.dxf", headers=auth_headers)
+    assert resp.content == b"sheet two"
+
+    # Archives are kept whole when asked
+    resp = client.post(f"/ecos/{eco_id}/attachments/batch?expand_archives=false", headers=auth_headers,
+                       files=[("files", ("raw.zip", b"not a zip", "application/zip"))])
+    result, = resp.json()["results"]
+    assert (result["filename"], result["ok"], result["size"]) == ("raw.zip", True, 9)
+
+    monkeypatch.setattr("api.MAX_BATCH_FILES", 2)
+    assert client.post(f"/ecos/{eco_id}/attachments/batch", headers=auth_headers, files=files).status_code == 413
+    assert client.post("/ecos/999/attachments/batch", headers=auth_headers, files=files[:1]).status_code == 404
+
+def test_change_feed_endpoint(auth_headers):
+    eco_id = client.post("/ecos", json={"title": "Synced", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    resp = client.get("/changes?since=0", headers=auth_headers)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["has_more"] is False
+    assert [(c["eco_id"], c["eco"]["title"]) for c in body["changes"]] == [(eco_id, "Synced")]
+
+    client.delete(f"/ecos/{eco_id}", headers=auth_headers)
+    body = client.get(f"/changes?since={body['next_since']}", headers=auth_headers).json()
+    assert body["changes"] == [{"seq": body["next_since"], "eco_id": eco_id, "deleted": True, "eco": None}]
+    assert client.get("/changes?since=-1", headers=auth_headers).status_code == 422
+
 def test_attachment_failure(auth_headers):
     file_content = b"test content"
     files = {"file": ("test.txt", file_content, "text/plain")}
@@ -242,6 +296,40 @@ def test_pagination_query_params(auth_headers):
     resp = client.get("/ecos?limit=10&offset=3", headers=auth_headers)
     assert resp.status_code == 200
     assert len(resp.json()) == 2
+    assert "X-Total-Count" not in resp.headers
+
+
+def test_list_ecos_total_and_version_headers(auth_headers):
+    for i in range(3):
+        client.post("/ecos", json={"title": f"V{i}", "description": "D"}, headers=auth_headers)
+    resp = client.get("/ecos?limit=1&count=true&search=V", headers=auth_headers)
+    assert resp.headers["X-Total-Count"] == "3"
+    version = int(resp.headers["X-List-Version"])
+
+    assert client.get("/ecos?limit=1", headers=auth_headers).headers["X-List-Version"] == str(version)
+    eco_id = resp.json()[0]["id"]
+    client.put(f"/ecos/{eco_id}", json={"title": "V edited", "description": "D"}, headers=auth_headers)
+    assert int(client.get("/ecos?limit=1", headers=auth_headers).headers["X-List-Version"]) > version
+
+
+def test_list_and_detail_revalidate_with_etag(auth_headers):
+    eco_id = client.post("/ecos", json={"title": "Cached", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    paths = ("/ecos", f"/ecos/{eco_id}")
+    etags = {}
+    for path in paths:
+        resp = client.get(path, headers=auth_headers)
+        etags[path] = resp.headers["ETag"]
+        assert resp.headers["Cache-Control"] == "private, no-cache"
+        resp = client.get(path, headers={**auth_headers, "If-None-Match": etags[path]})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+    client.post(f"/ecos/{eco_id}/submit", json={"comment": None}, headers=auth_headers)
+    for path in paths:
+        resp = client.get(path, headers={**auth_headers, "If-None-Match": etags[path]})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etags[path]
+    assert resp.json()["status"] == "SUBMITTED"
 
 
 def test_search_ecos_via_api(auth_headers):
@@ -378,3 +466,202 @@ def test_logout(test_eco_system):
 def test_logout_invalid_token():
     resp = client.post("/logout", headers={"X-API-Token": "bogus"})
     assert resp.status_code == 401
+
+
+def test_token_stats_admin_only(test_eco_system, auth_headers):
+    resp = client.get("/admin/tokens/stats", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["total"] == 1
+
+    test_eco_system.register_user("plain", "password1")
+    token = test_eco_system.generate_token("plain", "password1")
+    resp = client.get("/admin/tokens/stats", headers={"X-API-Token": token})
+    assert resp.status_code == 403
+
+
+def test_queued_report_job(test_eco_system, auth_headers):
+    import worker
+    resp = client.post("/ecos", json={"title": "Async Report", "description": "D"}, headers=auth_headers)
+    eco_id = resp.json()["eco_id"]
+
+    resp = client.post(f"/ecos/{eco_id}/report/jobs", headers=auth_headers)
+    assert resp.status_code == 202
+    job_id = resp.json()["job_id"]
+
+    resp = client.get(f"/jobs/{job_id}", headers=auth_headers)
+    assert resp.json()["status"] == "PENDING"
+    assert client.get(f"/jobs/{job_id}/file", headers=auth_headers).status_code == 404
+
+    worker.run_job(test_eco_system, test_eco_system.claim_job("w1"), "w1")
+    assert client.get(f"/jobs/{job_id}", headers=auth_headers).json()["status"] == "DONE"
+    resp = client.get(f"/jobs/{job_id}/file", headers=auth_headers)
+    assert resp.status_code == 200
+    assert "ECO Report: Async Report" in resp.text
+
+    # Other non-admin users cannot see the job
+    test_eco_system.register_user("other", "password1")
+    token = test_eco_system.generate_token("other", "password1")
+    assert client.get(f"/jobs/{job_id}", headers={"X-API-Token": token}).status_code == 404
+    assert client.post("/ecos/999/report/jobs", headers=auth_headers).status_code == 404
+
+
+def test_attachment_preview_endpoint(test_eco_system, auth_headers):
+    resp = client.post("/ecos", json={"title": "Preview", "description": "D"}, headers=auth_headers)
+    eco_id = resp.json()["eco_id"]
+    files = {"file": ("readme.txt", b"hello preview", "text/plain")}
+    client.post(f"/ecos/{eco_id}/attachments", headers=auth_headers, files=files)
+
+    resp = client.get(f"/ecos/{eco_id}/attachments/readme.txt/preview", headers=auth_headers)
+    assert resp.status_code == 404
+
+    sha256 = test_eco_system.get_eco_details(eco_id)["attachments"][0]["sha256"]
+    test_eco_system.create_attachment_preview(sha256)
+    resp = client.get(f"/ecos/{eco_id}/attachments/readme.txt/preview", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.text == "hello preview"
+    assert resp.headers["content-type"].startswith("text/plain")
+
+    resp = client.get(f"/ecos/{eco_id}/attachments/readme.txt/preview",
+                      headers={**auth_headers, "If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+
+
+def test_attachment_download_redirects_to_presigned_url(auth_headers):
+    resp = client.post("/ecos", json={"title": "Redirect", "description": "D"}, headers=auth_headers)
+    eco_id = resp.json()["eco_id"]
+    with patch("api.eco_system.get_attachment_url", return_value="https://bucket.example/signed"):
+        resp = client.get(f"/ecos/{eco_id}/attachments/a.txt", headers=auth_headers, follow_redirects=False)
+    assert resp.status_code == 307
+    assert resp.headers["location"] == "https://bucket.example/signed"
+
+
+def test_audit_endpoint(auth_headers):
+    resp = client.post("/ecos", json={"title": "Audit me", "description": "D"}, headers=auth_headers)
+    eco_id = resp.json()["eco_id"]
+    client.delete(f"/ecos/{eco_id}", headers=auth_headers)
+
+    resp = client.get("/audit", params={"eco_id": eco_id}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert [e["action"] for e in resp.json()["entries"]] == ["DELETED", "CREATED"]
+    assert all(e["username"] == "api_user" for e in resp.json()["entries"])
+
+    resp = client.get("/audit", params={"since": "yesterday"}, headers=auth_headers)
+    assert resp.status_code == 400
+    resp = client.get("/audit/verify", headers=auth_headers)
+    assert resp.json()["ok"] is True
+
+
+def test_made_up_tokens_share_the_address_bucket(auth_headers):
+    import secrets
+    # Each request with a new bogus token must not get a fresh bucket
+    codes = [client.post("/token", json={"username": "x", "password": "wrong-pass"},
+                         headers={"X-API-Token": secrets.token_hex(8)}).status_code for _ in range(6)]
+    assert codes[-1] == 429
+    codes = [client.get("/ecos?search=x", headers={"X-API-Token": secrets.token_hex(8)}).status_code
+             for _ in range(11)]
+    assert codes == [401] * 10 + [429]
+    # A valid token still has a bucket of its own
+    assert client.get("/ecos?search=x", headers=auth_headers).status_code == 200
+
+def test_token_is_looked_up_once_per_request(test_eco_system, auth_headers):
+    lookup = test_eco_system.get_user_from_token
+    with patch.object(test_eco_system, "get_user_from_token", side_effect=lookup) as spy:
+        assert client.get("/ecos", headers=auth_headers).status_code == 200
+        assert client.get("/ecos", headers={"X-API-Token": "invalid"}).status_code == 401
+    assert spy.call_count == 2
+
+def test_login_rate_limited(test_eco_system):
+    test_eco_system.register_user("slow", "password1")
+    codes = [client.post("/token", json={"username": "slow", "password": "wrong-pass"}).status_code
+             for _ in range(6)]
+    assert codes == [401] * 5 + [429]
+    resp = client.post("/token", json={"username": "slow", "password": "password1"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert resp.headers["X-Content-Type-Options"] == "nosniff"
+    # Other clients and route classes have their own buckets
+    assert client.get("/health").status_code == 200
+
+
+def test_expensive_routes_shed_load(auth_headers, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "ADMISSION_TIMEOUT", 0.05)
+    monkeypatch.setattr(api, "MAX_EXPENSIVE_REQUESTS", 0)
+    resp = client.get("/ecos", params={"search": "x"}, headers=auth_headers)
+    assert resp.status_code == 503
+    assert resp.json()["detail"] == "Server busy"
+    # Cheap reads are not queued behind expensive ones
+    assert client.get("/ecos", headers=auth_headers).status_code == 200
+
+
+def test_workflow_transitions_endpoint(auth_headers):
+    workflow = client.get("/workflow", headers=auth_headers).json()
+    assert workflow["initial"] == "DRAFT"
+    assert [t["action"] for t in workflow["transitions"]] == ["submit", "approve", "reject"]
+
+    eco_id = client.post("/ecos", json={"title": "Flow", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    resp = client.post(f"/ecos/{eco_id}/transitions/submit", json={}, headers=auth_headers)
+    assert resp.status_code == 200 and resp.json()["status"] == "SUBMITTED"
+    assert client.post(f"/ecos/{eco_id}/transitions/submit", json={}, headers=auth_headers).status_code == 400
+    assert client.post(f"/ecos/{eco_id}/transitions/reject", json={}, headers=auth_headers).status_code == 400
+    assert client.post(f"/ecos/{eco_id}/transitions/launch", json={}, headers=auth_headers).status_code == 404
+    resp = client.post(f"/ecos/{eco_id}/transitions/reject", json={"comment": "No"}, headers=auth_headers)
+    assert resp.json()["status"] == "REJECTED"
+
+
+def test_if_match_guards_writes(auth_headers):
+    eco_id = client.post("/ecos", json={"title": "Guarded", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    version = client.get(f"/ecos/{eco_id}", headers=auth_headers).json()["version"]
+    stale = {**auth_headers, "If-Match": f'"{version}"'}
+    resp = client.put(f"/ecos/{eco_id}", json={"title": "First", "description": "D"}, headers=stale)
+    assert resp.status_code == 200
+
+    for resp in (client.put(f"/ecos/{eco_id}", json={"title": "Second", "description": "D"}, headers=stale),
+                 client.post(f"/ecos/{eco_id}/transitions/submit", json={}, headers=stale),
+                 client.post(f"/ecos/{eco_id}/submit", json={}, headers=stale),
+                 client.delete(f"/ecos/{eco_id}", headers=stale)):
+        assert resp.status_code == 412
+        assert resp.headers["X-ECO-Version"] == str(version + 1)
+    assert client.get(f"/ecos/{eco_id}", headers=auth_headers).json()["title"] == "First"
+
+    fresh = {**auth_headers, "If-Match": f'"{version + 1}"'}
+    assert client.post(f"/ecos/{eco_id}/transitions/submit", json={}, headers=fresh).status_code == 200
+    # A failure that is not a version conflict keeps its usual status
+    fresh = {**auth_headers, "If-Match": f'"{version + 2}"'}
+    assert client.post(f"/ecos/{eco_id}/transitions/submit", json={}, headers=fresh).status_code == 400
+    assert client.put("/ecos/999", json={"title": "X", "description": "Y"}, headers=fresh).status_code == 404
+    assert client.put(f"/ecos/{eco_id}", json={"title": "X", "description": "Y"},
+                      headers={**auth_headers, "If-Match": "latest"}).status_code == 400
+
+
+def test_approvers_and_pending_queue(auth_headers, test_eco_system):
+    test_eco_system.register_user("approver", "password1")
+    approver = {"X-API-Token": test_eco_system.generate_token("approver", "password1")}
+    eco_id = client.post("/ecos", json={"title": "Board", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    resp = client.put(f"/ecos/{eco_id}/approvers", json={"approvers": ["ghost"]}, headers=auth_headers)
+    assert resp.status_code == 400
+    resp = client.put(f"/ecos/{eco_id}/approvers", json={"approvers": ["approver", "api_user"], "quorum": 1},
+                      headers=auth_headers)
+    assert resp.status_code == 200
+    assert client.put(f"/ecos/{eco_id}/approvers", json={"approvers": []}, headers=approver).status_code == 403
+    client.post(f"/ecos/{eco_id}/submit", json={}, headers=auth_headers)
+
+    pending = client.get("/me/pending", headers=approver).json()
+    assert [(e["id"], e["quorum"], e["approvals"]) for e in pending] == [(eco_id, 1, 0)]
+    assert client.get(f"/me/pending?after={eco_id}", headers=approver).json() == []
+    resp = client.post(f"/ecos/{eco_id}/approve", json={}, headers=approver)
+    assert resp.json() == {"message": "ECO approved", "status": "APPROVED"}
+    assert client.get("/me/pending", headers=auth_headers).json() == []
+
+
+def test_verified_download_refuses_corrupt_file(auth_headers, test_eco_system, monkeypatch):
+    monkeypatch.setattr("api.VERIFY_DOWNLOADS", True)
+    eco_id = client.post("/ecos", json={"title": "Rot", "description": "D"}, headers=auth_headers).json()["eco_id"]
+    client.post(f"/ecos/{eco_id}/attachments", headers=auth_headers, files={"file": ("a.txt", b"intact", "text/plain")})
+    assert client.get(f"/ecos/{eco_id}/attachments/a.txt", headers=auth_headers).content == b"intact"
+
+    with open(test_eco_system.get_attachment_path(eco_id, "a.txt"), "wb") as f:
+        f.write(b"rotten")
+    resp = client.get(f"/ecos/{eco_id}/attachments/a.txt", headers=auth_headers)
+    assert resp.status_code == 500
+    assert client.get(f"/ecos/{eco_id}", headers=auth_headers).json()["attachments"][0]["corrupt_at"]
@@ -0,0 +1,137 @@
+import datetime
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+from blobstore import LocalBlobStore, S3BlobStore
+from eco_manager import ECO
+
+
+class FakeS3Client:
+    """In-memory stand-in for the subset of the boto3 S3 client the store uses."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key):
+        self.objects[(bucket, key)] = Path(filename).read_bytes()
+
+    def download_file(self, bucket, key, filename):
+        Path(filename).write_bytes(self.objects[(bucket, key)])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, StartAfter=""):
+                keys = sorted(k for b, k in client.objects if b == Bucket and k.startswith(Prefix) and k > StartAfter)
+                yield {"Contents": [{"Key": k, "LastModified": datetime.datetime(2024, 1, 1)} for k in keys]}
+
+        return Paginator()
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def test_local_blob_store(tmp_path):
+    store = LocalBlobStore(tmp_path / "blobs")
+    src = tmp_path / "src.txt"
+    src.write_text("data")
+    assert store.put_file("1_src.txt", src) == hashlib.sha256(b"data").hexdigest()
+    assert store.exists("1_src.txt")
+    assert Path(store.local_path("1_src.txt")).read_text() == "data"
+    assert store.presigned_url("1_src.txt", "src.txt") is None
+    # Keys cannot escape the root directory
+    assert Path(store.location("../../etc/passwd")).parent == store.root
+    (store.root / ".preview-abc.jpg").write_text("")
+    (store.root / ".partial").write_text("")
+    assert [key for key, _ in store.iter_blobs()] == ["1_src.txt"]
+    assert list(store.iter_blobs(start_after="1_src.txt")) == []
+    store.delete("1_src.txt")
+    assert not store.exists("1_src.txt")
+
+
+def test_local_blob_store_write_is_atomic(tmp_path, monkeypatch):
+    store = LocalBlobStore(tmp_path / "blobs")
+    src = tmp_path / "src.txt"
+    src.write_text("old")
+    store.put_file("1_src.txt", src)
+    src.write_text("new")
+
+    def failing_fsync(fd):
+        raise OSError("I/O error")
+
+    monkeypatch.setattr(os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        store.put_file("1_src.txt", src)
+    # A failed write leaves the previous blob intact and no partial file
+    assert Path(store.local_path("1_src.txt")).read_text() == "old"
+    assert os.listdir(store.root) == ["1_src.txt"]
+
+
+def test_s3_blob_store_with_fake_client(tmp_path):
+    pytest.importorskip("botocore")
+    client = FakeS3Client()
+    store = S3BlobStore("bucket", prefix="eco/", client=client)
+    src = tmp_path / "drawing.dwg"
+    src.write_bytes(b"dwg")
+    assert store.put_file("7_drawing.dwg", src) == hashlib.sha256(b"dwg").hexdigest()
+    assert client.objects == {("bucket", "eco/7_drawing.dwg"): b"dwg"}
+    assert store.location("7_drawing.dwg") == "s3://bucket/eco/7_drawing.dwg"
+    assert store.local_path("7_drawing.dwg") is None
+    with store.local_file("7_drawing.dwg") as path:
+        assert path.read_bytes() == b"dwg"
+    assert not path.exists()
+    assert store.presigned_url("7_drawing.dwg", "drawing.dwg").startswith("https://s3.test/bucket/eco/7_drawing.dwg")
+    store.put_file("8_part.step", src)
+    assert [key for key, _ in store.iter_blobs()] == ["7_drawing.dwg", "8_part.step"]
+    assert [key for key, _ in store.iter_blobs(start_after="7_drawing.dwg")] == ["8_part.step"]
+    store.delete("7_drawing.dwg")
+    assert not store.exists("7_drawing.dwg")
+
+
+def test_eco_with_s3_store(tmp_path):
+    pytest.importorskip("botocore")
+    store = S3BlobStore("bucket", client=FakeS3Client())
+    eco = ECO(db_path=str(tmp_path / "s3.db"), attachments_dir=str(tmp_path / "att"), blob_store=store)
+    eco_id = eco.create_eco("S3", "Desc", "user1")
+    src = tmp_path / "spec.txt"
+    src.write_text("spec")
+    assert eco.add_attachment(eco_id, "spec.txt", str(src), "user1") is True
+    assert eco.get_eco_details(eco_id)['attachments'][0]['file_path'] == f"s3://bucket/{eco_id}_spec.txt"
+    assert eco.get_attachment_path(eco_id, "spec.txt") is None
+    assert eco.get_attachment_url(eco_id, "spec.txt").startswith("https://s3.test/")
+    sha256 = eco.get_eco_details(eco_id)['attachments'][0]['sha256']
+    assert eco.create_attachment_preview(sha256) is True
+    # Previews are shared through the bucket but are not attachment blobs
+    preview = eco.get_attachment_preview(eco_id, "spec.txt")
+    assert store.exists(preview['blob_key']) and preview['file_path'] is None
+    assert preview['url'].startswith(f"https://s3.test/bucket/{preview['blob_key']}")
+    assert [key for key, _ in store.iter_blobs()] == [f"{eco_id}_spec.txt"]
+
+
+@pytest.mark.skipif(not os.environ.get("ECO_TEST_S3_ENDPOINT"), reason="set ECO_TEST_S3_ENDPOINT and ECO_TEST_S3_BUCKET")
+def test_s3_blob_store_against_server(tmp_path):  # pragma: no cover - needs a MinIO-style server
+    store = S3BlobStore(os.environ["ECO_TEST_S3_BUCKET"], prefix=f"test-{uuid.uuid4().hex}",
+                        endpoint_url=os.environ["ECO_TEST_S3_ENDPOINT"])
+    src = tmp_path / "blob.bin"
+    src.write_bytes(os.urandom(1024))
+    store.put_file("blob.bin", src)
+    try:
+        with store.local_file("blob.bin") as path:
+            assert path.read_bytes() == src.read_bytes()
+        assert store.presigned_url("blob.bin", "blob.bin")
+    finally:
+        store.delete("blob.bin")
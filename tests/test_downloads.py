@@ -0,0 +1,114 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import downloads
+
+
+def _run(response, headers=(), extensions=None):
+    scope = {"type": "http", "method": "GET", "headers": list(headers), "extensions": extensions or {}}
+    messages = []
+
+    async def receive():
+        await asyncio.Event().wait()  # The client never disconnects
+
+    async def send(message):
+        if message["type"] == downloads.ZEROCOPY_EXTENSION:
+            f = message["file"]
+            f.seek(message["offset"])
+            message = dict(message, data=f.read(message["count"]))
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return messages
+
+
+def test_zerocopy_hands_the_file_to_the_server(tmp_path):
+    path = tmp_path / "part.bin"
+    path.write_bytes(b"x" * 5000)
+    response = downloads.ZeroCopyFileResponse(str(path), filename="part.bin")
+
+    start, body = _run(response, extensions={downloads.ZEROCOPY_EXTENSION: {}})
+    assert start["type"] == "http.response.start"
+    assert dict(start["headers"])[b"content-length"] == b"5000"
+    assert body["type"] == downloads.ZEROCOPY_EXTENSION
+    assert body["count"] == 5000 and body["data"] == b"x" * 5000
+
+
+def test_falls_back_to_reading_the_file(tmp_path):
+    path = tmp_path / "part.bin"
+    path.write_bytes(b"0123456789")
+
+    # Servers without the extension, and range requests, get an ordinary streamed body
+    for extensions, headers, expected in (
+        (None, (), b"0123456789"),
+        ({downloads.ZEROCOPY_EXTENSION: {}}, ((b"range", b"bytes=2-4"),), b"234"),
+    ):
+        messages = _run(downloads.ZeroCopyFileResponse(str(path)), headers, extensions)
+        assert all(m["type"] != downloads.ZEROCOPY_EXTENSION for m in messages)
+        assert b"".join(m.get("body", b"") for m in messages[1:]) == expected
+
+
+def test_attachment_download_offload(eco_system, tmp_path, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "eco_system", eco_system)
+    eco_system.register_user("user", "password1")
+    auth_headers = {"X-API-Token": eco_system.generate_token("user", "password1")}
+    client = TestClient(api.app)
+    src = tmp_path / "spec sheet.pdf"
+    src.write_bytes(b"%PDF-1.4 drawing")
+    eco_id = eco_system.create_eco("Offload", "Desc", "user")
+    eco_system.add_attachment(eco_id, "spec sheet.pdf", str(src), "user")
+    url = f"/ecos/{eco_id}/attachments/spec sheet.pdf"
+
+    resp = client.get(url, headers=auth_headers)
+    assert resp.content == b"%PDF-1.4 drawing"
+    assert "X-Accel-Redirect" not in resp.headers
+
+    monkeypatch.setattr(downloads, "ATTACHMENT_OFFLOAD", "x-accel-redirect")
+    resp = client.get(url, headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.content == b""
+    assert resp.headers["X-Accel-Redirect"] == f"/internal/attachments/{eco_id}_spec%20sheet.pdf"
+    assert resp.headers["content-type"] == "application/pdf"
+    assert "spec%20sheet.pdf" in resp.headers["content-disposition"]
+
+    monkeypatch.setattr(downloads, "ATTACHMENT_OFFLOAD", "x-sendfile")
+    resp = client.get(url, headers=auth_headers)
+    assert resp.headers["X-Sendfile"] == str(eco_system.blob_store.root / f"{eco_id}_spec sheet.pdf")
+
+    # Offloading never skips the permission check
+    resp = client.get(url, headers={"X-API-Token": "wrong"})
+    assert resp.status_code == 401 and "X-Sendfile" not in resp.headers
+
+
+def test_zerocopy_download_through_the_app(eco_system, tmp_path, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "eco_system", eco_system)
+    eco_system.register_user("user", "password1")
+    auth_headers = {"X-API-Token": eco_system.generate_token("user", "password1")}
+    src = tmp_path / "drawing.pdf"
+    src.write_bytes(b"%PDF-1.4 " * 1000)
+    eco_id = eco_system.create_eco("Zero copy", "Desc", "user")
+    eco_system.add_attachment(eco_id, "drawing.pdf", str(src), "user")
+    sent = []
+
+    async def server(scope, receive, send):
+        # Stands in for an ASGI server offering the extension: every
+        # middleware must pass the message through for the download to work
+        scope = dict(scope, extensions={**scope.get("extensions", {}), downloads.ZEROCOPY_EXTENSION: {}})
+
+        async def send_file(message):
+            if message["type"] == downloads.ZEROCOPY_EXTENSION:
+                sent.append(message["count"])
+                message["file"].seek(message["offset"])
+                message = {"type": "http.response.body", "body": message["file"].read(message["count"])}
+            await send(message)
+
+        await api.app(scope, receive, send_file)
+
+    resp = TestClient(server).get(f"/ecos/{eco_id}/attachments/drawing.pdf", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.content == src.read_bytes()
+    assert sent == [src.stat().st_size]
+    assert resp.headers["X-Content-Type-Options"] == "nosniff" and "X-Request-ID" in resp.headers
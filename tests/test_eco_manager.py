@@ -1,9 +1,13 @@
+import datetime
 import os
 import sqlite3
+import threading
 import time
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
 from eco_manager import ECO
 
 def test_create_user(eco_system):
@@ -74,6 +78,21 @@ def test_update_nonexistent_eco(eco_system):
     assert eco_system.update_eco(999, "X", "Y", "user1") is False
 
 
+def test_writes_check_expected_version(eco_system):
+    eco_id = eco_system.create_eco("Versioned", "Desc", "user1")
+    assert eco_system.get_eco_details(eco_id)["version"] == 1
+    assert eco_system.update_eco(eco_id, "Mine", "Desc", "user1", expected_version=1) is True
+    # A second editor who also read version 1 loses instead of overwriting
+    assert eco_system.update_eco(eco_id, "Theirs", "Desc", "user2", expected_version=1) is False
+    assert eco_system.submit_eco(eco_id, "user2", expected_version=1) is False
+    assert eco_system.get_eco_details(eco_id)["title"] == "Mine"
+    assert eco_system.submit_eco(eco_id, "user2", expected_version=2) is True
+    assert eco_system.current_version(eco_id) == 3
+    assert eco_system.delete_eco(eco_id, expected_version=2) is False
+    assert eco_system.delete_eco(eco_id, expected_version=3) is True
+    assert eco_system.current_version(eco_id) is None
+
+
 def test_delete_eco(eco_system):
     eco_id = eco_system.create_eco("Delete Me", "Desc", "user1")
     assert eco_system.delete_eco(eco_id) is True
@@ -219,9 +238,11 @@ def test_add_attachment_exception(eco_system, tmp_path):
     source_file = tmp_path / "valid.txt"
     source_file.write_text("content")
     
-    # Mock shutil.copy2 to raise an exception
-    with patch('shutil.copy2', side_effect=OSError("Disk full")):
+    # Fail the rename that moves the finished copy into place
+    with patch('blobstore.os.replace', side_effect=OSError("Disk full")):
         assert eco_system.add_attachment(eco_id, "valid.txt", str(source_file), "user1") is False
+    # Neither the blob nor its partial copy is left behind
+    assert os.listdir(eco_system.attachments_dir) == []
 
 def test_generate_report(eco_system, tmp_path):
     eco_id = eco_system.create_eco("Report Test", "Some Description", "userR")
@@ -255,7 +276,7 @@ def test_generate_report_no_data(eco_system, tmp_path):
     eco_id = eco_system.create_eco("Empty Test", "Desc", "user1")
     
     # Manually clear history to test the "No history" branch
-    with sqlite3.connect(eco_system.db_path) as conn:
+    with eco_system._connect() as conn:
         conn.execute("DELETE FROM eco_history WHERE eco_id = ?", (eco_id,))
         conn.commit()
         
@@ -341,6 +362,23 @@ def test_list_ecos_pagination(eco_system):
     assert len(eco_system.list_ecos(limit=10, offset=3)) == 2
 
 
+def test_list_windows_are_stable_with_count_and_version(eco_system):
+    for i in range(7):
+        eco_system.create_eco(f"ECO {i}", "D", "user")
+    with eco_system._connect() as conn:
+        conn.execute("UPDATE ecos SET created_at = '2024-01-01T00:00:00'")  # Ties on the sort key
+    windows = [r[0] for offset in range(0, 7, 3) for r in eco_system.list_ecos(limit=3, offset=offset)]
+    assert windows == sorted(windows, reverse=True)
+    assert eco_system.count_ecos() == 7
+    assert eco_system.count_ecos(search="ECO 1") == 1
+
+    version = eco_system.list_version()
+    eco_system.submit_eco(windows[0], "user")
+    assert eco_system.list_version() > version
+    eco_system.delete_eco(windows[1])
+    assert eco_system.count_ecos() == 6
+
+
 def test_delete_nonexistent_user(eco_system):
     assert eco_system.delete_user(999) is False
 
@@ -352,3 +390,576 @@ def test_mime_type_detection(eco_system, tmp_path):
     eco_system.add_attachment(eco_id, "test.pdf", str(source_file), "user1")
     details = eco_system.get_eco_details(eco_id)
     assert details['attachments'][0]['mime_type'] == 'application/pdf'
+
+
+@pytest.mark.sqlite_only
+def test_schema_version_recorded(eco_system):
+    from eco_manager import SCHEMA_VERSION
+    with sqlite3.connect(eco_system.db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+@pytest.mark.sqlite_only
+def test_current_schema_skips_migrations(eco_system):
+    with patch.object(ECO, '_apply_migrations') as apply:
+        ECO(db_path=eco_system.db_path, attachments_dir=str(eco_system.attachments_dir))
+    apply.assert_not_called()
+
+
+def test_migrates_legacy_database(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL)")
+        conn.execute("INSERT INTO users (username) VALUES ('old')")
+
+    eco = ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"))
+    assert eco.register_user("new", "password1", email="new@example.com") is True
+    emails = {u['username']: u['email'] for u in eco.get_all_users()}
+    assert emails == {"old": None, "new": "new@example.com"}
+
+
+@pytest.mark.sqlite_only
+def test_migrations_wait_for_the_migration_lock(tmp_path):
+    from eco_manager import SCHEMA_VERSION
+    from storage import SQLiteStorage
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL)")
+    worker = threading.Thread(target=ECO, kwargs={"db_path": db_path, "attachments_dir": str(tmp_path / "att")})
+    with SQLiteStorage(db_path).migration_lock():
+        worker.start()
+        time.sleep(0.2)
+        assert worker.is_alive()
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    worker.join()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_run_in_batches(tmp_path):
+    from eco_manager import _run_in_batches
+    with sqlite3.connect(tmp_path / "batch.db", isolation_level=None) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.executemany("INSERT INTO t (x) VALUES (NULL)", [()] * 7)
+        conn.execute("BEGIN IMMEDIATE")
+        updated = _run_in_batches(
+            conn,
+            "UPDATE t SET x = 1 WHERE rowid IN (SELECT rowid FROM t WHERE x IS NULL LIMIT ?)",
+            batch_size=3,
+        )
+        conn.execute("COMMIT")
+        assert updated == 7
+        assert conn.execute("SELECT COUNT(*) FROM t WHERE x IS NULL").fetchone()[0] == 0
+
+
+def test_expired_token_rejected(tmp_path):
+    eco = ECO(db_path=str(tmp_path / "ttl.db"), attachments_dir=str(tmp_path / "att"), token_ttl=-1)
+    eco.register_user("shortlived", "password1")
+    token = eco.generate_token("shortlived", "password1")
+    assert eco.get_user_from_token(token) is None
+
+
+def test_token_use_slides_expiry_with_coalesced_writes(eco_system):
+    eco_system.register_user("slider", "password1")
+    token = eco_system.generate_token("slider", "password1")
+    with eco_system._connect() as conn:
+        conn.execute("UPDATE api_tokens SET expires_at = '2000-01-01T00:00:00', last_used_at = '1999-01-01T00:00:00'")
+    # Expired tokens are not revived by use
+    assert eco_system.get_user_from_token(token) is None
+
+    with eco_system._connect() as conn:
+        conn.execute("UPDATE api_tokens SET expires_at = '2999-01-01T00:00:00'")
+    assert eco_system.get_user_from_token(token)['username'] == "slider"
+    with eco_system._connect() as conn:
+        first_use, expires_at = conn.execute("SELECT last_used_at, expires_at FROM api_tokens").fetchone()
+    assert first_use > '2000' and expires_at < '2999'
+
+    # A second use within the touch interval does not write again
+    eco_system.get_user_from_token(token)
+    with eco_system._connect() as conn:
+        assert conn.execute("SELECT last_used_at FROM api_tokens").fetchone()[0] == first_use
+
+
+def test_per_user_token_limit(tmp_path):
+    eco = ECO(db_path=str(tmp_path / "limit.db"), attachments_dir=str(tmp_path / "att"), max_tokens_per_user=2)
+    eco.register_user("busy", "password1")
+    tokens = [eco.generate_token("busy", "password1") for _ in range(3)]
+    assert eco.get_user_from_token(tokens[0]) is None
+    assert eco.get_user_from_token(tokens[1]) is not None
+    assert eco.get_user_from_token(tokens[2]) is not None
+
+
+def test_purge_expired_tokens(eco_system):
+    eco_system.register_user("purger", "password1")
+    live = eco_system.generate_token("purger", "password1")
+    with eco_system._connect() as conn:
+        conn.executemany(
+            "INSERT INTO api_tokens (token_hash, user_id, created_at, expires_at) VALUES (?, 1, '2000', '2000-01-02')",
+            [(eco_system._hash_token(f"dead{i}"),) for i in range(5)],
+        )
+    assert eco_system.token_stats()['expired'] == 5
+    assert eco_system.purge_expired_tokens(batch_size=2) == 5
+    stats = eco_system.token_stats()
+    assert stats['total'] == 1 and stats['expired'] == 0
+    assert eco_system.get_user_from_token(live) is not None
+
+
+def test_migration_backfills_token_expiry(tmp_path):
+    db_path = tmp_path / "v1.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE api_tokens (token TEXT PRIMARY KEY, user_id INTEGER NOT NULL, created_at TEXT NOT NULL)")
+        conn.execute("INSERT INTO api_tokens VALUES ('old', 1, '2999-01-01T12:00:00.123456')")
+    ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"), token_secret="k")
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT expires_at FROM api_tokens").fetchone()[0] == "2999-01-08T12:00:00.123"
+
+
+def test_tokens_stored_hashed(tmp_path):
+    eco = ECO(db_path=str(tmp_path / "hashed.db"), attachments_dir=str(tmp_path / "att"), token_secret="s3cret")
+    eco.register_user("hashed", "password1")
+    token = eco.generate_token("hashed", "password1")
+    with sqlite3.connect(eco.db_path) as conn:
+        stored = conn.execute("SELECT token_hash FROM api_tokens").fetchone()[0]
+    assert isinstance(stored, bytes) and len(stored) == 32
+    assert token.encode() not in stored and bytes.fromhex(token) != stored
+
+    # A different server key cannot authenticate the same token
+    other = ECO(db_path=eco.db_path, attachments_dir=str(tmp_path / "att"), token_secret="other")
+    assert other.get_user_from_token(token) is None
+    assert eco.get_user_from_token(token)['username'] == "hashed"
+
+
+def test_migration_hashes_existing_tokens(tmp_path):
+    db_path = tmp_path / "v2.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, is_admin INTEGER DEFAULT 0)")
+        conn.execute("INSERT INTO users (username) VALUES ('legacy')")
+        conn.execute("CREATE TABLE api_tokens (token TEXT PRIMARY KEY, user_id INTEGER NOT NULL, created_at TEXT NOT NULL)")
+        conn.execute("INSERT INTO api_tokens VALUES ('rawtoken', 1, '2999-01-01T00:00:00')")
+    # Without the server key the tokens cannot be hashed the way the API will check them
+    with pytest.raises(RuntimeError, match="TOKEN_SECRET"):
+        ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"))
+    eco = ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"), token_secret="k")
+    assert eco.get_user_from_token("rawtoken")['username'] == "legacy"
+    with sqlite3.connect(db_path) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(api_tokens)")]
+    assert "token" not in columns
+
+
+def test_job_claim_and_complete(eco_system):
+    job_id = eco_system.enqueue_job("demo", {"n": 1}, username="alice")
+    job = eco_system.claim_job("w1")
+    assert job['id'] == job_id and job['payload'] == {"n": 1} and job['attempts'] == 1
+    # Leased jobs are not handed out twice
+    assert eco_system.claim_job("w2") is None
+    # Only the lease holder can complete it
+    assert eco_system.complete_job(job_id, "w2", {"ok": True}) is False
+    assert eco_system.complete_job(job_id, "w1", {"ok": True}) is True
+    job = eco_system.get_job(job_id)
+    assert job['status'] == "DONE" and job['result'] == {"ok": True} and job['created_by'] == "alice"
+
+
+def test_job_retry_then_fail(eco_system):
+    job_id = eco_system.enqueue_job("flaky", max_attempts=2)
+    eco_system.claim_job("w1")
+    assert eco_system.fail_job(job_id, "w1", "boom") is True
+    job = eco_system.get_job(job_id)
+    assert job['status'] == "PENDING" and job['last_error'] == "boom"
+    # Retry is delayed by backoff
+    assert eco_system.claim_job("w1") is None
+
+    with eco_system._connect() as conn:
+        conn.execute("UPDATE jobs SET run_at = '2000-01-01'")
+    assert eco_system.claim_job("w1")['attempts'] == 2
+    eco_system.fail_job(job_id, "w1", "boom again")
+    assert eco_system.get_job(job_id)['status'] == "FAILED"
+
+
+def test_expired_job_lease_is_reclaimed(eco_system):
+    job_id = eco_system.enqueue_job("slow")
+    eco_system.claim_job("dead-worker", lease_seconds=-1)
+    job = eco_system.claim_job("w2")
+    assert job['id'] == job_id and job['attempts'] == 2
+    assert eco_system.complete_job(job_id, "dead-worker") is False
+    assert eco_system.complete_job(job_id, "w2") is True
+
+
+def test_job_dedupe_key(eco_system):
+    first = eco_system.enqueue_job("periodic", dedupe_key="once")
+    assert eco_system.enqueue_job("periodic", dedupe_key="once") == first
+    eco_system.claim_job("w1")
+    eco_system.complete_job(first, "w1")
+    assert eco_system.enqueue_job("periodic", dedupe_key="once") != first
+
+
+@pytest.mark.sqlite_only
+def test_job_dedupe_when_existing_job_finishes_meanwhile(eco_system, monkeypatch):
+    first = eco_system.enqueue_job("periodic", dedupe_key="race")
+
+    class RacingCursor(sqlite3.Cursor):
+        def execute(self, sql, params=()):
+            if sql.startswith("SELECT id FROM jobs WHERE dedupe_key"):
+                # The queued job completes between the failed INSERT and this lookup
+                super().execute("UPDATE jobs SET status = 'DONE' WHERE id = ?", (first,))
+            return super().execute(sql, params)
+
+    class RacingConnection(sqlite3.Connection):
+        def cursor(self, factory=RacingCursor):
+            return super().cursor(factory)
+
+    path = eco_system.db_path
+    monkeypatch.setattr(eco_system.storage, "connect", lambda **kwargs: sqlite3.connect(path, factory=RacingConnection))
+    second = eco_system.enqueue_job("periodic", dedupe_key="race")
+    assert second != first
+    assert eco_system.get_job(second)["status"] == "PENDING"
+
+
+def test_attachment_preview_pipeline(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Preview", "Desc", "user1")
+    source = tmp_path / "notes.txt"
+    source.write_text("line one\nline two")
+    assert eco_system.add_attachment(eco_id, "notes.txt", str(source), "user1") is True
+
+    attachment = eco_system.get_eco_details(eco_id)['attachments'][0]
+    assert len(attachment['sha256']) == 64
+    assert attachment['preview_mime_type'] is None
+    assert eco_system.get_attachment_preview(eco_id, "notes.txt") is None
+
+    job = eco_system.claim_job("w1")
+    assert job['kind'] == "attachment_preview" and job['payload'] == {"sha256": attachment['sha256']}
+    assert eco_system.create_attachment_preview(attachment['sha256']) is True
+
+    preview = eco_system.get_attachment_preview(eco_id, "notes.txt")
+    assert preview['mime_type'] == "text/plain" and preview['url'] is None
+    assert Path(preview['file_path']).read_text() == "line one\nline two"
+    assert eco_system.blob_store.exists(preview['blob_key'])
+    assert eco_system.get_eco_details(eco_id)['attachments'][0]['preview_mime_type'] == "text/plain"
+
+    # Identical content uploaded elsewhere reuses the preview without a new job
+    other_id = eco_system.create_eco("Other", "Desc", "user1")
+    eco_system.add_attachment(other_id, "copy.txt", str(source), "user1")
+    assert eco_system.get_attachment_preview(other_id, "copy.txt")['sha256'] == attachment['sha256']
+    assert eco_system.claim_job("w1") is None
+
+
+def test_migration_requeues_local_previews(eco_system):
+    from eco_manager import _requeue_local_previews
+    with eco_system._connect() as conn:
+        conn.execute("""
+            INSERT INTO attachment_previews (sha256, mime_type, file_path, file_size, created_at)
+            VALUES ('abc', 'image/jpeg', '/srv/att/.previews/abc.jpg', 10, '2000-01-01')
+        """)
+        _requeue_local_previews(conn)
+        _requeue_local_previews(conn)
+        assert conn.execute("SELECT COUNT(*) FROM attachment_previews").fetchone()[0] == 0
+    job = eco_system.claim_job("w1")
+    assert job['kind'] == "attachment_preview" and job['payload'] == {"sha256": "abc"}
+    assert eco_system.claim_job("w1") is None
+
+
+def test_attachment_without_preview(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Binary", "Desc", "user1")
+    source = tmp_path / "blob.bin"
+    source.write_bytes(b"\x00\x01")
+    eco_system.add_attachment(eco_id, "blob.bin", str(source), "user1")
+    sha256 = eco_system.get_eco_details(eco_id)['attachments'][0]['sha256']
+    assert eco_system.create_attachment_preview(sha256) is False
+    assert eco_system.create_attachment_preview("0" * 64) is False
+
+
+def test_custom_storage_backend(tmp_path):
+    from storage import SQLiteStorage
+
+    class CountingStorage(SQLiteStorage):
+        connections = 0
+
+        def connect(self, **kwargs):
+            CountingStorage.connections += 1
+            return super().connect(**kwargs)
+
+    storage = CountingStorage(str(tmp_path / "custom.db"))
+    eco = ECO(attachments_dir=str(tmp_path / "att"), storage=storage)
+    assert eco.db_path == storage.path
+    before = CountingStorage.connections
+    eco_id = eco.create_eco("Stored", "Desc", "user1")
+    assert eco.get_eco_details(eco_id)['title'] == "Stored"
+    assert CountingStorage.connections > before
+
+
+@pytest.mark.sqlite_only
+def test_database_uses_wal(eco_system):
+    with eco_system._connect() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_replica_reads_see_own_writes(tmp_path):
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage(str(tmp_path / "primary.db"), replica_path=str(tmp_path / "replica.db"))
+    eco = ECO(attachments_dir=str(tmp_path / "att"), storage=storage)
+    eco.create_eco("Before refresh", "Desc", "user1")
+    assert storage.refresh_replica() is True
+
+    eco_id = eco.create_eco("After refresh", "Desc", "user1")
+    # Other readers may see the replica's slightly older snapshot...
+    assert eco.get_eco_details(eco_id) is None
+    assert [e[1] for e in eco.list_ecos()] == ["Before refresh"]
+    # ...but the author is routed to the primary until the replica catches up
+    assert eco.get_eco_details(eco_id, username="user1")['title'] == "After refresh"
+    assert len(eco.list_ecos(username="user1")) == 2
+
+    storage.refresh_replica()
+    assert len(eco.list_ecos(username="user1")) == 2
+    assert eco.get_eco_details(eco_id)['title'] == "After refresh"
+
+
+def test_stale_replica_falls_back_to_primary(tmp_path):
+    from storage import SQLiteStorage
+
+    storage = SQLiteStorage(str(tmp_path / "primary.db"), replica_path=str(tmp_path / "replica.db"))
+    eco = ECO(attachments_dir=str(tmp_path / "att"), storage=storage)
+    storage.refresh_replica()
+    eco_id = eco.create_eco("New", "Desc", "user1")
+    assert eco.get_eco_details(eco_id) is None
+
+    old = datetime.datetime.now().timestamp() - storage.replica_max_staleness - 5
+    os.utime(storage.replica_path, (old, old))
+    assert eco.get_eco_details(eco_id)['title'] == "New"
+
+
+def test_reupload_replaces_attachment_row(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Rev", "Desc", "user1")
+    src = tmp_path / "spec.txt"
+    for content in ("rev A", "rev B"):
+        src.write_text(content)
+        assert eco_system.add_attachment(eco_id, "spec.txt", str(src), "user1")
+    attachments = eco_system.get_eco_details(eco_id)['attachments']
+    assert len(attachments) == 1
+    assert attachments[0]['file_size'] == len("rev B")
+
+
+def test_add_attachments_batch(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Package", "Desc", "user1")
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"dwg-{i}.txt"
+        path.write_text(f"drawing {i}")
+        paths.append((path.name, str(path)))
+    paths.append(("dwg-0.txt", paths[0][1]))
+    paths.append(("ghost.txt", str(tmp_path / "ghost.txt")))
+
+    results = eco_system.add_attachments(eco_id, paths, "user1", threads=3)
+    assert [r["ok"] for r in results] == [True] * 5 + [False, False]
+    assert results[5]["error"] == "Duplicate filename in upload"
+    assert results[6]["error"] == "File not found"
+    assert results[2]["size"] == len("drawing 2") and len(results[2]["sha256"]) == 64
+    attachments = eco_system.get_eco_details(eco_id)["attachments"]
+    assert sorted(a["filename"] for a in attachments) == [f"dwg-{i}.txt" for i in range(5)]
+    entries, _ = eco_system.query_audit(eco_id=eco_id)
+    assert sum(e["action"] == "ATTACHMENT_ADDED" for e in entries) == 5
+
+    # One failed write does not stop the others
+    real_put = eco_system.blob_store.put_file
+    def flaky_put(key, src):
+        if key.endswith("dwg-1.txt"):
+            raise OSError("Disk full")
+        return real_put(key, src)
+    with patch.object(eco_system.blob_store, "put_file", side_effect=flaky_put):
+        results = eco_system.add_attachments(eco_id, paths[:3], "user2")
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert results[1]["error"] == "Could not store file"
+
+
+def test_purge_removes_deleted_eco_files(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Gone", "Desc", "user1")
+    src = tmp_path / "spec.txt"
+    src.write_text("spec")
+    eco_system.add_attachment(eco_id, "spec.txt", str(src), "user1")
+    path = eco_system.get_attachment_path(eco_id, "spec.txt")
+    assert eco_system.delete_eco(eco_id)
+    # The request path only writes the tombstone
+    assert os.path.exists(path)
+    assert eco_system.get_attachment_path(eco_id, "spec.txt") is None
+    assert eco_system.purge_deleted() == {"ecos": 1, "files": 1, "users": 0}
+    assert not os.path.exists(path)
+
+
+def test_workflow_appends_to_audit_log(eco_system):
+    eco_id = eco_system.create_eco("Audited", "Desc", "author")
+    eco_system.submit_eco(eco_id, "author")
+    eco_system.approve_eco(eco_id, "approver", "LGTM")
+    eco_system.delete_eco(eco_id, "admin")
+    entries, cursor = eco_system.query_audit(eco_id=eco_id)
+    assert cursor is None
+    assert [(e['action'], e['username']) for e in reversed(entries)] == [
+        ("CREATED", "author"), ("SUBMITTED", "author"), ("APPROVED", "approver"), ("DELETED", "admin"),
+    ]
+    assert eco_system.verify_audit_chain() == {"ok": True, "checked": 4, "first_bad_id": None}
+
+
+def test_audit_log_is_append_only(eco_system):
+    eco_system.create_eco("Audited", "Desc", "user1")
+    with eco_system._connect() as conn:
+        with pytest.raises(sqlite3.IntegrityError, match="append-only"):
+            conn.execute("UPDATE audit_log SET comment = 'x'")
+        with pytest.raises(sqlite3.IntegrityError, match="append-only"):
+            conn.execute("DELETE FROM audit_log")
+
+
+@pytest.mark.sqlite_only
+def test_audit_chain_detects_tampering(eco_system):
+    for i in range(3):
+        eco_system.create_eco(f"ECO {i}", "Desc", "user1")
+    with eco_system._connect() as conn:
+        conn.execute("DROP TRIGGER audit_log_no_update")
+        conn.execute("UPDATE audit_log SET username = 'someone_else' WHERE id = 2")
+        conn.commit()
+    assert eco_system.verify_audit_chain(batch_size=2) == {"ok": False, "checked": 1, "first_bad_id": 2}
+
+
+def test_query_audit_filters_and_pages(eco_system):
+    ids = [eco_system.create_eco(f"ECO {i}", "Desc", "alice") for i in range(5)]
+    for eco_id in ids:
+        eco_system.submit_eco(eco_id, "alice")
+        eco_system.approve_eco(eco_id, "bob")
+    pages, cursor = [], None
+    while True:
+        entries, cursor = eco_system.query_audit(username="bob", action="APPROVED", limit=2, cursor=cursor)
+        pages.append([e['eco_id'] for e in entries])
+        if cursor is None:
+            break
+    assert pages == [[ids[4], ids[3]], [ids[2], ids[1]], [ids[0]]]
+    assert eco_system.query_audit(username="alice", action="APPROVED") == ([], None)
+    future = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+    assert eco_system.query_audit(since=future) == ([], None)
+
+
+def test_query_audit_finds_purged_users(eco_system):
+    eco_id = eco_system.create_eco("Purged", "Desc", "alice")
+    eco_system.submit_eco(eco_id, "alice")
+    eco_system.approve_eco(eco_id, "bob")
+    eco_system.delete_eco(eco_id, "alice")
+    users = {u['username']: u['id'] for u in eco_system.get_all_users()}
+    assert eco_system.delete_user(users["bob"]) is True
+    assert eco_system.purge_deleted()["users"] == 1
+
+    entries, _ = eco_system.query_audit(username="bob")
+    assert [(e['eco_id'], e['action']) for e in entries] == [(eco_id, "APPROVED")]
+
+
+@pytest.mark.sqlite_only
+def test_query_audit_by_username_uses_index(eco_system):
+    with eco_system._connect() as conn:
+        plan = conn.execute("""
+            EXPLAIN QUERY PLAN SELECT id FROM audit_log WHERE username = ?
+            ORDER BY performed_at DESC, id DESC
+        """, ("bob",)).fetchall()
+    assert any("idx_audit_log_username" in row[3] for row in plan)
+
+
+def test_migration_seeds_audit_log_from_history(tmp_path):
+    db_path = tmp_path / "legacy_audit.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL)")
+        conn.execute("""CREATE TABLE eco_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, eco_id INTEGER NOT NULL, action TEXT NOT NULL,
+            comment TEXT, performed_by INTEGER NOT NULL, performed_at TEXT NOT NULL
+        )""")
+        conn.execute("INSERT INTO users (username) VALUES ('old')")
+        conn.execute("INSERT INTO eco_history VALUES (1, 7, 'CREATED', NULL, 1, '2020-01-01T00:00:00')")
+        conn.execute("INSERT INTO eco_history VALUES (2, 7, 'SUBMITTED', 'ready', 1, '2020-01-02T00:00:00')")
+    eco = ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"))
+    entries, _ = eco.query_audit(eco_id=7)
+    assert [(e['action'], e['username']) for e in entries] == [("SUBMITTED", "old"), ("CREATED", "old")]
+    eco.create_eco("New", "Desc", "user1")
+    assert eco.verify_audit_chain() == {"ok": True, "checked": 3, "first_bad_id": None}
+
+
+def test_soft_deleted_eco_is_hidden_then_purged(eco_system):
+    eco_id = eco_system.create_eco("Doomed", "Desc", "user1")
+    for i in range(5):
+        eco_system.update_eco(eco_id, f"Doomed {i}", "Desc", "user1")
+    assert eco_system.delete_eco(eco_id, "admin") is True
+    assert eco_system.delete_eco(eco_id, "admin") is False
+    assert eco_system.list_ecos() == []
+    assert eco_system.submit_eco(eco_id, "user1") is False
+    assert eco_system.update_eco(eco_id, "Back", "Desc", "user1") is False
+    with eco_system._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM eco_history WHERE eco_id = ?", (eco_id,)).fetchone()[0] == 6
+        assert conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'purge_deleted'").fetchone()[0] == 1
+
+    assert eco_system.purge_deleted(batch_size=2)["ecos"] == 1
+    with eco_system._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM eco_history WHERE eco_id = ?", (eco_id,)).fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM ecos").fetchone()[0] == 0
+
+
+@pytest.mark.sqlite_only
+def test_list_ecos_uses_live_index(eco_system):
+    with eco_system._connect() as conn:
+        plan = conn.execute("""
+            EXPLAIN QUERY PLAN SELECT e.id FROM ecos e JOIN users u ON e.created_by = u.id
+            WHERE e.deleted_at IS NULL AND status = ? ORDER BY created_at DESC LIMIT 10
+        """, ("DRAFT",)).fetchall()
+    assert any("idx_ecos_live_status" in row[3] for row in plan)
+
+
+def test_deleted_user_keeps_attribution_until_unreferenced(eco_system):
+    eco_system.register_user("admin1", "password1")
+    eco_system.register_user("author", "password1")
+    eco_system.register_user("idle", "password1")
+    eco_id = eco_system.create_eco("Kept", "Desc", "author")
+    users = {u['username']: u['id'] for u in eco_system.get_all_users()}
+    assert eco_system.delete_user(users["author"]) is True
+    assert eco_system.delete_user(users["idle"]) is True
+    assert eco_system.delete_user(users["idle"]) is False
+    assert {u['username'] for u in eco_system.get_all_users()} == {"admin1"}
+    assert eco_system.generate_token("author", "password1") is None
+
+    assert eco_system.purge_deleted()["users"] == 1
+    assert eco_system.get_eco_details(eco_id)['created_by'] == "author"
+
+
+@pytest.mark.sqlite_only
+def test_user_purge_checks_use_indexes(eco_system):
+    with eco_system._connect() as conn:
+        for table, column in (("ecos", "created_by"), ("eco_history", "performed_by"),
+                              ("attachments", "uploaded_by"), ("jobs", "created_by")):
+            plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT 1 FROM {table} WHERE {column} = ?", (1,)).fetchall()
+            assert all(row[3].startswith("SEARCH") for row in plan), (table, plan)
+
+def test_change_feed(eco_system, tmp_path):
+    first = eco_system.create_eco("First", "Desc", "user1")
+    second = eco_system.create_eco("Second", "Desc", "user1")
+    feed = eco_system.changes_since(0)
+    assert [c["eco_id"] for c in feed["changes"]] == [first, second]
+    assert feed["changes"][0]["eco"]["title"] == "First" and feed["has_more"] is False
+    since = feed["next_since"]
+    assert eco_system.changes_since(since)["changes"] == []
+
+    # Every kind of write moves the ECO forward; each ECO is reported once
+    src = tmp_path / "spec.txt"
+    src.write_text("spec")
+    eco_system.update_eco(first, "First v2", "Desc", "user1")
+    eco_system.add_attachment(first, "spec.txt", str(src), "user1")
+    eco_system.submit_eco(second, "user1")
+    eco_system.submit_eco(first, "user1")
+    feed = eco_system.changes_since(since)
+    assert [c["eco_id"] for c in feed["changes"]] == [second, first]
+    eco = feed["changes"][1]["eco"]
+    assert (eco["title"], eco["status"]) == ("First v2", "SUBMITTED")
+    assert [a["filename"] for a in eco["attachments"]] == ["spec.txt"]
+    assert eco["version"] == eco_system.current_version(first)
+
+    # Paging resumes from next_since
+    page = eco_system.changes_since(since, limit=1)
+    assert page["has_more"] is True and [c["eco_id"] for c in page["changes"]] == [second]
+    assert [c["eco_id"] for c in eco_system.changes_since(page["next_since"])["changes"]] == [first]
+
+    # Deleted ECOs leave a tombstone, which outlives the purge
+    since = feed["next_since"]
+    eco_system.delete_eco(second, "user1")
+    eco_system.purge_deleted()
+    change, = eco_system.changes_since(since)["changes"]
+    assert (change["eco_id"], change["deleted"], change["eco"]) == (second, True, None)
@@ -0,0 +1,277 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import maintenance
+from eco_manager import ECO
+
+
+def _fragment(eco):
+    eco_ids = [eco.create_eco(f"ECO {i}", "x" * 4000, "user1") for i in range(200)]
+    for eco_id in eco_ids:
+        eco.delete_eco(eco_id)
+
+
+@pytest.mark.sqlite_only
+def test_new_database_uses_incremental_vacuum(eco_system):
+    with eco_system._connect() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == maintenance.AUTO_VACUUM_INCREMENTAL
+
+
+@pytest.mark.sqlite_only
+def test_vacuum_releases_free_pages(eco_system):
+    _fragment(eco_system)
+    with eco_system._connect() as conn:
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    result = maintenance.vacuum(eco_system, pages_per_step=16, sleep=0)
+    assert result["freed_pages"] > 0
+    with eco_system._connect() as conn:
+        assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+
+def test_convert_legacy_database_to_incremental(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password_hash TEXT)")
+    eco = ECO(db_path=str(db_path), attachments_dir=str(tmp_path / "att"))
+    assert "skipped" in maintenance.vacuum(eco)
+    maintenance.convert_to_incremental(eco)
+    assert "skipped" not in maintenance.vacuum(eco)
+
+
+@pytest.mark.sqlite_only
+def test_backup_is_consistent_and_pruned(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Backed up", "Desc", "user1")
+    backup_dir = tmp_path / "backups"
+    for i in range(3):
+        old = backup_dir / f"test_eco-2000010{i}-000000.db"
+        backup_dir.mkdir(exist_ok=True)
+        old.write_bytes(b"")
+    result = maintenance.backup(eco_system, str(backup_dir), keep=2, pages=1, sleep=0)
+    assert result["removed"] == 2
+    assert len(os.listdir(backup_dir)) == 2
+    restored = ECO(db_path=result["path"], attachments_dir=str(tmp_path / "att"))
+    assert restored.get_eco_details(eco_id)["title"] == "Backed up"
+
+
+@pytest.mark.sqlite_only
+def test_backup_pauses_after_each_step(eco_system, tmp_path, monkeypatch):
+    _fragment(eco_system)
+    with eco_system._connect() as conn:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    pauses = []
+    monkeypatch.setattr(time, "sleep", pauses.append)
+    maintenance.backup(eco_system, str(tmp_path / "backups"), pages=1, sleep=0.01)
+    assert pauses == [0.01] * (page_count - 1)
+
+
+def test_check_reports_missing_attachments(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("With file", "Desc", "user1")
+    src = tmp_path / "spec.txt"
+    src.write_text("spec")
+    assert eco_system.add_attachment(eco_id, "spec.txt", str(src), "user1")
+    assert maintenance.check(eco_system)["ok"] is True
+
+    os.remove(eco_system.get_attachment_path(eco_id, "spec.txt"))
+    result = maintenance.check(eco_system)
+    assert result["ok"] is False
+    assert result["missing_attachments"] == [f"ECO {eco_id}: spec.txt"]
+
+
+def test_run_maintenance_reports_timings(eco_system, tmp_path):
+    results = maintenance.run_maintenance(eco_system, backup_dir=str(tmp_path / "backups"))
+    assert set(results) == {"backup", "vacuum", "analyze", "check"}
+    assert all(result["seconds"] >= 0 for result in results.values())
+
+
+def _orphan(eco, key, age=maintenance.GC_GRACE_PERIOD + 60):
+    path = eco.blob_store.root / key
+    path.write_text("orphan")
+    old = time.time() - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_gc_finds_and_deletes_orphans(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Files", "Desc", "user1")
+    src = tmp_path / "keep.txt"
+    src.write_text("keep")
+    assert eco_system.add_attachment(eco_id, "keep.txt", str(src), "user1")
+    old_orphan = _orphan(eco_system, "999_gone.txt")
+    recent = _orphan(eco_system, "998_uploading.txt", age=0)
+
+    report = maintenance.collect_garbage(eco_system)
+    assert report["orphan_keys"] == ["999_gone.txt"]
+    assert report["deleted"] == 0 and old_orphan.exists()
+
+    result = maintenance.collect_garbage(eco_system, delete=True, batch_size=1, sleep=0)
+    assert result["deleted"] == 1
+    assert not old_orphan.exists()
+    assert recent.exists()
+    assert eco_system.get_attachment_path(eco_id, "keep.txt") is not None
+    assert os.path.exists(eco_system.get_attachment_path(eco_id, "keep.txt"))
+
+
+def test_gc_resumes_from_checkpoint(eco_system):
+    for i in range(5):
+        _orphan(eco_system, f"90{i}_old.txt")
+    first = maintenance.collect_garbage(eco_system, delete=True, limit=3, sleep=0)
+    assert (first["scanned"], first["deleted"], first["complete"]) == (3, 3, False)
+    second = maintenance.collect_garbage(eco_system, delete=True, limit=3, sleep=0)
+    assert (second["scanned"], second["deleted"], second["complete"]) == (2, 2, True)
+    assert maintenance._get_state(eco_system, maintenance.GC_CHECKPOINT) == ""
+
+
+def test_gc_keeps_blob_claimed_by_concurrent_upload(eco_system, tmp_path):
+    _orphan(eco_system, "1_claimed.txt")
+    eco_id = eco_system.create_eco("Race", "Desc", "user1")
+    assert eco_id == 1
+    src = tmp_path / "claimed.txt"
+    src.write_text("new")
+    assert eco_system.add_attachment(eco_id, "claimed.txt", str(src), "user1")
+    assert maintenance._delete_orphans(eco_system, ["1_claimed.txt"]) == 0
+    assert (eco_system.blob_store.root / "1_claimed.txt").read_text() == "new"
+
+
+def test_gc_keeps_blob_stored_before_its_row(eco_system, tmp_path, monkeypatch):
+    _orphan(eco_system, "1_racing.txt")
+    eco_id = eco_system.create_eco("Race", "Desc", "user1")
+    src = tmp_path / "racing.txt"
+    src.write_text("new")
+    put_file = eco_system.blob_store.put_file
+    collected = []
+
+    def put_then_collect(key, path):
+        # The GC runs after the blob is written but before its row is committed
+        sha256 = put_file(key, path)
+        collected.append(maintenance._delete_orphans(eco_system, [key]))
+        return sha256
+
+    monkeypatch.setattr(eco_system.blob_store, "put_file", put_then_collect)
+    assert eco_system.add_attachment(eco_id, "racing.txt", str(src), "user1")
+    assert collected == [0]
+    assert (eco_system.blob_store.root / "1_racing.txt").read_text() == "new"
+    with eco_system._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM blob_uploads").fetchone()[0] == 0
+
+
+def test_gc_deletes_blobs_without_the_write_lock(eco_system, monkeypatch):
+    orphan = _orphan(eco_system, "999_gone.txt")
+    delete = eco_system.blob_store.delete
+
+    def delete_while_writing(key):
+        # Writers are not held up by a slow blob store
+        eco_system.create_eco("Meanwhile", "Desc", "user1")
+        delete(key)
+
+    monkeypatch.setattr(eco_system.blob_store, "delete", delete_while_writing)
+    assert maintenance._delete_orphans(eco_system, ["999_gone.txt"]) == 1
+    assert not orphan.exists()
+    with eco_system._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM blob_uploads").fetchone()[0] == 0
+
+
+def test_upload_waits_for_gc_delete_claim(eco_system, tmp_path):
+    eco_id = eco_system.create_eco("Race", "Desc", "user1")
+    src = tmp_path / "late.txt"
+    src.write_text("new")
+    with eco_system._connect() as conn:
+        conn.execute("INSERT INTO blob_uploads (blob_key, started_at, deleting) VALUES (?, ?, 1)",
+                     (f"{eco_id}_late.txt", datetime.datetime.now().isoformat()))
+        conn.commit()
+    upload = threading.Thread(target=eco_system.add_attachment, args=(eco_id, "late.txt", str(src), "user1"))
+    upload.start()
+    time.sleep(0.3)
+    assert not eco_system.blob_store.exists(f"{eco_id}_late.txt")
+    with eco_system._connect() as conn:
+        conn.execute("DELETE FROM blob_uploads")
+        conn.commit()
+    upload.join()
+    assert (eco_system.blob_store.root / f"{eco_id}_late.txt").read_text() == "new"
+
+
+def test_gc_expires_abandoned_upload_claims(eco_system):
+    orphan = _orphan(eco_system, "999_abandoned.txt")
+    with eco_system._connect() as conn:
+        conn.execute("INSERT INTO blob_uploads (blob_key, started_at) VALUES ('999_abandoned.txt', '2000-01-01')")
+        conn.commit()
+    assert maintenance.collect_garbage(eco_system, delete=True, sleep=0)["deleted"] == 0
+    assert orphan.exists()
+    assert maintenance.collect_garbage(eco_system, delete=True, sleep=0)["deleted"] == 1
+
+
+def _attach(eco, tmp_path, count):
+    eco_id = eco.create_eco("Scrub", "Desc", "user1")
+    for i in range(count):
+        src = tmp_path / f"part{i}.txt"
+        src.write_bytes(os.urandom(64 * 1024))
+        assert eco.add_attachment(eco_id, src.name, str(src), "user1")
+    return eco_id
+
+
+def test_scrub_detects_corrupt_and_missing_blobs(eco_system, tmp_path):
+    eco_id = _attach(eco_system, tmp_path, 3)
+    assert maintenance.scrub_attachments(eco_system, max_mb_per_s=0)["corrupt"] == 0
+    # Bit rot in one file, another lost
+    with open(eco_system.get_attachment_path(eco_id, "part0.txt"), "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(bytes([first[0] ^ 0xFF]))
+    os.remove(eco_system.get_attachment_path(eco_id, "part1.txt"))
+
+    result = maintenance.scrub_attachments(eco_system, max_mb_per_s=0)
+    assert (result["checked"], result["corrupt"], result["complete"]) == (3, 2, True)
+    assert result["corrupt_attachments"] == [f"ECO {eco_id}: part0.txt", f"ECO {eco_id}: part1.txt"]
+    damaged = {a["filename"] for a in eco_system.get_eco_details(eco_id)["attachments"] if a["corrupt_at"]}
+    assert damaged == {"part0.txt", "part1.txt"}
+    report = maintenance.check(eco_system)
+    assert report["corrupt_count"] == 2 and not report["ok"]
+
+    # Uploading the file again replaces the damaged copy
+    src = tmp_path / "part0.txt"
+    assert eco_system.add_attachment(eco_id, "part0.txt", str(src), "user1")
+    assert eco_system.verify_attachment(eco_id, "part0.txt") is True
+    assert maintenance.check(eco_system)["corrupt_count"] == 1
+
+
+def test_scrub_results_change_the_eco_version(eco_system, tmp_path):
+    eco_id = _attach(eco_system, tmp_path, 1)
+    path = eco_system.get_attachment_path(eco_id, "part0.txt")
+    intact = eco_system.eco_version(eco_id)
+    original = open(path, "rb").read()
+    with open(path, "r+b") as f:
+        f.write(bytes([original[0] ^ 0xFF]))
+    maintenance.scrub_attachments(eco_system, max_mb_per_s=0)
+    corrupt = eco_system.eco_version(eco_id)
+    assert corrupt != intact
+
+    with open(path, "wb") as f:
+        f.write(original)
+    assert eco_system.verify_attachment(eco_id, "part0.txt") is True
+    assert eco_system.eco_version(eco_id) != corrupt
+
+def test_scrub_is_rate_limited_and_resumable(eco_system, tmp_path):
+    _attach(eco_system, tmp_path, 5)  # 320 KiB
+    start = time.monotonic()
+    first = maintenance.scrub_attachments(eco_system, limit=3, max_mb_per_s=1)
+    # 192 KiB at 1 MB/s takes at least ~0.19 s
+    assert time.monotonic() - start >= 0.15
+    assert first["mb_per_s"] <= 1.1
+    assert (first["checked"], first["complete"]) == (3, False)
+    second = maintenance.scrub_attachments(eco_system, limit=3, max_mb_per_s=0)
+    assert (second["checked"], second["complete"]) == (2, True)
+    assert maintenance._get_state(eco_system, maintenance.SCRUB_CHECKPOINT) == "0"
+
+
+def test_gc_removes_interrupted_writes(eco_system):
+    partial = eco_system.blob_store.root / ".1_big.bin.abc123.partial"
+    partial.write_bytes(b"half")
+    old = time.time() - 2 * maintenance.GC_GRACE_PERIOD
+    os.utime(partial, (old, old))
+    assert maintenance.collect_garbage(eco_system)["partial_writes_removed"] == 0
+    assert maintenance.collect_garbage(eco_system, delete=True, sleep=0)["partial_writes_removed"] == 1
+    assert not partial.exists()
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import pytest
+
+from previews import TEXT_PREVIEW_BYTES, generate_preview
+
+SAMPLE_PDF = Path(__file__).resolve().parent.parent / "attachments" / "1_Electrostatics.pdf"
+
+
+def test_text_preview_is_truncated(tmp_path):
+    src = tmp_path / "big.txt"
+    src.write_text("é" * TEXT_PREVIEW_BYTES)
+    path, mime_type = generate_preview(src, "text/plain", tmp_path / "out" / "abc")
+    assert mime_type == "text/plain" and path.suffix == ".txt"
+    assert len(path.read_bytes()) <= TEXT_PREVIEW_BYTES
+
+
+def test_unsupported_type_has_no_preview(tmp_path):
+    src = tmp_path / "data.bin"
+    src.write_bytes(b"\x00")
+    assert generate_preview(src, "application/octet-stream", tmp_path / "abc") is None
+
+
+def test_image_thumbnail(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    src = tmp_path / "photo.png"
+    Image.new("RGBA", (1200, 800), (255, 0, 0, 128)).save(src)
+    path, mime_type = generate_preview(src, "image/png", tmp_path / "abc")
+    assert mime_type == "image/jpeg"
+    with Image.open(path) as thumb:
+        assert max(thumb.size) <= 320
+
+
+def test_unreadable_image_has_no_preview(tmp_path):
+    pytest.importorskip("PIL.Image")
+    src = tmp_path / "logo.svg"
+    src.write_text('<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"/>')
+    assert generate_preview(src, "image/svg+xml", tmp_path / "abc") is None
+    src = tmp_path / "broken.png"
+    src.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 16)
+    assert generate_preview(src, "image/png", tmp_path / "abc") is None
+
+
+def test_pdf_excerpt(tmp_path):
+    pytest.importorskip("pypdf")
+    path, mime_type = generate_preview(SAMPLE_PDF, "application/pdf", tmp_path / "abc")
+    assert mime_type == "text/plain"
+    assert path.read_text(encoding="utf-8").strip()
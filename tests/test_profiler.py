@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import profiler
+
+
+def _keep_busy(eco, stop):
+    while not stop.is_set():
+        eco.list_ecos(search="x")
+
+
+@pytest.fixture
+def busy_thread(eco_system):
+    eco_system.create_eco("Busy", "Desc", "user1")
+    stop = threading.Event()
+    thread = threading.Thread(target=_keep_busy, args=(eco_system, stop))
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+def test_sample_collects_app_stacks(busy_thread):
+    result = profiler.sample(0.3, interval=0.005)
+    assert result["samples"] > 0
+    assert result["stacks"]
+    assert all(stack.startswith(("api.py:", "eco_manager.py:")) for stack in result["stacks"])
+    assert any(stack.startswith("eco_manager.py:ECO.list_ecos") for stack in result["stacks"])
+    assert result["overhead"] < 0.5
+
+    text = profiler.collapsed(result["stacks"])
+    stack, count = text.splitlines()[0].rsplit(" ", 1)
+    assert int(count) >= 1 and " " not in stack
+
+
+def test_sample_all_threads_and_bounds(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_MAX_SECONDS", 0.05)
+    result = profiler.sample(10, interval=0.01, scope="all")
+    assert result["seconds"] < 1
+    with pytest.raises(ValueError):
+        profiler.sample(0.01, scope="everything")
+
+
+def test_one_profile_at_a_time():
+    with profiler._lock:
+        assert profiler.sample(0.01) is None
+
+
+def test_profile_endpoint(tmp_path, monkeypatch):
+    import api
+    from eco_manager import ECO
+    eco = ECO(db_path=str(tmp_path / "api.db"), attachments_dir=str(tmp_path / "att"))
+    monkeypatch.setattr(api, "eco_system", eco)
+    eco.register_user("admin", "password1")
+    eco.register_user("user", "password1")
+    admin = {"X-API-Token": eco.generate_token("admin", "password1")}
+    user = {"X-API-Token": eco.generate_token("user", "password1")}
+    client = TestClient(api.app)
+
+    monkeypatch.setattr(profiler, "PROFILER_ENABLED", False)
+    assert client.post("/admin/profile?seconds=0.05", headers=admin).status_code == 404
+
+    monkeypatch.setattr(profiler, "PROFILER_ENABLED", True)
+    assert client.post("/admin/profile?seconds=0.05", headers=user).status_code == 403
+    resp = client.post("/admin/profile?seconds=0.05&scope=all", headers=admin)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    assert int(resp.headers["X-Profile-Samples"]) > 0
+    assert resp.headers["X-Profile-PID"].isdigit()
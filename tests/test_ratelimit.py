@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from ratelimit import MemoryBuckets, SQLiteBuckets, classify, client_key
+
+
+@pytest.mark.parametrize("method, path, search, expected", [
+    ("POST", "/token", False, "auth"),
+    ("GET", "/ecos", True, "search"),
+    ("GET", "/ecos", False, "read"),
+    ("GET", "/ecos/3/report", False, "report"),
+    ("POST", "/ecos/3/report/jobs", False, "report"),
+    ("POST", "/ecos/3/attachments", False, "upload"),
+    ("POST", "/ecos/3/attachments/batch", False, "upload"),
+    ("POST", "/ecos/3/approve", False, "write"),
+    ("GET", "/static/app.js", False, None),
+    ("OPTIONS", "/ecos", False, None),
+])
+def test_classify(method, path, search, expected):
+    assert classify(method, path, search) == expected
+
+
+def test_client_key_uses_validated_user_or_ip():
+    assert client_key(7, "10.0.0.1") == "u:7"
+    assert client_key(None, "10.0.0.1") == "ip:10.0.0.1"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBuckets()
+    return SQLiteBuckets(str(tmp_path / "buckets.db"))
+
+
+def test_bucket_allows_burst_then_refills(buckets):
+    assert [buckets.take("k", rate=10.0, burst=3) for _ in range(3)] == [0.0] * 3
+    retry_after = buckets.take("k", rate=10.0, burst=3)
+    assert 0 < retry_after <= 0.1
+    assert buckets.take("other", rate=10.0, burst=3) == 0.0
+    time.sleep(retry_after + 0.01)
+    assert buckets.take("k", rate=10.0, burst=3) == 0.0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / "shared.db")
+    stores = [SQLiteBuckets(path) for _ in range(4)]
+    granted = []
+
+    def hammer(store):
+        for _ in range(25):
+            if store.take("shared", rate=0.001, burst=20) == 0.0:
+                granted.append(1)
+
+    threads = [threading.Thread(target=hammer, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(granted) == 20
@@ -0,0 +1,107 @@
+import gzip
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+import static_assets
+
+
+def _build(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "app.js").write_text(
+        "// Comment line\n"
+        "const URL_BASE = 'http://example.com'; // trailing\n"
+        "function f() {\n"
+        "    return `${URL_BASE}/x`;\n"
+        "}\n" * 20
+    )
+    (source / "style.css").write_text("/* c */\n.a  :hover {\n    color: red;\n}\n" * 40)
+    (source / "index.html").write_text(
+        '<html>\n    <link rel="stylesheet" href="style.css">\n    <script src="app.js"></script>\n</html>\n'
+    )
+    dest = tmp_path / "dist"
+    manifest = static_assets.build(str(source), str(dest))
+    return dest, manifest
+
+
+def test_build_fingerprints_minifies_and_compresses(tmp_path):
+    dest, manifest = _build(tmp_path)
+    assert manifest["index.html"] == "index.html"
+    assert manifest["app.js"].startswith("app.") and manifest["app.js"] != "app.js"
+    assert json.loads((dest / "manifest.json").read_text()) == manifest
+
+    js = (dest / manifest["app.js"]).read_text()
+    assert "Comment" not in js and "trailing" not in js
+    assert "'http://example.com'" in js and "    " not in js
+    css = (dest / manifest["style.css"]).read_text()
+    assert ".a :hover{color:red}" in css
+
+    page = (dest / "index.html").read_text()
+    assert f'href="{manifest["style.css"]}"' in page and f'src="{manifest["app.js"]}"' in page
+    assert gzip.decompress((dest / (manifest["app.js"] + ".gz")).read_bytes()).decode() == js
+
+    # Rebuilding the same input gives the same names
+    assert static_assets.build(str(tmp_path / "src"), str(dest)) == manifest
+
+
+@pytest.mark.parametrize("source", ["const re = /a'b/;\n", "const s = `multi\nline`;\n"])
+def test_minify_js_refuses_what_it_cannot_handle(source):
+    with pytest.raises(ValueError):
+        static_assets.minify_js(source)
+
+
+def test_precompressed_static_files(tmp_path):
+    dest, manifest = _build(tmp_path)
+    app = Starlette(routes=[Mount("/static", static_assets.PrecompressedStaticFiles(directory=str(dest)))])
+    client = TestClient(app)
+
+    resp = client.get(f"/static/{manifest['app.js']}", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Content-Type"].startswith("text/javascript")
+    assert resp.headers["Cache-Control"] == static_assets.IMMUTABLE
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert resp.text == (dest / manifest["app.js"]).read_text()
+    etag = resp.headers["ETag"]
+    resp = client.get(f"/static/{manifest['app.js']}", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert resp.status_code == 304
+
+    resp = client.get(f"/static/{manifest['app.js']}", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in resp.headers
+    assert int(resp.headers["Content-Length"]) == os.path.getsize(dest / manifest["app.js"])
+
+    resp = client.get("/static/index.html", headers={"Accept-Encoding": "gzip;q=0"})
+    assert resp.headers["Cache-Control"] == "no-cache"
+    assert "Content-Encoding" not in resp.headers
+
+
+def test_large_json_responses_are_compressed(tmp_path, monkeypatch):
+    import api
+    from eco_manager import ECO
+    eco = ECO(db_path=str(tmp_path / "api.db"), attachments_dir=str(tmp_path / "att"))
+    monkeypatch.setattr(api, "eco_system", eco)
+    eco.register_user("user", "password1")
+    headers = {"X-API-Token": eco.generate_token("user", "password1")}
+    eco_id = eco.create_eco("Long history", "D" * 4000, "user")
+    client = TestClient(api.app)
+
+    resp = client.get(f"/ecos/{eco_id}", headers={**headers, "Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert int(resp.headers["Content-Length"]) < 4000
+    assert resp.json()["description"] == "D" * 4000
+    assert "ETag" in resp.headers
+
+    resp = client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+
+    # JSON attachments are downloads: they stream as stored, never buffered
+    src = tmp_path / "bom.json"
+    src.write_bytes(b'{"parts": []}' * 1000)
+    eco.add_attachment(eco_id, "bom.json", str(src), "user")
+    resp = client.get(f"/ecos/{eco_id}/attachments/bom.json", headers={**headers, "Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+    assert resp.content == src.read_bytes()
@@ -0,0 +1,180 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import storage
+from eco_manager import ECO, SCHEMA_VERSION
+from storage import SQLiteStorage, _pyformat, storage_from_env
+
+
+def test_pyformat_rewrites_placeholders_outside_literals():
+    assert _pyformat("SELECT id FROM t WHERE a = ? AND b = ?") == "SELECT id FROM t WHERE a = %s AND b = %s"
+    # Literal % signs are escaped everywhere; a ? inside a string stays a ?
+    assert _pyformat("SELECT 'why?' WHERE x LIKE ? OR y LIKE '5%'") == "SELECT 'why?' WHERE x LIKE %s OR y LIKE '5%%'"
+    assert _pyformat("SELECT 'it''s ?', ?") == "SELECT 'it''s ?', %s"
+
+
+def test_default_text_search_is_like_on_every_column(tmp_path):
+    condition, params = SQLiteStorage(str(tmp_path / "s.db")).text_search(["title", "description"], "gear")
+    assert condition == "(title LIKE ? OR description LIKE ?)"
+    assert params == ["%gear%", "%gear%"]
+
+
+def test_storage_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("DATABASE_PATH", str(tmp_path / "env.db"))
+    backend = storage_from_env()
+    assert isinstance(backend, SQLiteStorage) and backend.path == str(tmp_path / "env.db")
+
+    created = {}
+    monkeypatch.setenv("DATABASE_URL", "postgresql://db.example/eco")
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "3")
+    monkeypatch.setattr(storage, "PostgresStorage", lambda url, pool_size: created.update(url=url, size=pool_size))
+    storage_from_env()
+    assert created == {"url": "postgresql://db.example/eco", "size": 3}
+
+
+def test_sqlite_migration_lock_excludes_other_processes(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / "lock.db"))
+    with backend.migration_lock():
+        with pytest.raises(sqlite3.OperationalError):
+            with SQLiteStorage(backend.path).migration_lock(timeout=0.1):
+                pass
+        # Unlike the write lock, it leaves the database itself free
+        with backend.connect() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+    with backend.migration_lock(timeout=0.1):
+        pass
+
+
+def test_postgres_migrations_reach_the_schema_version():
+    from eco_manager import MIGRATIONS, POSTGRES_MIGRATIONS
+    versions = [version for version, _ in POSTGRES_MIGRATIONS]
+    assert versions == sorted(set(versions))
+    # Every SQLite migration after the first PostgreSQL one has a counterpart
+    assert versions == [version for version, _ in MIGRATIONS if version >= versions[0]]
+
+
+def _schema(eco):
+    """Columns of each table, and the names of the explicitly created indexes."""
+    with eco._connect() as conn:
+        if eco.storage.dialect == "sqlite":
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            columns = {table: {row[1] for row in conn.execute(f"PRAGMA table_info({table})")} for table in tables}
+            indexes = {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+            return columns, indexes
+        columns = {}
+        for table, column in conn.execute(
+                "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()"):
+            columns.setdefault(table, set()).add(column)
+        columns.pop("schema_version")
+        indexes = {row[0] for row in conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname LIKE 'idx_%'")}
+        indexes.remove("idx_ecos_search")
+        return columns, indexes
+
+
+def test_postgres_schema_matches_sqlite(pg_storage, tmp_path):
+    sqlite_eco = ECO(db_path=str(tmp_path / "eco.db"), attachments_dir=str(tmp_path / "att"))
+    pg_eco = ECO(storage=pg_storage, attachments_dir=str(tmp_path / "att"))
+    assert _schema(pg_eco) == _schema(sqlite_eco)
+    with pg_eco._connect() as conn:
+        assert conn.execute("SELECT version FROM schema_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_postgres_upgrades_an_older_schema(pg_storage, tmp_path, monkeypatch):
+    import eco_manager
+    first = eco_manager.POSTGRES_MIGRATIONS[0]
+    # A database created before any later migration existed
+    monkeypatch.setattr(eco_manager, "POSTGRES_MIGRATIONS", [first])
+    monkeypatch.setattr(eco_manager, "SCHEMA_VERSION", first[0])
+    eco = ECO(storage=pg_storage, attachments_dir=str(tmp_path / "att"))
+    with eco._connect() as conn:
+        conn.execute("""
+            INSERT INTO attachments (eco_id, filename, mime_type, file_path, file_size, uploaded_by, uploaded_at)
+            VALUES (7, 'a.txt', 'text/plain', 'att/7_a.txt', 1, 1, '2000-01-01')
+        """)
+    monkeypatch.undo()
+
+    eco = ECO(storage=pg_storage, attachments_dir=str(tmp_path / "att"))
+    with eco._connect() as conn:
+        assert conn.execute("SELECT version FROM schema_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT blob_key FROM attachments").fetchone()[0] == "7_a.txt"
+
+
+def test_postgres_migration_lock_outlives_transactions(pg_storage):
+    with pg_storage.migration_lock():
+        with pg_storage.connect() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+        with pytest.raises(sqlite3.OperationalError):
+            with pg_storage.migration_lock(timeout=0.1):
+                pass
+    with pg_storage.migration_lock(timeout=0.1):
+        pass
+
+
+def test_postgres_errors_are_sqlite_errors(pg_storage, tmp_path):
+    eco = ECO(storage=pg_storage, attachments_dir=str(tmp_path / "att"))
+    assert eco.register_user("dup", "password1") is True
+    assert eco.register_user("dup", "password1") is False
+    with pytest.raises(sqlite3.OperationalError):
+        with eco._connect() as conn:
+            conn.execute("SELECT no_such_column FROM ecos")
+
+
+def test_postgres_writers_are_serialized(pg_storage):
+    order = []
+    holding = threading.Event()
+
+    def second_writer():
+        holding.wait()
+        with pg_storage.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            order.append("second")
+
+    with pg_storage.connect() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    thread = threading.Thread(target=second_writer)
+    thread.start()
+    with pg_storage.connect() as conn:
+        conn.execute("INSERT INTO t (x) VALUES (?)", (1,))
+        holding.set()
+        time.sleep(0.2)
+        order.append("first")
+    thread.join()
+    assert order == ["first", "second"]
+
+
+def test_postgres_iterate_streams_rows(pg_storage):
+    with pg_storage.connect() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.executemany("INSERT INTO t (x) VALUES (?)", [(i,) for i in range(2500)])
+    with pg_storage.connect() as conn:
+        rows = pg_storage.iterate(conn, "SELECT x FROM t WHERE x >= ? ORDER BY x", (500,))
+        assert next(rows) == (500,)
+        assert sum(1 for _ in rows) == 1999
+
+
+def test_postgres_search_uses_index(pg_storage, tmp_path):
+    eco = ECO(storage=pg_storage, attachments_dir=str(tmp_path / "att"))
+    eco.create_eco("Bracket redesign", "Thicker mounting plate", "user1")
+    eco.create_eco("Label change", "New part number", "user1")
+    assert [e[1] for e in eco.list_ecos(search="mount")] == ["Bracket redesign"]
+    assert [e[1] for e in eco.list_ecos(search="label numb")] == ["Label change"]
+    assert eco.list_ecos(search="?!") == []
+
+    with eco._connect() as conn:
+        conn.execute("""
+            INSERT INTO ecos (title, description, created_by, created_at, updated_at)
+            SELECT 'Routine change ' || n, 'Nothing to see', 1, '2000-01-01', '2000-01-01'
+            FROM generate_series(1, 5000) AS n
+        """)
+        conn.execute("ANALYZE ecos")
+    where, params = pg_storage.text_search(["title", "description"], "bracket")
+    with eco._connect() as conn:
+        plan = "\n".join(row[0] for row in conn.execute(f"EXPLAIN SELECT id FROM ecos WHERE {where}", params))
+    assert "idx_ecos_search" in plan
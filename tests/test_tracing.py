@@ -0,0 +1,69 @@
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+import tracing
+from eco_manager import ECO
+
+
+@pytest.fixture
+def traced_eco(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "SERVER_TIMING", True)
+    return ECO(db_path=str(tmp_path / "traced.db"), attachments_dir=str(tmp_path / "att"))
+
+
+def test_request_id_from_header():
+    assert tracing.request_id_from_header("abc-123") == "abc-123"
+    for bad in (None, "", "has space", "x" * 100, "inject\r\nHeader: 1"):
+        generated = tracing.request_id_from_header(bad)
+        assert generated != bad and len(generated) == 32
+
+
+def test_trace_records_method_spans_and_sql(traced_eco):
+    trace, token = tracing.start_trace("req-1")
+    try:
+        traced_eco.create_eco("Traced", "Desc", "user1")
+    finally:
+        tracing.end_trace(token)
+    assert "ECO.create_eco" in [name for name, _ in trace.spans]
+    assert trace.sql_count > 0
+    header = trace.server_timing()
+    assert header.startswith("total;dur=")
+    assert f'desc="{trace.sql_count} queries"' in header
+    assert "ECO_create_eco;dur=" in header
+
+
+def test_no_trace_outside_requests(traced_eco):
+    traced_eco.create_eco("Untraced", "Desc", "user1")
+    assert tracing.current_trace() is None
+
+
+def test_slow_query_log_has_plan_and_param_types_only(traced_eco, monkeypatch, caplog):
+    traced_eco.create_eco("Secret title", "Desc", "user1")
+    monkeypatch.setattr(tracing, "SLOW_QUERY_MS", 1e-9)
+    with caplog.at_level(logging.WARNING, logger="eco.slow_query"):
+        traced_eco.list_ecos(search="Secret")
+    messages = [r.getMessage() for r in caplog.records if r.name == "eco.slow_query"]
+    assert messages
+    assert any("plan=[" in m and "(str" in m for m in messages)
+    assert not any("Secret" in m for m in messages)
+
+
+def test_api_sets_request_id_and_server_timing(traced_eco, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "eco_system", traced_eco)
+    traced_eco.register_user("tracer", "password1")
+    token = traced_eco.generate_token("tracer", "password1")
+    client = TestClient(api.app)
+
+    resp = client.get("/ecos", headers={"X-API-Token": token, "X-Request-ID": "client-42"})
+    assert resp.status_code == 200
+    assert resp.headers["X-Request-ID"] == "client-42"
+    timing = resp.headers["Server-Timing"]
+    assert "db;dur=" in timing and "ECO_list_ecos" in timing
+
+    monkeypatch.setattr(tracing, "SERVER_TIMING", False)
+    resp = client.get("/health")
+    assert len(resp.headers["X-Request-ID"]) == 32
+    assert "Server-Timing" not in resp.headers
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+import worker
+
+
+def test_run_job_dispatches_to_handler(eco_system, monkeypatch):
+    seen = []
+    monkeypatch.setitem(worker.JOB_HANDLERS, "record", lambda eco, payload: seen.append(payload) or {"n": len(seen)})
+    job_id = eco_system.enqueue_job("record", {"x": 1})
+    worker.run_job(eco_system, eco_system.claim_job("w1"), "w1")
+    assert seen == [{"x": 1}]
+    assert eco_system.get_job(job_id)['result'] == {"n": 1}
+
+
+def test_run_job_records_failure(eco_system, monkeypatch):
+    def explode(eco, payload):
+        raise ValueError("nope")
+    monkeypatch.setitem(worker.JOB_HANDLERS, "explode", explode)
+    job_id = eco_system.enqueue_job("explode", max_attempts=1)
+    worker.run_job(eco_system, eco_system.claim_job("w1"), "w1")
+    job = eco_system.get_job(job_id)
+    assert job['status'] == "FAILED" and "ValueError: nope" in job['last_error']
+
+
+def test_unknown_job_kind_fails(eco_system):
+    job_id = eco_system.enqueue_job("mystery", max_attempts=1)
+    worker.run_job(eco_system, eco_system.claim_job("w1"), "w1")
+    assert "No handler" in eco_system.get_job(job_id)['last_error']
+
+
+def test_generate_report_job(eco_system):
+    eco_id = eco_system.create_eco("Queued", "Desc", "user1")
+    job_id = eco_system.enqueue_job("generate_report", {"eco_id": eco_id})
+    worker.run_job(eco_system, eco_system.claim_job("w1"), "w1")
+    result = eco_system.get_job(job_id)['result']
+    # Stored in the blob store under the job's id, where any host can read it
+    assert result == {"blob_key": f".report-{job_id}.md", "filename": f"eco_{eco_id}_report.md"}
+    with open(eco_system.blob_store.local_path(result['blob_key']), encoding='utf-8') as f:
+        assert "# ECO Report: Queued" in f.read()
+
+
+def test_periodic_jobs_scheduled_once(eco_system):
+    worker.schedule_periodic_jobs(eco_system)
+    worker.schedule_periodic_jobs(eco_system)
+    with eco_system._connect() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'purge_tokens'").fetchone()[0]
+    assert count == 1
+
+
+@pytest.mark.sqlite_only
+def test_replica_refresh_scheduled_only_with_replica(eco_system, tmp_path):
+    assert "refresh_replica" not in [kind for kind, _ in worker.periodic_jobs(eco_system)]
+    eco_system.storage.replica_path = str(tmp_path / "replica.db")
+    worker.schedule_periodic_jobs(eco_system)
+    with eco_system._connect() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'refresh_replica'").fetchone()[0]
+    assert count == 1
+    assert worker.refresh_replica(eco_system, {}) == {"refreshed": True}
+    assert os.path.exists(eco_system.storage.replica_path)
+
+
+def test_concurrent_workers_run_each_job_once(eco_system, monkeypatch):
+    runs = []
+    lock = threading.Lock()
+
+    def record(eco, payload):
+        with lock:
+            runs.append(payload['i'])
+
+    monkeypatch.setitem(worker.JOB_HANDLERS, "record", record)
+    monkeypatch.setattr(worker, "PERIODIC_JOBS", [])
+    for i in range(20):
+        eco_system.enqueue_job("record", {"i": i})
+
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=worker.run_worker, args=(eco_system, f"w{n}", stop, 0.01))
+        for n in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for _ in range(500):
+        with eco_system._connect() as conn:
+            if conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'DONE'").fetchone()[0] == 20:
+                break
+        stop.wait(0.01)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert sorted(runs) == list(range(20))
+
+
+def test_purge_deleted_job(eco_system):
+    eco_id = eco_system.create_eco("Doomed", "Desc", "user1")
+    eco_system.delete_eco(eco_id)
+    job = eco_system.claim_job("w1")
+    assert job["kind"] == "purge_deleted"
+    worker.run_job(eco_system, job, "w1")
+    assert eco_system.get_job(job["id"])["result"] == {"ecos": 1, "files": 0, "users": 0}
+
+
+def test_long_job_keeps_its_lease(eco_system, monkeypatch):
+    monkeypatch.setattr(worker, "LEASE_RENEW_INTERVAL", 0.05)
+    stolen = []
+
+    def slow(eco, payload):
+        time.sleep(0.6)  # well past the initial lease
+        stolen.append(eco.claim_job("w2"))
+
+    monkeypatch.setitem(worker.JOB_HANDLERS, "slow", slow)
+    job_id = eco_system.enqueue_job("slow")
+    worker.run_job(eco_system, eco_system.claim_job("w1", lease_seconds=0.2), "w1")
+    assert stolen == [None]
+    assert eco_system.get_job(job_id)['status'] == "DONE"
+
+
+def test_purge_jobs_removes_old_finished_jobs(eco_system):
+    eco_id = eco_system.create_eco("Old", "Desc", "user1")
+    report_job = eco_system.enqueue_job("generate_report", {"eco_id": eco_id})
+    worker.run_job(eco_system, eco_system.claim_job("w1"), "w1")
+    report_key = eco_system.get_job(report_job)['result']['blob_key']
+    pending_job = eco_system.enqueue_job("generate_report", {"eco_id": eco_id})
+
+    assert worker.purge_jobs(eco_system, {}) == {"purged": 0, "files_removed": 0}
+    assert worker.purge_jobs(eco_system, {"retention": -1}) == {"purged": 1, "files_removed": 1}
+    assert eco_system.get_job(report_job) is None
+    assert not eco_system.blob_store.exists(report_key)
+    assert eco_system.get_job(pending_job)['status'] == "PENDING"
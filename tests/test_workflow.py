@@ -0,0 +1,200 @@
+import multiprocessing
+import random
+import threading
+
+import pytest
+
+from eco_manager import ECO
+from workflow import DEFAULT_WORKFLOW, TransitionRejected, Workflow
+
+REVIEW_WORKFLOW = {
+    "initial": "DRAFT",
+    "states": ["DRAFT", "IN_REVIEW", "SIGN_OFF", "APPROVED", "REJECTED"],
+    "transitions": [
+        {"action": "submit", "from": ["DRAFT", "REJECTED"], "to": "IN_REVIEW", "comment": "none"},
+        {"action": "review", "from": ["IN_REVIEW"], "to": "SIGN_OFF"},
+        {"action": "approve", "from": ["SIGN_OFF"], "to": "APPROVED"},
+        {"action": "reject", "from": ["IN_REVIEW", "SIGN_OFF"], "to": "REJECTED", "comment": "required"},
+    ],
+}
+
+
+@pytest.fixture
+def review_eco(tmp_path):
+    return ECO(db_path=str(tmp_path / "wf.db"), attachments_dir=str(tmp_path / "att"),
+               workflow=Workflow(REVIEW_WORKFLOW))
+
+
+def test_lookup_table():
+    wf = Workflow(REVIEW_WORKFLOW)
+    assert wf.next_state("reject", "SIGN_OFF") == "REJECTED"
+    assert wf.next_state("approve", "IN_REVIEW") is None
+    assert [t.action for t in wf.actions_from("IN_REVIEW")] == ["review", "reject"]
+    assert Workflow(wf.as_dict()).as_dict() == wf.as_dict()
+
+
+@pytest.mark.parametrize("change", [
+    {"initial": "NOPE"},
+    {"transitions": DEFAULT_WORKFLOW["transitions"] * 2},
+    {"transitions": [{"action": "x", "from": ["DRAFT"], "to": "LIMBO"}]},
+    {"transitions": [{"action": "x", "from": ["DRAFT"], "to": "SUBMITTED", "comment": "maybe"}]},
+])
+def test_invalid_definitions(change):
+    with pytest.raises(ValueError):
+        Workflow({**DEFAULT_WORKFLOW, **change})
+
+
+def test_multi_stage_review(review_eco):
+    eco_id = review_eco.create_eco("Staged", "Desc", "author")
+    assert review_eco.get_eco_details(eco_id)["status"] == "DRAFT"
+    assert not review_eco.transition(eco_id, "approve", "boss")
+    assert review_eco.transition(eco_id, "submit", "author")
+    assert review_eco.transition(eco_id, "review", "reviewer", "Looks fine")
+    assert not review_eco.transition(eco_id, "reject", "boss")  # Comment required
+    assert review_eco.transition(eco_id, "reject", "boss", "Missing drawing")
+    assert review_eco.transition(eco_id, "submit", "author")
+    details = review_eco.get_eco_details(eco_id)
+    assert details["status"] == "IN_REVIEW"
+    assert [h["action"] for h in details["history"]] == ["CREATED", "IN_REVIEW", "SIGN_OFF", "REJECTED", "IN_REVIEW"]
+    assert not review_eco.transition(eco_id, "no_such_action", "author")
+
+
+def test_hooks_run_in_the_transaction(review_eco):
+    calls = []
+
+    @review_eco.workflow.hook("review")
+    def record(cursor, eco_id, action, status, username, comment):
+        cursor.execute("SELECT status FROM ecos WHERE id = ?", (eco_id,))
+        calls.append((eco_id, action, status, username, cursor.fetchone()[0]))
+
+    @review_eco.workflow.hook("approve")
+    def veto(cursor, eco_id, action, status, username, comment):
+        raise TransitionRejected("sign-off needs two approvers")
+
+    eco_id = review_eco.create_eco("Hooked", "Desc", "author")
+    review_eco.transition(eco_id, "submit", "author")
+    assert review_eco.transition(eco_id, "review", "reviewer")
+    assert calls == [(eco_id, "review", "SIGN_OFF", "reviewer", "SIGN_OFF")]
+
+    assert not review_eco.transition(eco_id, "approve", "boss")
+    details = review_eco.get_eco_details(eco_id)
+    assert details["status"] == "SIGN_OFF"
+    assert details["history"][-1]["action"] == "SIGN_OFF"
+    assert review_eco.verify_audit_chain()["ok"]
+
+
+def test_concurrent_transitions_have_one_winner(eco_system):
+    eco_id = eco_system.create_eco("Race", "Desc", "author")
+    eco_system.submit_eco(eco_id, "author")
+    for name in ("approver", "rejecter"):
+        eco_system.get_or_create_user(name)
+    results = []
+    barrier = threading.Barrier(2)
+
+    def act(action, username):
+        barrier.wait()
+        results.append(eco_system.transition(eco_id, action, username, "comment"))
+
+    threads = [threading.Thread(target=act, args=("approve", "approver")),
+               threading.Thread(target=act, args=("reject", "rejecter"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False, True]
+    history = eco_system.get_eco_details(eco_id)["history"]
+    assert len([h for h in history if h["action"] in ("APPROVED", "REJECTED")]) == 1
+
+
+def test_quorum_of_named_approvers(eco_system):
+    for name in ("alice", "bob", "carol", "dave"):
+        eco_system.get_or_create_user(name)
+    eco_id = eco_system.create_eco("Board", "Desc", "author")
+    assert eco_system.set_approvers(eco_id, ["alice", "bob", "carol"], "admin", quorum=2) is True
+    assert eco_system.pending_approvals("alice") == []  # Not submitted yet
+    eco_system.submit_eco(eco_id, "author")
+    assert [e["id"] for e in eco_system.pending_approvals("alice")] == [eco_id]
+
+    assert eco_system.approve_eco(eco_id, "dave") is False  # Not an approver
+    assert eco_system.approve_eco(eco_id, "alice") is True
+    assert eco_system.approve_eco(eco_id, "alice") is False  # One vote each
+    assert eco_system.reject_eco(eco_id, "bob", "Not yet") is True
+    assert eco_system.current_status(eco_id) == "SUBMITTED"
+    assert eco_system.pending_approvals("alice") == []
+    assert [e["approvals"] for e in eco_system.pending_approvals("carol")] == [1]
+
+    assert eco_system.approve_eco(eco_id, "carol") is True
+    details = eco_system.get_eco_details(eco_id)
+    assert details["status"] == "APPROVED"
+    assert (details["quorum"], details["approvals"], details["rejections"]) == (2, 2, 1)
+    assert {a["username"]: a["decision"] for a in details["approvers"]} == {
+        "alice": "approve", "bob": "reject", "carol": "approve"}
+    assert [h["action"] for h in details["history"]][-3:] == ["APPROVAL_VOTE", "REJECTION_VOTE", "APPROVED"]
+    assert eco_system.pending_approvals("carol") == []
+    assert eco_system.set_approvers(eco_id, ["dave"], "admin") is False
+
+
+def test_rejected_once_quorum_is_unreachable(review_eco):
+    for name in ("alice", "bob"):
+        review_eco.get_or_create_user(name)
+    eco_id = review_eco.create_eco("Board", "Desc", "author")
+    review_eco.set_approvers(eco_id, ["alice", "bob"], "admin")
+    with pytest.raises(ValueError):
+        review_eco.set_approvers(eco_id, ["alice", "nobody"], "admin")
+    with pytest.raises(ValueError):
+        review_eco.set_approvers(eco_id, ["alice"], "admin", quorum=2)
+    review_eco.transition(eco_id, "submit", "author")
+    # Rejecting during review is an ordinary transition; sign-off starts at SIGN_OFF
+    assert review_eco.pending_approvals("alice") == []
+    review_eco.transition(eco_id, "review", "reviewer")
+    assert review_eco.transition(eco_id, "reject", "bob", "No") is True
+    assert review_eco.current_status(eco_id) == "REJECTED"
+    assert review_eco.pending_approvals("alice") == []
+
+    # Resubmitting starts a new round of votes
+    review_eco.transition(eco_id, "submit", "author")
+    review_eco.transition(eco_id, "review", "reviewer")
+    assert review_eco.transition(eco_id, "approve", "bob") is True
+    assert review_eco.current_status(eco_id) == "SIGN_OFF"
+    assert review_eco.transition(eco_id, "approve", "alice") is True
+    assert review_eco.current_status(eco_id) == "APPROVED"
+
+
+@pytest.mark.sqlite_only
+def test_pending_queue_uses_partial_index(eco_system):
+    with eco_system._connect() as conn:
+        plan = conn.execute("""
+            EXPLAIN QUERY PLAN SELECT eco_id FROM eco_approvers
+            WHERE user_id = ? AND pending = 1 AND eco_id > ? ORDER BY eco_id LIMIT 50
+        """, (1, 0)).fetchall()
+    assert any("idx_eco_approvers_pending" in row[3] for row in plan)
+
+
+def _act_on_all(db_path, attachments_dir, action, username, eco_ids):
+    # Runs in a separate process, like a second gunicorn worker
+    eco = ECO(db_path=db_path, attachments_dir=attachments_dir)
+    random.shuffle(eco_ids)
+    return [eco_id for eco_id in eco_ids if eco.transition(eco_id, action, username, "stress")]
+
+
+def test_transitions_from_many_processes_happen_exactly_once(tmp_path):
+    db_path, attachments_dir = str(tmp_path / "stress.db"), str(tmp_path / "att")
+    eco = ECO(db_path=db_path, attachments_dir=attachments_dir)
+    eco_ids = [eco.create_eco(f"ECO {i}", "Desc", "author") for i in range(40)]
+    for eco_id in eco_ids:
+        eco.submit_eco(eco_id, "author")
+    workers = [("approve", f"approver{i}") for i in range(3)] + [("reject", f"rejecter{i}") for i in range(3)]
+    for _, username in workers:
+        eco.get_or_create_user(username)
+
+    with multiprocessing.get_context("spawn").Pool(len(workers)) as pool:
+        won = pool.starmap(_act_on_all, [(db_path, attachments_dir, action, username, list(eco_ids))
+                                         for action, username in workers])
+
+    # Every ECO was moved by exactly one worker, and none failed on a lock
+    assert sorted(i for ids in won for i in ids) == eco_ids
+    for eco_id in eco_ids:
+        details = eco.get_eco_details(eco_id)
+        assert details["status"] in ("APPROVED", "REJECTED")
+        assert details["version"] == 3
+        assert len([h for h in details["history"] if h["action"] in ("APPROVED", "REJECTED")]) == 1
@@ -0,0 +1,214 @@
+"""Request tracing and the slow-query log.
+
+The API starts a ``Trace`` for every request. While it is active, calls to
+ECO methods and SQL statements are recorded as spans, so a slow request can
+be broken down into where its time went. SQL timing needs connections made
+with ``TracingConnection``; the storage backend uses it while
+``sql_tracing_enabled()`` is true, so there is no overhead when it is off.
+
+Configuration (environment):
+    SLOW_QUERY_MS   log statements slower than this, with their plan (0: off)
+    SERVER_TIMING   set to 1 to send a Server-Timing header with each response
+"""
+import contextvars
+import functools
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+slow_query_logger = logging.getLogger("eco.slow_query")
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+MAX_SPANS = 200  # per request; SQL totals keep counting past this
+MAX_REQUEST_ID_LENGTH = 64
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]+$")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class Trace:
+    """Spans recorded while handling one request."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+    def add_span(self, name: str, seconds: float) -> None:
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((name, seconds))
+
+    def add_sql(self, seconds: float) -> None:
+        self.sql_count += 1
+        self.sql_seconds += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: total, SQL, then each traced method (summed by name)."""
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        parts = [
+            f"total;dur={self.elapsed() * 1000:.1f}",
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"',
+        ]
+        parts += [f'{re.sub(r"[^A-Za-z0-9_-]", "_", name)};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("eco_trace", default=None)
+
+
+def request_id_from_header(value: Optional[str]) -> str:
+    """Reuse a caller's request id if it is safe to log and echo back, otherwise make one."""
+    if value and len(value) <= MAX_REQUEST_ID_LENGTH and _REQUEST_ID_RE.match(value):
+        return value
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id: str) -> Tuple[Trace, contextvars.Token]:
+    trace = Trace(request_id)
+    return trace, _current.set(trace)
+
+
+def end_trace(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - start)
+
+
+def trace_methods(cls):
+    """Class decorator recording a span for each public method call made during a request."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not callable(method):
+            continue
+
+        def wrap(method, span_name):
+            @functools.wraps(method)
+            def traced(*args, **kwargs):
+                trace = _current.get()
+                if trace is None:
+                    return method(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    trace.add_span(span_name, time.perf_counter() - start)
+            return traced
+
+        setattr(cls, name, wrap(method, f"{cls.__name__}.{name}"))
+    return cls
+
+
+def sql_tracing_enabled() -> bool:
+    return SLOW_QUERY_MS > 0 or SERVER_TIMING
+
+
+def _params_shape(params) -> str:
+    # Types only: parameter values can be passwords, tokens or personal data
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+def _record_sql(conn: sqlite3.Connection, sql: str, params, seconds: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_sql(seconds)
+    if SLOW_QUERY_MS <= 0 or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    statement = " ".join(sql.split())
+    plan = ""
+    if statement.upper().startswith(_EXPLAINABLE):
+        try:
+            rows = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            plan = "; ".join(row[3] for row in rows)
+        except sqlite3.Error:
+            plan = "(unavailable)"
+    slow_query_logger.warning(
+        "Slow query %.1f ms request=%s params=%s plan=[%s] sql=%s",
+        seconds * 1000, trace.request_id if trace else "-", _params_shape(params), plan, statement,
+    )
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that times statements and the fetches that step through their results.
+
+    The slow-query log judges a statement by its execute step, which is
+    where SQLite does the work for sorted, grouped or single-row queries.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(self.connection, sql, (), time.perf_counter() - start)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            trace = _current.get()
+            if trace is not None:
+                trace.sql_seconds += seconds
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        return self._timed_fetch(super().__next__)
+
+
+class TracingConnection(sqlite3.Connection):
+    """Connection whose cursors (including ``execute`` shortcuts) are TracingCursors."""
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_sql(self, "COMMIT", (), time.perf_counter() - start)
@@ -0,0 +1,247 @@
+"""Background job worker.
+
+Workers poll the ``jobs`` table, lease one job at a time and run the handler
+registered for its kind. Leases make it safe to run any number of workers --
+threads inside the API processes, or separate processes started with
+``python worker.py`` -- against the same database.
+"""
+import argparse
+import contextvars
+import datetime
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import maintenance
+from blobstore import blob_store_from_env
+import eco_manager
+from eco_manager import ECO
+from storage import storage_from_env
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0  # seconds between polls when the queue is empty
+SCHEDULE_INTERVAL = 60  # seconds between checks that periodic jobs are queued
+# Generated reports are blobs keyed by their job, so any API host can serve
+# them. Dot-keys are never attachment blobs, so the attachment GC leaves them alone.
+REPORT_KEY_PREFIX = ".report-"
+TOKEN_PURGE_INTERVAL = int(os.environ.get("TOKEN_PURGE_INTERVAL", 3600))  # seconds
+REPLICA_REFRESH_INTERVAL = int(os.environ.get("REPLICA_REFRESH_INTERVAL", 10))  # seconds
+MAINTENANCE_INTERVAL = int(os.environ.get("MAINTENANCE_INTERVAL", 86400))  # seconds
+BACKUP_DIR = os.environ.get("BACKUP_DIR") or None
+ATTACHMENT_GC_INTERVAL = int(os.environ.get("ATTACHMENT_GC_INTERVAL", 3600))  # seconds
+ATTACHMENT_GC_BLOBS_PER_RUN = 10000  # each run resumes where the last one stopped
+ATTACHMENT_SCRUB_INTERVAL = int(os.environ.get("ATTACHMENT_SCRUB_INTERVAL", 3600))  # seconds
+ATTACHMENT_SCRUB_PER_RUN = 1000  # attachments verified per run; each run resumes where the last one stopped
+PURGE_DELETED_INTERVAL = int(os.environ.get("PURGE_DELETED_INTERVAL", 3600))  # seconds
+JOB_PURGE_INTERVAL = int(os.environ.get("JOB_PURGE_INTERVAL", 3600))  # seconds
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", eco_manager.JOB_RETENTION))  # seconds
+# A running job's lease is renewed this often, so long jobs are never taken
+# over by another worker while their handler is still going
+LEASE_RENEW_INTERVAL = eco_manager.JOB_LEASE_SECONDS / 3
+
+JobHandler = Callable[[ECO, dict], Optional[dict]]
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+_current_job_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("eco_job_id", default=None)
+
+# (kind, interval in seconds) for jobs every worker keeps scheduled
+PERIODIC_JOBS: List[Tuple[str, int]] = [
+    ("purge_tokens", TOKEN_PURGE_INTERVAL),
+    ("refresh_replica", REPLICA_REFRESH_INTERVAL),
+    ("maintenance", MAINTENANCE_INTERVAL),
+    ("attachment_gc", ATTACHMENT_GC_INTERVAL),
+    ("attachment_scrub", ATTACHMENT_SCRUB_INTERVAL),
+    # Deletes queue a purge straight away; this catches any that failed
+    ("purge_deleted", PURGE_DELETED_INTERVAL),
+    ("purge_jobs", JOB_PURGE_INTERVAL),
+]
+
+
+def job_handler(kind: str) -> Callable[[JobHandler], JobHandler]:
+    def register(func: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+@job_handler("purge_tokens")
+def purge_tokens(eco: ECO, payload: dict) -> dict:
+    return {"purged": eco.purge_expired_tokens()}
+
+
+@job_handler("purge_deleted")
+def purge_deleted(eco: ECO, payload: dict) -> dict:
+    return eco.purge_deleted()
+
+
+@job_handler("purge_jobs")
+def purge_jobs(eco: ECO, payload: dict) -> dict:
+    purged, blob_keys = eco.purge_finished_jobs(payload.get("retention", JOB_RETENTION))
+    removed = 0
+    for key in blob_keys:
+        try:
+            eco.blob_store.delete(key)
+            removed += 1
+        except OSError:
+            logger.warning("Could not remove job output '%s'", key)
+    return {"purged": purged, "files_removed": removed}
+
+
+@job_handler("generate_report")
+def generate_report(eco: ECO, payload: dict) -> dict:
+    eco_id = payload["eco_id"]
+    filename = f"eco_{eco_id}_report.md"
+    blob_key = f"{REPORT_KEY_PREFIX}{current_job_id()}.md"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = os.path.join(tmp_dir, filename)
+        if not eco.generate_report(eco_id, output_file):
+            raise RuntimeError(f"Failed to generate report for ECO {eco_id}")
+        eco.blob_store.put_file(blob_key, output_file)
+    return {"blob_key": blob_key, "filename": filename}
+
+
+@job_handler("attachment_preview")
+def attachment_preview(eco: ECO, payload: dict) -> dict:
+    return {"created": eco.create_attachment_preview(payload["sha256"])}
+
+
+@job_handler("refresh_replica")
+def refresh_replica(eco: ECO, payload: dict) -> dict:
+    return {"refreshed": eco.storage.refresh_replica()}
+
+
+@job_handler("maintenance")
+def run_maintenance(eco: ECO, payload: dict) -> dict:
+    return maintenance.run_maintenance(eco, backup_dir=payload.get("backup_dir", BACKUP_DIR))
+
+
+@job_handler("attachment_gc")
+def attachment_gc(eco: ECO, payload: dict) -> dict:
+    return maintenance.collect_garbage(eco, delete=True, limit=payload.get("limit", ATTACHMENT_GC_BLOBS_PER_RUN))
+
+
+@job_handler("attachment_scrub")
+def attachment_scrub(eco: ECO, payload: dict) -> dict:
+    return maintenance.scrub_attachments(eco, limit=payload.get("limit", ATTACHMENT_SCRUB_PER_RUN))
+
+
+def periodic_jobs(eco: ECO) -> List[Tuple[str, int]]:
+    """The entries of PERIODIC_JOBS that apply to this deployment."""
+    return [
+        (kind, interval) for kind, interval in PERIODIC_JOBS
+        if kind != "refresh_replica" or eco.storage.replica_path
+    ]
+
+
+def schedule_periodic_jobs(eco: ECO) -> None:
+    now = datetime.datetime.now()
+    for kind, interval in periodic_jobs(eco):
+        # The dedupe key keeps exactly one instance queued across all workers
+        eco.enqueue_job(kind, run_at=now + datetime.timedelta(seconds=interval), dedupe_key=f"periodic:{kind}")
+
+
+def _renew_lease(eco: ECO, job: dict, worker_id: str, done: threading.Event) -> None:
+    while not done.wait(LEASE_RENEW_INTERVAL):
+        try:
+            if not eco.extend_job_lease(job['id'], worker_id):
+                logger.warning("Job %d (%s) lost its lease while running", job['id'], job['kind'])
+                return
+        except sqlite3.Error:
+            logger.exception("Could not renew the lease on job %d", job['id'])
+
+
+def current_job_id() -> Optional[int]:
+    """Id of the job whose handler is running, for naming what it stores."""
+    return _current_job_id.get()
+
+
+def run_job(eco: ECO, job: dict, worker_id: str) -> None:
+    handler = JOB_HANDLERS.get(job['kind'])
+    if handler is None:
+        eco.fail_job(job['id'], worker_id, f"No handler for job kind '{job['kind']}'")
+        return
+    if job['attempts'] > job['max_attempts']:
+        # Leased repeatedly by workers that died mid-run
+        eco.fail_job(job['id'], worker_id, "Lease expired on every attempt")
+        return
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_renew_lease, args=(eco, job, worker_id, done), daemon=True)
+    heartbeat.start()
+    token = _current_job_id.set(job['id'])
+    try:
+        result = handler(eco, job['payload'])
+    except Exception:
+        logger.exception("Job %d (%s) failed", job['id'], job['kind'])
+        eco.fail_job(job['id'], worker_id, traceback.format_exc(limit=5))
+        return
+    finally:
+        _current_job_id.reset(token)
+        done.set()
+        heartbeat.join()
+    if not eco.complete_job(job['id'], worker_id, result):
+        logger.warning("Job %d (%s) finished after its lease was taken over", job['id'], job['kind'])
+
+
+def run_worker(
+    eco: ECO,
+    worker_id: Optional[str] = None,
+    stop: Optional[threading.Event] = None,
+    poll_interval: float = POLL_INTERVAL,
+) -> None:
+    """Process jobs until ``stop`` is set."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    stop = stop or threading.Event()
+    logger.info("Job worker %s started", worker_id)
+    # Check at least as often as the most frequent periodic job runs
+    schedule_interval = min([SCHEDULE_INTERVAL] + [interval for _, interval in periodic_jobs(eco)])
+    next_schedule = 0.0
+    while not stop.is_set():
+        try:
+            if time.monotonic() >= next_schedule:
+                schedule_periodic_jobs(eco)
+                next_schedule = time.monotonic() + schedule_interval
+            job = eco.claim_job(worker_id)
+        except sqlite3.Error:
+            logger.exception("Job worker %s could not poll the queue", worker_id)
+            job = None
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        run_job(eco, job, worker_id)
+
+
+def _worker_process(attachments_dir: str) -> None:  # pragma: no cover
+    logging.basicConfig(level=logging.INFO)
+    eco = ECO(
+        storage=storage_from_env(),
+        attachments_dir=attachments_dir,
+        blob_store=blob_store_from_env(attachments_dir),
+        token_secret=os.environ.get("TOKEN_SECRET"),
+    )
+    try:
+        run_worker(eco)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Run ECO Manager background job workers")
+    parser.add_argument("-n", "--processes", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    attachments_dir = os.environ.get("ATTACHMENTS_DIR", "attachments")
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(attachments_dir,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
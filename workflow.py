@@ -0,0 +1,139 @@
+"""ECO workflow: the states an ECO moves through and the actions that move it.
+
+A workflow is plain data: states plus transitions, each taking an ECO from one
+of its ``from`` states to its ``to`` state. It is loaded and compiled into
+lookup tables once per process. ``ECO.transition`` applies an action with a
+single conditional UPDATE, so two users acting on the same ECO at once cannot
+both succeed.
+
+The built-in workflow is draft -> submitted -> approved/rejected. Set
+WORKFLOW_FILE to a JSON file of the same shape as ``DEFAULT_WORKFLOW`` to use
+another, for example one with several review stages.
+
+Hooks run inside the transition's transaction, after the status change:
+
+    @workflow.hook("approve")
+    def notify(cursor, eco_id, action, status, username, comment):
+        ...
+
+A hook raising ``TransitionRejected`` cancels the transition; any other
+exception rolls it back and propagates.
+
+An ECO can name the users who must sign it off. While it is in an
+approval state (one the ``approve`` action starts from), ``approve`` and
+``reject`` by those users are counted as votes, and only the vote that
+reaches the ECO's quorum -- or makes it unreachable -- changes its status.
+"""
+import json
+import os
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+COMMENT_NONE = "none"
+COMMENT_OPTIONAL = "optional"
+COMMENT_REQUIRED = "required"
+
+# Actions counted as sign-off votes on ECOs that name their approvers
+APPROVE = "approve"
+REJECT = "reject"
+
+DEFAULT_WORKFLOW = {
+    "initial": "DRAFT",
+    "states": ["DRAFT", "SUBMITTED", "APPROVED", "REJECTED"],
+    "transitions": [
+        {"action": "submit", "label": "Submit for Approval", "from": ["DRAFT"], "to": "SUBMITTED",
+         "comment": COMMENT_NONE},
+        {"action": "approve", "label": "Approve", "from": ["SUBMITTED"], "to": "APPROVED"},
+        {"action": "reject", "label": "Reject", "from": ["SUBMITTED"], "to": "REJECTED",
+         "comment": COMMENT_REQUIRED},
+    ],
+}
+
+Hook = Callable[..., None]
+
+
+class TransitionRejected(Exception):
+    """Raised by a hook to cancel a transition."""
+
+
+class Transition(NamedTuple):
+    action: str
+    label: str
+    sources: Tuple[str, ...]
+    target: str
+    comment: str
+
+
+class Workflow:
+    """A compiled workflow definition."""
+
+    def __init__(self, definition: dict):
+        self.initial: str = definition["initial"]
+        self.states: List[str] = list(definition["states"])
+        self.transitions: Dict[str, Transition] = {}
+        self._next: Dict[Tuple[str, str], str] = {}  # (action, from state) -> to state
+        self._hooks: Dict[str, List[Hook]] = {}
+        for spec in definition["transitions"]:
+            transition = Transition(
+                action=spec["action"],
+                label=spec.get("label", spec["action"].replace("_", " ").title()),
+                sources=tuple(spec["from"]),
+                target=spec["to"],
+                comment=spec.get("comment", COMMENT_OPTIONAL),
+            )
+            self._validate(transition)
+            self.transitions[transition.action] = transition
+            for source in transition.sources:
+                self._next[(transition.action, source)] = transition.target
+        if self.initial not in self.states:
+            raise ValueError(f"Initial state '{self.initial}' is not a workflow state")
+        # States in which an ECO waits for its approvers
+        approve = self.transitions.get(APPROVE)
+        self.approval_states: Tuple[str, ...] = approve.sources if approve else ()
+
+    def _validate(self, transition: Transition) -> None:
+        if transition.action in self.transitions:
+            raise ValueError(f"Duplicate workflow action '{transition.action}'")
+        unknown = [s for s in transition.sources + (transition.target,) if s not in self.states]
+        if unknown:
+            raise ValueError(f"Action '{transition.action}' uses unknown states {unknown}")
+        if transition.comment not in (COMMENT_NONE, COMMENT_OPTIONAL, COMMENT_REQUIRED):
+            raise ValueError(f"Action '{transition.action}' has an invalid comment setting")
+
+    def next_state(self, action: str, status: str) -> Optional[str]:
+        """State ``action`` leads to from ``status``, or None if it is not allowed there."""
+        return self._next.get((action, status))
+
+    def actions_from(self, status: str) -> List[Transition]:
+        return [t for t in self.transitions.values() if status in t.sources]
+
+    def hook(self, action: str) -> Callable[[Hook], Hook]:
+        """Decorator registering a hook for ``action``."""
+        if action not in self.transitions:
+            raise ValueError(f"Unknown workflow action '{action}'")
+
+        def register(fn: Hook) -> Hook:
+            self._hooks.setdefault(action, []).append(fn)
+            return fn
+        return register
+
+    def hooks(self, action: str) -> List[Hook]:
+        return self._hooks.get(action, [])
+
+    def as_dict(self) -> dict:
+        return {
+            "initial": self.initial,
+            "states": self.states,
+            "transitions": [
+                {"action": t.action, "label": t.label, "from": list(t.sources), "to": t.target, "comment": t.comment}
+                for t in self.transitions.values()
+            ],
+        }
+
+
+def workflow_from_env() -> Workflow:
+    """Workflow from the JSON file named by WORKFLOW_FILE, or the built-in one."""
+    path = os.environ.get("WORKFLOW_FILE")
+    if not path:
+        return Workflow(DEFAULT_WORKFLOW)
+    with open(path, encoding="utf-8") as f:
+        return Workflow(json.load(f))